@@ -0,0 +1,230 @@
+import binascii
+import hashlib
+import json
+import mimetypes
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 解码后的内联数据替换为该前缀加内容哈希，释放请求中的 base64 字符串
+ATTACHMENT_REF_PREFIX = "attachment:"
+
+# 每次解码的 base64 字符数，须为 4 的倍数
+DECODE_CHUNK_CHARS = 64 * 1024
+
+
+class AttachmentError(Exception):
+    """附件无法处理，status_code 为返回给客户端的状态码"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class Attachment:
+    """一个解码后的附件，按内容哈希去重"""
+
+    __slots__ = ("sha256", "content_type", "file_name", "data")
+
+    def __init__(self, sha256: str, content_type: str, file_name: str, data: bytes):
+        self.sha256 = sha256
+        self.content_type = content_type
+        self.file_name = file_name
+        self.data = data
+
+
+class AttachmentCache:
+    """已上传附件的 LRU 表：(账户, 内容哈希) -> 上游附件描述，重复的图片不再上传"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: Dict[str, Any]):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def decode_base64(
+    text: str, max_bytes: int, start: int = 0
+) -> Tuple[bytes, str]:
+    """从 text[start:] 分块解码 base64，同时计算 SHA-256，返回 (数据, 十六进制哈希)
+
+    解码前按长度估算大小，超出 max_bytes 直接拒绝；分块解码不复制整段 base64 字符串。
+    """
+    length = len(text) - start
+    if max_bytes > 0 and (length // 4) * 3 - 2 > max_bytes:
+        raise AttachmentError(
+            f"Attachment exceeds the {max_bytes} byte limit.", status_code=413
+        )
+
+    digest = hashlib.sha256()
+    data = bytearray()
+    try:
+        for offset in range(start, len(text), DECODE_CHUNK_CHARS):
+            piece = binascii.a2b_base64(text[offset : offset + DECODE_CHUNK_CHARS])
+            digest.update(piece)
+            data += piece
+    except (binascii.Error, ValueError):
+        # 带换行等空白的 base64 无法按固定长度切分，去掉空白后整体解码
+        try:
+            piece = binascii.a2b_base64("".join(text[start:].split()))
+        except (binascii.Error, ValueError):
+            raise AttachmentError("Attachment is not valid base64 data.")
+        digest = hashlib.sha256(piece)
+        data = bytearray(piece)
+    if max_bytes > 0 and len(data) > max_bytes:
+        raise AttachmentError(
+            f"Attachment exceeds the {max_bytes} byte limit.", status_code=413
+        )
+    return bytes(data), digest.hexdigest()
+
+
+def _inline_source(part: Dict[str, Any]) -> Optional[Tuple[Dict[str, Any], str, str, str]]:
+    """返回内联附件的 (所在字典, 字段名, 默认类型, 文件名)，非内联附件返回 None"""
+    kind = part.get("type")
+    if kind == "image_url":
+        holder = part.get("image_url")
+        if isinstance(holder, str):
+            part["image_url"] = holder = {"url": holder}
+        if isinstance(holder, dict) and isinstance(holder.get("url"), str):
+            return holder, "url", "image/png", ""
+    elif kind == "input_audio":
+        holder = part.get("input_audio")
+        if isinstance(holder, dict) and isinstance(holder.get("data"), str):
+            return holder, "data", f"audio/{holder.get('format') or 'wav'}", ""
+    elif kind == "file":
+        holder = part.get("file")
+        if isinstance(holder, dict) and isinstance(holder.get("file_data"), str):
+            file_name = holder.get("filename") or ""
+            content_type = mimetypes.guess_type(file_name)[0] if file_name else None
+            return holder, "file_data", content_type or "application/octet-stream", file_name
+    return None
+
+
+def is_inline(part: Dict[str, Any]) -> bool:
+    """内容片段是否为内联数据（data URL、base64 或已解码的引用），远程 URL 不算"""
+    source = _inline_source(part) if isinstance(part, dict) else None
+    if source is None:
+        return False
+    holder, field, _, _ = source
+    value = holder[field]
+    if part.get("type") == "image_url":
+        return value.startswith(("data:", ATTACHMENT_REF_PREFIX))
+    return True
+
+
+def content_text(parts: List[Any]) -> str:
+    """列表形式 content 的文本：拼接文本片段，内联附件不计入，远程图片保留 URL"""
+    texts = []
+    for part in parts:
+        if not isinstance(part, dict):
+            texts.append(json.dumps(part))
+        elif part.get("type") == "text":
+            texts.append(str(part.get("text", "")))
+        elif is_inline(part):
+            continue
+        elif part.get("type") == "image_url" and _inline_source(part):
+            texts.append(part["image_url"]["url"])
+        else:
+            texts.append(json.dumps(part))
+    return "\n".join(texts)
+
+
+def decode_attachments(
+    contents: Iterable[Any],
+    max_bytes: int,
+    max_count: int,
+    allowed_types: Optional[List[str]] = None,
+) -> "OrderedDict[str, Attachment]":
+    """解码所有消息中的内联附件，按内容哈希去重
+
+    解码后的字段替换为 attachment:<sha256> 引用，之后可用 attachment_refs 找回附件；
+    客户端直接发来的引用返回 400，每个请求的内容只解码一次。
+    allowed_types 为 None 时不检查类型，支持 image/* 形式的通配。
+    """
+    attachments: "OrderedDict[str, Attachment]" = OrderedDict()
+    for content in contents:
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            if not isinstance(part, dict):
+                continue
+            if part.get("type") == "image_url" and _inline_source(part) is None:
+                raise AttachmentError(
+                    "image_url content parts need an image_url.url string."
+                )
+            if not is_inline(part):
+                continue
+            holder, field, content_type, file_name = _inline_source(part)
+            value = holder[field]
+            if value.startswith(ATTACHMENT_REF_PREFIX):
+                # 引用只由解码生成，客户端发来的引用没有对应的附件
+                raise AttachmentError(
+                    f"Content parts cannot use {ATTACHMENT_REF_PREFIX} references."
+                )
+
+            start = 0
+            if value.startswith("data:"):
+                comma = value.find(",")
+                header = value[5:comma] if comma >= 0 else ""
+                if ";base64" not in header:
+                    raise AttachmentError("Only base64 data URLs are supported.")
+                content_type = header.split(";", 1)[0] or content_type
+                start = comma + 1
+            check_type(content_type, allowed_types)
+
+            data, sha256 = decode_base64(value, max_bytes, start)
+            holder[field] = ATTACHMENT_REF_PREFIX + sha256
+            if sha256 in attachments:
+                continue
+            if max_count > 0 and len(attachments) >= max_count:
+                raise AttachmentError(
+                    f"Too many attachments, the limit is {max_count}.", status_code=413
+                )
+            if not file_name:
+                extension = mimetypes.guess_extension(content_type) or ".bin"
+                file_name = f"{sha256[:16]}{extension}"
+            attachments[sha256] = Attachment(sha256, content_type, file_name, data)
+    return attachments
+
+
+def check_type(content_type: str, allowed_types: Optional[List[str]]):
+    if allowed_types is None:
+        return
+    major = content_type.split("/", 1)[0]
+    if content_type not in allowed_types and f"{major}/*" not in allowed_types:
+        if not allowed_types:
+            raise AttachmentError("This model does not accept attachments.")
+        raise AttachmentError(
+            f"Attachment type {content_type} is not supported by this model."
+        )
+
+
+def attachment_refs(contents: Iterable[Any]) -> List[str]:
+    """按出现顺序列出消息中引用的附件哈希（去重）"""
+    refs: Dict[str, None] = {}
+    for content in contents:
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            if not isinstance(part, dict) or not is_inline(part):
+                continue
+            holder, field, _, _ = _inline_source(part)
+            value = holder[field]
+            if value.startswith(ATTACHMENT_REF_PREFIX):
+                refs[value[len(ATTACHMENT_REF_PREFIX) :]] = None
+    return list(refs)
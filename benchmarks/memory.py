@@ -0,0 +1,115 @@
+"""账户和流状态的内存占用基准
+
+用法: python benchmarks/memory.py [--streams 10000] [--accounts 10000]
+
+模拟大量同时存活的流：每个流读到一半挂起，统计每个流和每个账户的平均常驻内存。
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yyapi  # noqa: E402
+
+
+def fake_lines(chunks: int = 20):
+    """构造一段 Yupp 流式响应：左右两路流，选中左路"""
+    lines = [
+        b"1:" + json.dumps({"leftStream": {"next": "$@10"}, "rightStream": {"next": "$@900"}}).encode(),
+        b"e:" + json.dumps({"modelSelections": [{"selectionSource": "USER_SELECTED"}, {"selectionSource": "RANDOM"}]}).encode(),
+    ]
+    for i in range(chunks):
+        text = f"token {i} of a reasonably sized streamed answer. "
+        lines.append(
+            f"{10 + i}:".encode()
+            + json.dumps({"curr": text, "next": f"$@{11 + i}"}).encode()
+        )
+    return lines
+
+
+def measure(label: str, count: int, build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objects = build(count)
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    print(f"{label:<40} {count:>7}  {total / 1024 / 1024:8.2f} MiB  {total / count:8.0f} B each")
+    return objects
+
+
+def build_accounts(count: int):
+    return [yyapi.YuppAccount(f"token-{i:08d}") for i in range(count)]
+
+
+def build_account_dicts(count: int):
+    # 改为 __slots__ 之前的 TypedDict 形式，作为对照
+    return [
+        {
+            "token": f"token-{i:08d}",
+            "is_valid": True,
+            "last_used": 0.0,
+            "error_count": 0,
+            "in_flight": 0,
+            "draining": False,
+        }
+        for i in range(count)
+    ]
+
+
+def build_streams(count: int, keep_text: bool, advance: int = 12):
+    account = yyapi.YuppAccount("token-bench")
+    lines = fake_lines()
+    on_complete = (lambda entry: None) if keep_text else None
+    streams = []
+    for _ in range(count):
+        stream = yyapi.yupp_stream_generator(
+            iter(lines), "bench-model", account, on_complete=on_complete
+        )
+        # 推进到流的中途挂起，模拟正在输出的并发流
+        for _ in range(advance):
+            next(stream)
+        streams.append(stream)
+    return streams
+
+
+def drain(streams):
+    # 生成器在 finally 中还会输出结束块，读完而不是 close()
+    for stream in streams:
+        for _ in stream:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=10000)
+    parser.add_argument("--accounts", type=int, default=10000)
+    args = parser.parse_args()
+
+    yyapi.DEBUG_MODE = False
+    print(f"{'case':<40} {'count':>7}  {'total':>12}  {'per object':>15}")
+    measure("accounts (slotted YuppAccount)", args.accounts, build_accounts)
+    measure("accounts (dict, previous layout)", args.accounts, build_account_dicts)
+    streams = measure(
+        "streams mid-flight (counters only)",
+        args.streams,
+        lambda n: build_streams(n, keep_text=False),
+    )
+    drain(streams)
+    del streams
+    streams = measure(
+        "streams mid-flight (text kept for cache)",
+        args.streams,
+        lambda n: build_streams(n, keep_text=True),
+    )
+    drain(streams)
+
+
+if __name__ == "__main__":
+    main()
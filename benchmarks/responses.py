@@ -0,0 +1,120 @@
+"""响应序列化与压缩基准：每个响应的字节数和 CPU 耗时
+
+用法: python benchmarks/responses.py [--iterations 200] [--models 500] [--answer-chars 20000]
+
+对比非流式补全和模型列表的三种序列化方式：
+FastAPI 默认的 jsonable_encoder + JSONResponse、按 response_model 校验后再编码，以及 ModelJSONResponse；
+并给出原始、gzip 和 zstd（安装了 zstandard 时）的响应大小与压缩耗时。
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+import responses  # noqa: E402
+import yyapi  # noqa: E402
+
+
+def build_completion(answer_chars: int) -> yyapi.ChatCompletionResponse:
+    sentence = "这是一段较长的回答 with mixed English text and code `x = y + 1`. "
+    content = (sentence * (answer_chars // len(sentence) + 1))[:answer_chars]
+    return yyapi.ChatCompletionResponse(
+        model="bench-model",
+        choices=[
+            yyapi.ChatCompletionChoice(
+                message=yyapi.ChatMessage(
+                    role="assistant",
+                    content=content,
+                    reasoning_content="Thinking about the question. " * 40,
+                )
+            )
+        ],
+        usage={"prompt_tokens": 1200, "completion_tokens": 5000, "total_tokens": 6200},
+    )
+
+
+def build_models(count: int) -> yyapi.ModelList:
+    return yyapi.ModelList(
+        data=[
+            yyapi.ModelInfo(
+                id=f"publisher-{i % 20}/model-{i:04d}-preview",
+                created=1700000000,
+                owned_by=f"publisher-{i % 20}",
+            )
+            for i in range(count)
+        ]
+    )
+
+
+def default_render(model) -> bytes:
+    # 没有 response_model 时 FastAPI 的做法
+    return JSONResponse(jsonable_encoder(model)).body
+
+
+def validated_render(model) -> bytes:
+    # 有 response_model 时：先按模型重新校验，再 jsonable_encoder
+    validated = type(model).model_validate(model.model_dump())
+    return JSONResponse(jsonable_encoder(validated)).body
+
+
+def fast_render(model) -> bytes:
+    return responses.ModelJSONResponse(model).body
+
+
+def per_call(func, iterations: int) -> float:
+    """单次调用的 CPU 耗时（微秒）"""
+    func()
+    start = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def report(label: str, model, iterations: int):
+    print(f"\n{label}")
+    print(f"  {'serializer':<34} {'bytes':>9}  {'cpu/resp':>12}")
+    body = b""
+    for name, render in (
+        ("jsonable_encoder + JSONResponse", default_render),
+        ("response_model validate + encode", validated_render),
+        ("ModelJSONResponse", fast_render),
+    ):
+        body = render(model)
+        cost = per_call(lambda: render(model), iterations)
+        print(f"  {name:<34} {len(body):>9}  {cost:>9.1f} us")
+
+    print(f"  {'encoding':<34} {'bytes':>9}  {'cpu/resp':>12}  {'ratio':>6}")
+    encodings = responses.available_encodings(("gzip", "zstd"))
+    for encoding in encodings:
+        compressed = responses.compress(body, encoding)
+        cost = per_call(lambda: responses.compress(body, encoding), iterations)
+        print(
+            f"  {encoding:<34} {len(compressed):>9}  {cost:>9.1f} us"
+            f"  {len(compressed) / len(body):>6.2f}"
+        )
+    if "zstd" not in encodings:
+        print("  zstd                               (zstandard not installed)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--models", type=int, default=500)
+    parser.add_argument("--answer-chars", type=int, default=20000)
+    args = parser.parse_args()
+
+    report(
+        f"chat completion ({args.answer_chars} character answer)",
+        build_completion(args.answer_chars),
+        args.iterations,
+    )
+    report(f"model list ({args.models} models)", build_models(args.models), args.iterations)
+
+
+if __name__ == "__main__":
+    main()
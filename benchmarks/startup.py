@@ -0,0 +1,97 @@
+"""冷启动基准：模块导入耗时，以及进程启动到 /healthz、/readyz 可用的耗时
+
+用法: python benchmarks/startup.py [--runs 5] [--port 18765]
+
+未设置 MODEL_FILE 时使用临时的单模型快照，YUPP_TOKENS / CLIENT_API_KEYS 未设置时使用占位值，
+不会访问 Yupp。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_time(env) -> float:
+    code = "import time; t = time.perf_counter(); import yyapi; print(time.perf_counter() - t)"
+    output = subprocess.check_output(
+        [sys.executable, "-c", code], cwd=ROOT, env=env, text=True
+    )
+    return float(output.strip().splitlines()[-1])
+
+
+def probe(url: str) -> bool:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status == 200
+    except (urllib.error.URLError, ConnectionError, OSError):
+        return False
+
+
+def ready_time(env, port: int, timeout: float = 60):
+    """启动服务，返回 (存活耗时, 就绪耗时)，单位秒"""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-c", "from yyapi import main; main()"],
+        cwd=ROOT,
+        env={**env, "PORT": str(port), "HOST": "127.0.0.1"},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    live = ready = None
+    try:
+        while time.perf_counter() - start < timeout:
+            if live is None and probe(f"http://127.0.0.1:{port}/healthz"):
+                live = time.perf_counter() - start
+            if live is not None and probe(f"http://127.0.0.1:{port}/readyz"):
+                ready = time.perf_counter() - start
+                break
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return live, ready
+
+
+def summary(values) -> str:
+    values = [v for v in values if v is not None]
+    if not values:
+        return "n/a"
+    return f"median {statistics.median(values) * 1000:7.1f} ms  min {min(values) * 1000:7.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=18765)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault("YUPP_TOKENS", "bench-token")
+    env.setdefault("CLIENT_API_KEYS", "bench-key")
+    env["SHUTDOWN_GRACE_PERIOD"] = "0"
+    if not env.get("MODEL_FILE"):
+        snapshot = tempfile.NamedTemporaryFile(
+            "w", suffix=".json", delete=False, encoding="utf-8"
+        )
+        json.dump([{"label": "bench", "name": "bench", "publisher": "bench"}], snapshot)
+        snapshot.close()
+        env["MODEL_FILE"] = snapshot.name
+
+    imports = [import_time(env) for _ in range(args.runs)]
+    starts = [ready_time(env, args.port) for _ in range(args.runs)]
+
+    print(f"import yyapi      {summary(imports)}")
+    print(f"process -> live   {summary([live for live, _ in starts])}")
+    print(f"process -> ready  {summary([ready for _, ready in starts])}")
+
+
+if __name__ == "__main__":
+    main()
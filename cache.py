@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class CompletionCache:
+    """完成结果缓存：内存 LRU + 可选磁盘层，均按 TTL 过期并按大小淘汰"""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 3600,
+        disk_dir: Optional[str] = None,
+        disk_max_bytes: int = 512 * 1024 * 1024,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        # key -> (写入时间, 序列化后的 JSON, UTF-8 字节数)
+        self._memory: "OrderedDict[str, Tuple[float, str, int]]" = OrderedDict()
+        self._memory_bytes = 0
+        # key -> 文件大小，按写入顺序排列，用于磁盘层淘汰
+        self._disk_index: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    @staticmethod
+    def make_key(model: str, prompt: str) -> str:
+        """以模型标签和规范化后的提示词生成缓存键"""
+        normalized = "\n".join(line.rstrip() for line in prompt.strip().splitlines())
+        digest = hashlib.sha256()
+        digest.update(model.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(normalized.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _load_disk_index(self):
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.disk_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk_index[key] = size
+            self._disk_bytes += size
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        """读取缓存，返回 (条目, 字节数)，未命中或已过期返回 None"""
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                stored_at, raw, size = item
+                if now - stored_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    return json.loads(raw), size
+                self._remove_memory(key)
+
+        if not self.disk_dir or key not in self._disk_index:
+            return None
+
+        path = self._disk_path(key)
+        try:
+            if now - os.path.getmtime(path) > self.ttl:
+                self._remove_disk(key)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                raw = f.read()
+            entry = json.loads(raw)
+        except (OSError, ValueError):
+            self._remove_disk(key)
+            return None
+
+        # 磁盘命中提升到内存层
+        size = len(raw.encode("utf-8"))
+        with self._lock:
+            self._put_memory(key, raw, size, os.path.getmtime(path))
+        return entry, size
+
+    def put(self, key: str, entry: Dict[str, Any]):
+        """写入缓存"""
+        raw = json.dumps(entry, ensure_ascii=False)
+        size = len(raw.encode("utf-8"))
+        with self._lock:
+            self._put_memory(key, raw, size, time.time())
+        if self.disk_dir:
+            self._put_disk(key, raw, size)
+
+    def _put_memory(self, key: str, raw: str, size: int, stored_at: float):
+        if size > self.max_bytes:
+            return
+        self._remove_memory(key)
+        self._memory[key] = (stored_at, raw, size)
+        self._memory_bytes += size
+        while self._memory and (
+            len(self._memory) > self.max_entries or self._memory_bytes > self.max_bytes
+        ):
+            _, (_, _, evicted_size) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_size
+
+    def _remove_memory(self, key: str):
+        item = self._memory.pop(key, None)
+        if item is not None:
+            self._memory_bytes -= item[2]
+
+    def _put_disk(self, key: str, raw: str, size: int):
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(raw)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Failed to write completion cache entry: {e}")
+            return
+
+        with self._lock:
+            self._disk_bytes -= self._disk_index.pop(key, 0)
+            self._disk_index[key] = size
+            self._disk_bytes += size
+            evicted = []
+            while self._disk_index and self._disk_bytes > self.disk_max_bytes:
+                old_key, old_size = self._disk_index.popitem(last=False)
+                self._disk_bytes -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._disk_path(old_key))
+            except OSError:
+                pass
+
+    def _remove_disk(self, key: str):
+        with self._lock:
+            self._disk_bytes -= self._disk_index.pop(key, 0)
+        try:
+            os.remove(self._disk_path(key))
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk_index),
+                "disk_bytes": self._disk_bytes,
+            }
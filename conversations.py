@@ -0,0 +1,55 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+
+class Conversation:
+    """一个已建立的 Yupp 对话：所在账户和上游 chat id
+
+    Yupp 在服务端保存对话历史，同一账户以相同 chat id 发送新消息即为续接，
+    不需要轮次或消息 ID。
+    """
+
+    __slots__ = ("token", "chat_id")
+
+    def __init__(self, token: str, chat_id: str):
+        self.token = token
+        self.chat_id = chat_id
+
+
+class ConversationTable:
+    """对话亲和表：以消息前缀哈希映射到上游对话，按 LRU 淘汰
+
+    键是截至上一条助手回复（含）的全部消息的哈希。查找时取出并删除条目，
+    同一前缀的重试或重新生成不会再次落到已经追加过内容的上游对话上，
+    只有成功完成的轮次才会以延长后的前缀重新登记。
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Conversation]" = OrderedDict()
+
+    @staticmethod
+    def prefix_key(model: str, messages: Iterable[Tuple[str, str]]) -> str:
+        """以模型标签和 (角色, 文本) 序列生成前缀哈希，文本首尾空白不参与计算"""
+        digest = hashlib.sha256()
+        digest.update(model.encode("utf-8"))
+        for role, text in messages:
+            digest.update(b"\0")
+            digest.update(role.encode("utf-8"))
+            digest.update(b"\0")
+            digest.update(text.strip().encode("utf-8"))
+        return digest.hexdigest()
+
+    def claim(self, key: str) -> Optional[Conversation]:
+        with self._lock:
+            return self._entries.pop(key, None)
+
+    def record(self, key: str, conversation: Conversation):
+        with self._lock:
+            self._entries[key] = conversation
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,432 @@
+import hashlib
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import unquote, urlparse
+
+
+def token_id(token: str) -> str:
+    """共享存储中只保存 token 的哈希，不落盘或外传原始会话 token"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()[:32]
+
+
+class LeaseBackend:
+    """账户租约后端：多个副本通过同一后端协调 token 的分配
+
+    每次选用账户时登记一个带 TTL 的租约，选择集群内活跃租约最少、最久未使用的 token；
+    副本崩溃时租约随 TTL 过期。block() 让失效或冷却中的 token 对所有副本暂停分配。
+    本类是进程内实现，也定义了其他后端的接口。
+    """
+
+    def __init__(self, lease_ttl: float = 600):
+        self.lease_ttl = lease_ttl
+        self._lock = threading.Lock()
+        self._leases: Dict[str, Dict[str, float]] = {}
+        self._last_used: Dict[str, float] = {}
+        self._blocked_until: Dict[str, float] = {}
+
+    @staticmethod
+    def choose(
+        ids: Sequence[str],
+        preferred: Optional[str],
+        leases: Dict[str, int],
+        last_used: Dict[str, float],
+        blocked: Sequence[str],
+    ) -> Optional[str]:
+        candidates = [i for i in ids if i not in blocked]
+        if not candidates:
+            return None
+        if preferred in candidates:
+            return preferred
+        return min(
+            candidates, key=lambda i: (leases.get(i, 0), last_used.get(i, 0.0))
+        )
+
+    def lease(
+        self, tokens: Sequence[str], preferred: Optional[str] = None
+    ) -> Optional[Tuple[str, str]]:
+        """从候选 token 中租用一个，返回 (token, 租约 ID)，全部被阻止时返回 None"""
+        by_id = {token_id(token): token for token in tokens}
+        preferred_id = token_id(preferred) if preferred else None
+        lease_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            counts = {}
+            for i in by_id:
+                leases = self._leases.get(i)
+                if leases:
+                    for expired in [k for k, exp in leases.items() if exp <= now]:
+                        del leases[expired]
+                    counts[i] = len(leases)
+            blocked = [i for i in by_id if self._blocked_until.get(i, 0) > now]
+            chosen = self.choose(
+                list(by_id), preferred_id, counts, self._last_used, blocked
+            )
+            if chosen is None:
+                return None
+            self._leases.setdefault(chosen, {})[lease_id] = now + self.lease_ttl
+            self._last_used[chosen] = now
+        return by_id[chosen], lease_id
+
+    def release(self, token: str, lease_id: str):
+        with self._lock:
+            self._leases.get(token_id(token), {}).pop(lease_id, None)
+
+    def block(self, token: str, seconds: float):
+        """在 seconds 秒内不再分配该 token，已有更长的阻止时间则保持不变"""
+        i = token_id(token)
+        until = time.time() + seconds
+        with self._lock:
+            self._blocked_until[i] = max(self._blocked_until.get(i, 0), until)
+
+    def close(self):
+        pass
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """基于 SQLite 文件的租约后端，适用于同一主机或共享卷上的多个副本"""
+
+    def __init__(self, path: str, lease_ttl: float = 600):
+        super().__init__(lease_ttl)
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "lease_id TEXT PRIMARY KEY, token_id TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS leases_token ON leases (token_id)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS accounts ("
+                "token_id TEXT PRIMARY KEY, last_used REAL NOT NULL DEFAULT 0, "
+                "blocked_until REAL NOT NULL DEFAULT 0)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def lease(
+        self, tokens: Sequence[str], preferred: Optional[str] = None
+    ) -> Optional[Tuple[str, str]]:
+        by_id = {token_id(token): token for token in tokens}
+        if not by_id:
+            return None
+        preferred_id = token_id(preferred) if preferred else None
+        lease_id = uuid.uuid4().hex
+        now = time.time()
+        placeholders = ",".join("?" * len(by_id))
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM leases WHERE expires_at <= ?", (now,))
+            counts = dict(
+                conn.execute(
+                    f"SELECT token_id, COUNT(*) FROM leases WHERE token_id IN ({placeholders}) "
+                    "GROUP BY token_id",
+                    list(by_id),
+                ).fetchall()
+            )
+            last_used = {}
+            blocked = []
+            for i, used, blocked_until in conn.execute(
+                f"SELECT token_id, last_used, blocked_until FROM accounts "
+                f"WHERE token_id IN ({placeholders})",
+                list(by_id),
+            ):
+                last_used[i] = used
+                if blocked_until > now:
+                    blocked.append(i)
+            chosen = self.choose(list(by_id), preferred_id, counts, last_used, blocked)
+            if chosen is not None:
+                conn.execute(
+                    "INSERT INTO leases (lease_id, token_id, expires_at) VALUES (?, ?, ?)",
+                    (lease_id, chosen, now + self.lease_ttl),
+                )
+                conn.execute(
+                    "INSERT INTO accounts (token_id, last_used) VALUES (?, ?) "
+                    "ON CONFLICT(token_id) DO UPDATE SET last_used = excluded.last_used",
+                    (chosen, now),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if chosen is None:
+            return None
+        return by_id[chosen], lease_id
+
+    def release(self, token: str, lease_id: str):
+        self._connect().execute("DELETE FROM leases WHERE lease_id = ?", (lease_id,))
+
+    def block(self, token: str, seconds: float):
+        self._connect().execute(
+            "INSERT INTO accounts (token_id, blocked_until) VALUES (?, ?) "
+            "ON CONFLICT(token_id) DO UPDATE SET "
+            "blocked_until = MAX(blocked_until, excluded.blocked_until)",
+            (token_id(token), time.time() + seconds),
+        )
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RedisError(Exception):
+    pass
+
+
+class RespConnection:
+    """最小的 RESP2 客户端，只实现租约需要的命令，不引入 redis 依赖"""
+
+    def __init__(self, url: str, timeout: float = 2):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        self._sock = socket.create_connection((self.host, self.port), self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile("rb")
+        setup = []
+        if self.password:
+            setup.append(
+                ("AUTH", self.username, self.password)
+                if self.username
+                else ("AUTH", self.password)
+            )
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            self._send(setup)
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._file = None
+
+    @staticmethod
+    def _encode(command: Sequence) -> bytes:
+        parts = [f"*{len(command)}\r\n".encode()]
+        for arg in command:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        return b"".join(parts)
+
+    def _read(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            return RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self._read() for _ in range(length)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    def _send(self, commands: List[Sequence]) -> List:
+        self._sock.sendall(b"".join(self._encode(cmd) for cmd in commands))
+        replies = [self._read() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def pipeline(self, commands: List[Sequence]) -> List:
+        """按顺序发送多条命令并读取全部回复，连接断开时重连重试一次"""
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._open()
+                    return self._send(commands)
+                except (OSError, ConnectionError):
+                    self._close()
+                    if attempt:
+                        raise
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+class RedisLeaseBackend(LeaseBackend):
+    """基于 Redis 协议的租约后端，只使用基础命令，可对接 Redis、Valkey 等兼容服务
+
+    每个 token 的租约存放在一个以过期时间为分数的有序集合中。选择和登记是两次往返，
+    并发时两个副本可能选中同一个 token，对负载分散而言可以接受。
+    """
+
+    def __init__(self, url: str, lease_ttl: float = 600, prefix: str = "yupp2api:"):
+        super().__init__(lease_ttl)
+        self.prefix = prefix
+        self.conn = RespConnection(url)
+
+    def _key(self, kind: str, i: str) -> str:
+        return f"{self.prefix}{kind}:{i}"
+
+    def lease(
+        self, tokens: Sequence[str], preferred: Optional[str] = None
+    ) -> Optional[Tuple[str, str]]:
+        by_id = {token_id(token): token for token in tokens}
+        if not by_id:
+            return None
+        preferred_id = token_id(preferred) if preferred else None
+        ids = list(by_id)
+        now = time.time()
+
+        commands = []
+        for i in ids:
+            commands.append(("ZREMRANGEBYSCORE", self._key("lease", i), "-inf", now))
+            commands.append(("ZCARD", self._key("lease", i)))
+            commands.append(("GET", self._key("used", i)))
+            commands.append(("EXISTS", self._key("block", i)))
+        replies = self.conn.pipeline(commands)
+
+        counts, last_used, blocked = {}, {}, []
+        for n, i in enumerate(ids):
+            _, count, used, is_blocked = replies[n * 4 : n * 4 + 4]
+            counts[i] = count
+            last_used[i] = float(used) if used else 0.0
+            if is_blocked:
+                blocked.append(i)
+        chosen = self.choose(ids, preferred_id, counts, last_used, blocked)
+        if chosen is None:
+            return None
+
+        lease_id = uuid.uuid4().hex
+        ttl_ms = int(self.lease_ttl * 1000)
+        self.conn.pipeline(
+            [
+                ("ZADD", self._key("lease", chosen), now + self.lease_ttl, lease_id),
+                ("PEXPIRE", self._key("lease", chosen), ttl_ms),
+                ("SET", self._key("used", chosen), now, "PX", ttl_ms * 10),
+            ]
+        )
+        return by_id[chosen], lease_id
+
+    def release(self, token: str, lease_id: str):
+        self.conn.pipeline([("ZREM", self._key("lease", token_id(token)), lease_id)])
+
+    def block(self, token: str, seconds: float):
+        key = self._key("block", token_id(token))
+        ttl_ms = int(seconds * 1000)
+        (current,) = self.conn.pipeline([("PTTL", key)])
+        if current is None or current < ttl_ms:
+            self.conn.pipeline([("SET", key, 1, "PX", ttl_ms)])
+
+    def close(self):
+        self.conn.close()
+
+
+class LeaseBackendUnavailable(Exception):
+    """熔断期间不访问共享后端，调用方按后端出错处理（退回本地选择）"""
+
+
+class CircuitBreakerLeaseBackend(LeaseBackend):
+    """共享后端的熔断器：一次调用失败后 open_seconds 秒内直接抛出 LeaseBackendUnavailable
+
+    后端宕机时每个请求都要等连接超时，熔断后请求立即退回本地选择。
+    熔断期结束后只放行一个调用试探后端，成功则恢复，失败则重新计时。
+    """
+
+    def __init__(self, backend: LeaseBackend, open_seconds: float = 30):
+        super().__init__(backend.lease_ttl)
+        self.backend = backend
+        self.open_seconds = open_seconds
+        self._open_until = 0.0
+
+    def _call(self, method: str, *args):
+        with self._lock:
+            now = time.monotonic()
+            if now < self._open_until:
+                raise LeaseBackendUnavailable(
+                    f"lease backend skipped for another {self._open_until - now:.0f}s"
+                )
+            probing = self._open_until > 0
+            if probing:
+                # 试探期间其他调用继续直接失败
+                self._open_until = now + self.open_seconds
+        try:
+            result = getattr(self.backend, method)(*args)
+        except Exception:
+            with self._lock:
+                self._open_until = time.monotonic() + self.open_seconds
+            raise
+        if probing:
+            with self._lock:
+                self._open_until = 0.0
+        return result
+
+    def lease(
+        self, tokens: Sequence[str], preferred: Optional[str] = None
+    ) -> Optional[Tuple[str, str]]:
+        return self._call("lease", tokens, preferred)
+
+    def release(self, token: str, lease_id: str):
+        self._call("release", token, lease_id)
+
+    def block(self, token: str, seconds: float):
+        self._call("block", token, seconds)
+
+    def close(self):
+        self.backend.close()
+
+
+def create_lease_backend(
+    spec: Optional[str], lease_ttl: float = 600, breaker_seconds: float = 30
+) -> LeaseBackend:
+    """按配置创建租约后端：空或 memory、sqlite:///leases.db、redis://host:6379/0
+
+    共享后端套上熔断器，breaker_seconds 为 0 时不熔断。
+    """
+    spec = (spec or "").strip()
+    if not spec or spec == "memory":
+        return LeaseBackend(lease_ttl)
+    if spec.startswith("sqlite:///"):
+        # 与 SQLAlchemy 相同：sqlite:///leases.db 为相对路径，sqlite:////data/leases.db 为绝对路径
+        backend: LeaseBackend = SQLiteLeaseBackend(spec[len("sqlite:///") :], lease_ttl)
+    elif spec.startswith(("redis://", "rediss://")):
+        if spec.startswith("rediss://"):
+            raise ValueError("TLS Redis (rediss://) is not supported; use a local TLS proxy.")
+        backend = RedisLeaseBackend(spec, lease_ttl)
+    else:
+        raise ValueError(f"Unknown LEASE_BACKEND: {spec}")
+    if breaker_seconds > 0:
+        return CircuitBreakerLeaseBackend(backend, breaker_seconds)
+    return backend
@@ -0,0 +1,103 @@
+import threading
+from typing import Dict, Tuple
+
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+# 默认直方图分桶（秒），覆盖首 token 时延和排队时间的常见范围
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class MetricsRegistry:
+    """进程内指标注册表，按 Prometheus 文本格式导出"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str]] = {}
+        self._values: Dict[str, Dict[LabelKey, float]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+
+    def describe(
+        self,
+        name: str,
+        metric_type: str,
+        help_text: str,
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        """声明指标类型（counter / gauge / histogram）和说明"""
+        with self._lock:
+            self._meta[name] = (metric_type, help_text)
+            if metric_type == "histogram":
+                self._buckets[name] = tuple(sorted(buckets))
+                for suffix in ("_bucket", "_count", "_sum"):
+                    self._values.setdefault(name + suffix, {})
+            else:
+                self._values.setdefault(name, {})
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        """累加计数器"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: str):
+        """设置仪表盘的当前值"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values.setdefault(name, {})[key] = value
+
+    def observe(self, name: str, value: float, **labels: str):
+        """向直方图记录一个观测值，分桶按 Prometheus 约定累计"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            buckets = self._values.setdefault(name + "_bucket", {})
+            for bound in self._buckets.get(name, DEFAULT_BUCKETS):
+                bucket_key = tuple(sorted((*key, ("le", _format_value(bound)))))
+                buckets[bucket_key] = buckets.get(bucket_key, 0) + (value <= bound)
+            inf_key = tuple(sorted((*key, ("le", "+Inf"))))
+            buckets[inf_key] = buckets.get(inf_key, 0) + 1
+            count = self._values.setdefault(name + "_count", {})
+            count[key] = count.get(key, 0) + 1
+            total = self._values.setdefault(name + "_sum", {})
+            total[key] = total.get(key, 0) + value
+
+    def get(self, name: str, **labels: str) -> float:
+        """读取指标的当前值，不存在时返回 0"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            return self._values.get(name, {}).get(key, 0)
+
+    def render(self) -> str:
+        """导出为 Prometheus 文本格式"""
+        lines = []
+        with self._lock:
+            for name in sorted(self._values):
+                # 直方图的 _bucket / _count / _sum 共用一组说明，排序后 _bucket 在最前
+                meta_name = name[: -len("_bucket")] if name.endswith("_bucket") else name
+                if meta_name in self._meta:
+                    metric_type, help_text = self._meta[meta_name]
+                    lines.append(f"# HELP {meta_name} {help_text}")
+                    lines.append(f"# TYPE {meta_name} {metric_type}")
+                for labels, value in self._values[name].items():
+                    if labels:
+                        label_str = ",".join(
+                            f'{k}="{_escape_label(v)}"' for k, v in labels
+                        )
+                        lines.append(f"{name}{{{label_str}}} {_format_value(value)}")
+                    else:
+                        lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# 全局指标注册表
+registry = MetricsRegistry()
@@ -190,6 +190,10 @@ def filter_and_process_models(data: List[Dict[str, Any]]) -> List[Dict[str, Any]
                 "isAgent": item.get("isAgent", False),
                 "isReasoning": item.get("isReasoning", False),
                 "isFast": item.get("isFast", False),
+                "supportedAttachmentMimeTypes": item.get(
+                    "supportedAttachmentMimeTypes"
+                )
+                or [],
             }
             processed_models.append(processed_item)
 
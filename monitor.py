@@ -0,0 +1,113 @@
+import asyncio
+import time
+from typing import Optional
+
+from anyio import to_thread
+
+from metrics import registry as metrics
+
+
+metrics.describe(
+    "yupp_event_loop_lag_seconds",
+    "gauge",
+    "Delay of the latest event loop wake-up beyond its schedule",
+)
+metrics.describe(
+    "yupp_event_loop_lag_max_seconds",
+    "gauge",
+    "Largest event loop lag in the current alert window",
+)
+metrics.describe(
+    "yupp_event_loop_lag_alerts_total",
+    "counter",
+    "Event loop lag samples above the alert threshold",
+)
+metrics.describe(
+    "yupp_threadpool_size", "gauge", "Worker threads available to the threadpool"
+)
+metrics.describe(
+    "yupp_threadpool_active", "gauge", "Threadpool workers currently busy"
+)
+metrics.describe(
+    "yupp_threadpool_queued", "gauge", "Calls waiting for a free threadpool worker"
+)
+
+
+def configure_threadpool(size: Optional[int]):
+    """设置 Starlette/AnyIO 默认线程池的大小
+
+    同步流式生成器的每次迭代、run_in_threadpool 中的上游请求都占用这个线程池，
+    并发流较多时需要按流数量调大。
+    """
+    if size and size > 0:
+        to_thread.current_default_thread_limiter().total_tokens = size
+
+
+class LoopMonitor:
+    """定时测量事件循环延迟，并采样线程池占用，写入指标
+
+    每隔 interval 秒唤醒一次，实际唤醒时间与计划时间之差即为事件循环延迟。
+    延迟超过 alert_threshold 时打印告警，同一窗口内最多告警一次。
+    """
+
+    def __init__(
+        self,
+        interval: float = 1.0,
+        alert_threshold: float = 0.25,
+        alert_window: float = 30.0,
+    ):
+        self.interval = interval
+        self.alert_threshold = alert_threshold
+        self.alert_window = alert_window
+        self._task: Optional[asyncio.Task] = None
+        self._max_lag = 0.0
+        self._window_start = time.monotonic()
+        self._alerted = False
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def sample_threadpool(self):
+        stats = to_thread.current_default_thread_limiter().statistics()
+        metrics.set("yupp_threadpool_size", stats.total_tokens)
+        metrics.set("yupp_threadpool_active", stats.borrowed_tokens)
+        metrics.set("yupp_threadpool_queued", stats.tasks_waiting)
+        return stats
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - scheduled, 0.0)
+            stats = self.sample_threadpool()
+            metrics.set("yupp_event_loop_lag_seconds", lag)
+
+            now = time.monotonic()
+            if now - self._window_start >= self.alert_window:
+                self._window_start = now
+                self._max_lag = 0.0
+                self._alerted = False
+            self._max_lag = max(self._max_lag, lag)
+            metrics.set("yupp_event_loop_lag_max_seconds", self._max_lag)
+
+            if self.alert_threshold > 0 and lag > self.alert_threshold:
+                metrics.inc("yupp_event_loop_lag_alerts_total")
+                if not self._alerted:
+                    self._alerted = True
+                    print(
+                        f"Warning: event loop lag {lag * 1000:.0f}ms "
+                        f"(max {self._max_lag * 1000:.0f}ms), threadpool "
+                        f"{stats.borrowed_tokens}/{stats.total_tokens} busy, "
+                        f"{stats.tasks_waiting} queued"
+                    )
@@ -0,0 +1,110 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Optional
+
+
+class ProfilerBusy(Exception):
+    """已有一次剖析在进行中"""
+
+
+# 同一时间只允许一次剖析，避免相互干扰；未调用时不安装任何钩子，空闲开销为零
+_profile_lock = threading.Lock()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name}@{os.path.basename(code.co_filename)}:{code.co_firstlineno}"
+
+
+def sample_cpu(duration: float, interval: float = 0.005) -> str:
+    """对所有线程做定时栈采样，返回 flamegraph.pl / speedscope 可用的 collapsed 格式
+
+    每行形如 "线程名;外层函数;...;内层函数 采样次数"。采样在调用线程中进行，
+    调用线程本身不计入结果。
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running.")
+    try:
+        own_ident = threading.get_ident()
+        stacks: Counter = Counter()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, f"thread-{ident}").replace(" ", "_"))
+                stacks[";".join(reversed(labels))] += 1
+            time.sleep(interval)
+    finally:
+        _profile_lock.release()
+
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def memory_diff(
+    duration: float,
+    top: int = 30,
+    group_by: str = "lineno",
+    frames: int = 1,
+    path_filter: Optional[str] = None,
+) -> Dict[str, object]:
+    """在 duration 秒内对比两次 tracemalloc 快照，返回内存增长最多的位置
+
+    tracemalloc 只在剖析期间开启（若已由 PYTHONTRACEMALLOC 开启则保持原状）。
+    path_filter 可以只保留文件路径中包含该字符串的分配，例如 "yyapi.py"。
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running.")
+    started = False
+    try:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(max(frames, 1))
+            started = True
+        before = tracemalloc.take_snapshot()
+        time.sleep(duration)
+        after = tracemalloc.take_snapshot()
+        traced_current, traced_peak = tracemalloc.get_traced_memory()
+    finally:
+        if started:
+            tracemalloc.stop()
+        _profile_lock.release()
+
+    filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ]
+    if path_filter:
+        filters.append(tracemalloc.Filter(True, f"*{path_filter}*"))
+    before = before.filter_traces(filters)
+    after = after.filter_traces(filters)
+
+    stats: List[Dict[str, object]] = []
+    for stat in after.compare_to(before, group_by)[:top]:
+        stats.append(
+            {
+                "size_diff": stat.size_diff,
+                "size": stat.size,
+                "count_diff": stat.count_diff,
+                "count": stat.count,
+                "traceback": [
+                    f"{frame.filename}:{frame.lineno}" for frame in stat.traceback
+                ],
+            }
+        )
+
+    return {
+        "duration": duration,
+        "group_by": group_by,
+        "traced_memory": traced_current,
+        "traced_peak": traced_peak,
+        "stats": stats,
+    }
@@ -0,0 +1,295 @@
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+PRIORITY_CLASSES = (PRIORITY_INTERACTIVE, PRIORITY_BATCH)
+
+
+class RateLimitExceeded(Exception):
+    """超出限流配额，retry_after 为建议的重试等待秒数"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def parse_key_weights(value: Optional[str]) -> Dict[str, float]:
+    """解析 key:weight 形式的逗号分隔配置，例如 sk-a:2,sk-b:0.5"""
+    weights = {}
+    for item in (value or "").split(","):
+        key, sep, weight = item.strip().rpartition(":")
+        if not sep or not key:
+            continue
+        try:
+            weights[key] = max(float(weight), 0.01)
+        except ValueError:
+            print(f"Warning: invalid weight for key ...{key[-4:]}: {weight}")
+    return weights
+
+
+def parse_key_priorities(value: Optional[str]) -> Dict[str, str]:
+    """解析 key:class 形式的逗号分隔配置，例如 sk-etl:batch,sk-app:interactive"""
+    priorities = {}
+    for item in (value or "").split(","):
+        key, sep, priority = item.strip().rpartition(":")
+        if not sep or not key:
+            continue
+        if priority in PRIORITY_CLASSES:
+            priorities[key] = priority
+        else:
+            print(f"Warning: invalid priority for key ...{key[-4:]}: {priority}")
+    return priorities
+
+
+class TokenBucket:
+    """令牌桶，按时间惰性补充令牌，每次操作 O(1)"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """尝试取出一个令牌，成功返回 0，否则返回需要等待的秒数"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class ClientLimitState:
+    __slots__ = ("bucket", "active", "max_active")
+
+    def __init__(self, bucket: Optional[TokenBucket], max_active: int):
+        self.bucket = bucket
+        self.active = 0
+        self.max_active = max_active
+
+
+class ClientRateLimiter:
+    """按客户端密钥的请求速率和并发限制，权重按比例放大速率、突发量和并发上限"""
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        max_concurrent: int,
+        weights: Dict[str, float],
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.weights = weights
+        self._states: Dict[str, ClientLimitState] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0 or self.max_concurrent > 0
+
+    def weight(self, key: str) -> float:
+        return self.weights.get(key, 1.0)
+
+    def _state(self, key: str) -> ClientLimitState:
+        state = self._states.get(key)
+        if state is None:
+            weight = self.weight(key)
+            bucket = None
+            if self.rate > 0:
+                bucket = TokenBucket(
+                    self.rate * weight, max(self.burst * weight, 1.0)
+                )
+            max_active = (
+                max(int(self.max_concurrent * weight), 1)
+                if self.max_concurrent > 0
+                else 0
+            )
+            state = self._states[key] = ClientLimitState(bucket, max_active)
+        return state
+
+    def acquire(self, key: str):
+        """登记一个请求，超出速率或并发上限时抛出 RateLimitExceeded"""
+        if not self.enabled:
+            return
+        with self._lock:
+            state = self._state(key)
+            if state.max_active and state.active >= state.max_active:
+                raise RateLimitExceeded(
+                    f"Too many concurrent requests for this API key (limit {state.max_active}).",
+                    1,
+                )
+            if state.bucket:
+                wait = state.bucket.take(time.monotonic())
+                if wait > 0:
+                    raise RateLimitExceeded(
+                        "Request rate limit exceeded for this API key.", wait
+                    )
+            state.active += 1
+
+    def release(self, key: str):
+        if not self.enabled:
+            return
+        with self._lock:
+            state = self._states.get(key)
+            if state and state.active > 0:
+                state.active -= 1
+
+
+class _Waiter:
+    __slots__ = ("loop", "future", "state")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, future: asyncio.Future):
+        self.loop = loop
+        self.future = future
+        self.state = "waiting"
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdmissionController:
+    """全局并发准入控制
+
+    名额用尽时请求进入等待队列，按各密钥权重做加权公平排队（虚拟完成时间），
+    避免单个密钥的大量请求饿死其他密钥。release 可以在线程池中调用。
+
+    请求分为 interactive 和 batch 两个优先级，各自排队：排队标签再乘以优先级权重，
+    interactive 更早获得名额；interactive_reserve 比例的名额只留给 interactive，
+    batch 最多同时占用其余名额，交互流量激增时 batch 请求在队列中延后。
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        interactive_reserve: float = 0.0,
+        priority_weights: Optional[Dict[str, float]] = None,
+    ):
+        self.max_concurrent = max_concurrent
+        self.interactive_reserve = min(max(interactive_reserve, 0.0), 1.0)
+        self.priority_weights = priority_weights or {}
+        self.active = 0
+        self.active_by_priority: Dict[str, int] = {p: 0 for p in PRIORITY_CLASSES}
+        self._lock = threading.Lock()
+        self._waiters: Dict[str, List[tuple]] = {p: [] for p in PRIORITY_CLASSES}
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+
+    @property
+    def queued(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def limit(self, priority: str) -> int:
+        """该优先级最多同时占用的名额"""
+        if priority == PRIORITY_INTERACTIVE:
+            return self.max_concurrent
+        reserved = math.ceil(self.max_concurrent * self.interactive_reserve)
+        return max(self.max_concurrent - reserved, 1)
+
+    def _next_priority(self) -> Optional[str]:
+        """下一个可以获得名额的优先级：队首虚拟完成时间最小且未超出该级上限"""
+        best = None
+        for priority, waiters in self._waiters.items():
+            while waiters and waiters[0][2].state != "waiting":
+                heapq.heappop(waiters)
+            if not waiters or self.active_by_priority[priority] >= self.limit(priority):
+                continue
+            if best is None or waiters[0] < self._waiters[best][0]:
+                best = priority
+        return best
+
+    async def acquire(
+        self,
+        key: str,
+        weight: float,
+        timeout: float,
+        priority: str = PRIORITY_INTERACTIVE,
+    ):
+        """获取一个名额，排队超时抛出 RateLimitExceeded"""
+        if self.max_concurrent <= 0:
+            return
+        with self._lock:
+            if (
+                self.active < self.max_concurrent
+                and self.active_by_priority[priority] < self.limit(priority)
+                and self._next_priority() is None
+            ):
+                self.active += 1
+                self.active_by_priority[priority] += 1
+                return
+            loop = asyncio.get_running_loop()
+            waiter = _Waiter(loop, loop.create_future())
+            weight *= self.priority_weights.get(priority, 1.0)
+            tag = max(self._virtual_time, self._last_finish.get(key, 0.0)) + 1.0 / weight
+            self._last_finish[key] = tag
+            heapq.heappush(self._waiters[priority], (tag, next(self._seq), waiter))
+
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                # 超时与分配名额同时发生时，名额已经转交给当前请求
+                if waiter.state == "granted":
+                    return
+                waiter.state = "cancelled"
+            raise RateLimitExceeded("Server is busy, please retry later.", timeout)
+        except BaseException:
+            with self._lock:
+                granted = waiter.state == "granted"
+                waiter.state = "cancelled"
+            if granted:
+                self.release(priority)
+            raise
+
+    def release(self, priority: str = PRIORITY_INTERACTIVE):
+        """释放名额，并按虚拟完成时间把空出的名额分配给可以获得名额的等待者"""
+        if self.max_concurrent <= 0:
+            return
+        with self._lock:
+            self.active = max(self.active - 1, 0)
+            self.active_by_priority[priority] = max(
+                self.active_by_priority[priority] - 1, 0
+            )
+            while self.active < self.max_concurrent:
+                next_priority = self._next_priority()
+                if next_priority is None:
+                    break
+                tag, _, waiter = heapq.heappop(self._waiters[next_priority])
+                waiter.state = "granted"
+                self._virtual_time = tag
+                self.active += 1
+                self.active_by_priority[next_priority] += 1
+                waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+            if not any(self._waiters.values()):
+                # 队列清空后重置各密钥的虚拟完成时间
+                self._last_finish.clear()
+
+
+def call_once(func: Callable[[], None]) -> Callable[[], None]:
+    """包装为只执行一次的回调，便于在多个退出路径上安全地释放名额"""
+    lock = threading.Lock()
+    called = False
+
+    def wrapper():
+        nonlocal called
+        with lock:
+            if called:
+                return
+            called = True
+        func()
+
+    return wrapper
@@ -0,0 +1,164 @@
+import gzip
+import json
+from typing import Any, Dict, Optional, Sequence
+
+from anyio import to_thread
+from pydantic import BaseModel
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+
+from metrics import registry as metrics
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖，未安装时只提供 gzip
+    zstandard = None
+
+# 超过该大小的响应体放到线程池中压缩，避免阻塞事件循环
+THREAD_COMPRESS_BYTES = 256 * 1024
+
+metrics.describe(
+    "yupp_response_compressed_total", "counter", "Responses compressed per encoding"
+)
+metrics.describe(
+    "yupp_response_bytes_saved_total",
+    "counter",
+    "Response bytes saved by compression per encoding",
+)
+
+
+class ModelJSONResponse(Response):
+    """用 pydantic 的 model_dump_json 直接序列化模型的 JSON 响应
+
+    直接返回该响应时，FastAPI 不再经过 jsonable_encoder 转换和 response_model 的二次校验。
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            return content.model_dump_json().encode("utf-8")
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode(
+            "utf-8"
+        )
+
+
+def available_encodings(names: Sequence[str]) -> tuple:
+    """按配置顺序保留本进程支持的编码，zstd 需要安装 zstandard"""
+    supported = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+    return tuple(name for name in names if name in supported)
+
+
+def parse_accept_encoding(value: str) -> Dict[str, float]:
+    """解析 Accept-Encoding 为 编码 -> q 值"""
+    weights = {}
+    for item in value.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+    return weights
+
+
+def choose_encoding(accept: str, encodings: Sequence[str]) -> Optional[str]:
+    """选出客户端接受且 q 值最高的编码，q 值相同时按服务端配置顺序"""
+    weights = parse_accept_encoding(accept)
+    best, best_q = None, 0.0
+    for name in encodings:
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def compress(body: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level or 3).compress(body)
+    return gzip.compress(body, compresslevel=level or 6, mtime=0)
+
+
+class CompressionMiddleware:
+    """按 Accept-Encoding 协商 zstd / gzip 压缩响应体
+
+    只压缩一次性发送的响应体：流式响应（分多块发送）和 SSE 原样转发，
+    小于 minimum_size 的响应和已经带 Content-Encoding 的响应也不压缩。
+    """
+
+    def __init__(
+        self,
+        app,
+        encodings: Sequence[str] = ("zstd", "gzip"),
+        minimum_size: int = 1024,
+    ):
+        self.app = app
+        self.encodings = available_encodings(encodings)
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(
+            Headers(scope=scope).get("accept-encoding", ""), self.encodings
+        )
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if "content-encoding" in headers or headers.get(
+                    "content-type", ""
+                ).startswith("text/event-stream"):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message
+                return
+
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < self.minimum_size:
+                # 流式响应或小响应：原样发送
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            if len(body) > THREAD_COMPRESS_BYTES:
+                compressed = await to_thread.run_sync(compress, body, encoding)
+            else:
+                compressed = compress(body, encoding)
+            if len(compressed) < len(body):
+                headers = MutableHeaders(scope=start_message)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(compressed))
+                headers.add_vary_header("Accept-Encoding")
+                metrics.inc("yupp_response_compressed_total", encoding=encoding)
+                metrics.inc(
+                    "yupp_response_bytes_saved_total",
+                    len(body) - len(compressed),
+                    encoding=encoding,
+                )
+                message = {**message, "body": compressed}
+            passthrough = True
+            await send(start_message)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,63 @@
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# yyapi 在导入时读取这些配置，测试中使用占位值，不访问 Yupp
+os.environ.setdefault("CLIENT_API_KEYS", "test-key")
+os.environ.setdefault("YUPP_TOKENS", "test-token")
+
+
+@pytest.fixture
+def yupp(monkeypatch, tmp_path):
+    """用 FakeYupp 替换上游连接，并为应用准备一份最小的模型快照"""
+    import yyapi
+    from fake_yupp import FakeYupp
+
+    fake = FakeYupp()
+    model_file = tmp_path / "model.json"
+    model_file.write_text(
+        json.dumps([{"label": "M", "name": "m-name", "publisher": "p"}])
+    )
+    monkeypatch.setattr(yyapi, "get_requests_session", lambda: fake)
+    # lifespan 会保留同名 token 的账户状态，每个测试从新的账户池开始
+    monkeypatch.setattr(yyapi, "YUPP_ACCOUNTS", [])
+    monkeypatch.setattr(yyapi, "BATCH_JOBS", {})
+    monkeypatch.setattr(yyapi, "REWARD_EXECUTOR", ThreadPoolExecutor(max_workers=1))
+    for name, value in {
+        "MODEL_FILE": str(model_file),
+        "CLIENT_API_KEYS": "test-key",
+        "YUPP_TOKENS": "tok-a,tok-b",
+        "LOOP_MONITOR_INTERVAL": "0",
+        "SHUTDOWN_GRACE_PERIOD": "1",
+    }.items():
+        monkeypatch.setenv(name, value)
+    yield fake
+    yyapi.DRAINING.clear()
+
+
+@pytest.fixture
+def serve(yupp, monkeypatch):
+    """启动应用并运行 lifespan；关键字参数在启动前写入环境变量"""
+    from fastapi.testclient import TestClient
+
+    import yyapi
+
+    clients = []
+
+    def start(**env):
+        for name, value in env.items():
+            monkeypatch.setenv(name, str(value))
+        client = TestClient(yyapi.app)
+        client.__enter__()
+        clients.append(client)
+        return client
+
+    yield start
+    for client in clients:
+        client.__exit__(None, None, None)
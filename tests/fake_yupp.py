@@ -0,0 +1,139 @@
+"""测试用的 Yupp 上游替身
+
+按计划返回流式响应行（与 Yupp 的 text/x-component 流格式相同），并记录每次请求，
+测试通过 monkeypatch 替换 yyapi.get_requests_session 使用它，不访问网络。
+"""
+
+import json
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import requests
+
+# conftest.py 中 yupp fixture 配置的客户端密钥
+AUTH = {"Authorization": "Bearer test-key"}
+
+
+def stream_lines(
+    left: Iterable[str] = ("Hello ", "world"),
+    right: Iterable[str] = (),
+    models=("m-left", "m-right"),
+    reward_id: Optional[str] = None,
+    fail: bool = False,
+) -> List[bytes]:
+    """构造一次 Yupp 流式响应：左右两个回答（默认只有左侧），可选奖励信息
+
+    fail=True 时在最后一行之后抛出连接中断，模拟上游流中途断开。
+    """
+    lines = [
+        b"1:"
+        + json.dumps(
+            {"leftStream": {"next": "$@10"}, "rightStream": {"next": "$@50"}}
+        ).encode(),
+        b"e:"
+        + json.dumps(
+            {
+                "modelSelections": [
+                    {"selectionSource": "USER_SELECTED", "modelName": models[0]},
+                    {"selectionSource": "RANDOM", "modelName": models[1]},
+                ]
+            }
+        ).encode(),
+    ]
+    if reward_id:
+        lines.append(
+            b"a:"
+            + json.dumps({"unclaimedRewardInfo": {"rewardId": reward_id}}).encode()
+        )
+    for base, texts in ((10, list(left)), (50, list(right))):
+        for i, text in enumerate(texts):
+            lines.append(
+                f"{base + i}:".encode()
+                + json.dumps({"curr": text, "next": f"$@{base + i + 1}"}).encode()
+            )
+    if fail:
+        lines.append(ConnectionBroken)
+    return lines
+
+
+class ConnectionBroken:
+    """stream_lines 中的标记：迭代到这里时抛出 ChunkedEncodingError"""
+
+
+class FakeResponse:
+    def __init__(self, lines: List[Any], payload: Any = None):
+        self.status_code = 200
+        self._lines = lines
+        self._payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._payload
+
+    def iter_lines(self):
+        for line in self._lines:
+            if line is ConnectionBroken:
+                raise requests.exceptions.ChunkedEncodingError("connection broken")
+            yield line
+
+    def close(self):
+        pass
+
+
+class FakeYupp:
+    """记录请求并按 plans 依次返回流式响应，plans 为空时返回默认响应"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls: List[Dict[str, Any]] = []
+        self.plans: List[Callable[[], List[Any]]] = []
+        self.default: Callable[[], List[Any]] = stream_lines
+
+    def post(self, url, data=None, json=None, headers=None, stream=False, **kwargs):
+        with self.lock:
+            self.calls.append(
+                {
+                    "url": url,
+                    "payload": _loads(data) if data is not None else json,
+                    "headers": headers or {},
+                }
+            )
+            if "reward.claim" in url:
+                balance = [
+                    {"result": {"data": {"json": {"currentCreditBalance": 100}}}}
+                ]
+                return FakeResponse([], balance)
+            plan = self.plans.pop(0) if self.plans else self.default
+        return FakeResponse(plan())
+
+    def chat_calls(self) -> List[Dict[str, Any]]:
+        return [call for call in self.calls if "/chat/" in call["url"]]
+
+    def tokens(self) -> List[str]:
+        """每次聊天请求使用的账户 token"""
+        return [
+            call["headers"]["Cookie"].split("=", 1)[1] for call in self.chat_calls()
+        ]
+
+
+def _loads(data):
+    return json.loads(data) if isinstance(data, (str, bytes)) else data
+
+
+def sse_events(text: str) -> List[Dict[str, Any]]:
+    """解析 SSE 响应体中的 JSON 数据块"""
+    return [
+        json.loads(line[6:]) for line in text.splitlines() if line.startswith("data: {")
+    ]
+
+
+def stream_content(text: str, index: int = 0) -> str:
+    """拼接 SSE 响应中某个选项的 content 增量"""
+    return "".join(
+        choice["delta"].get("content") or ""
+        for event in sse_events(text)
+        for choice in event.get("choices", [])
+        if choice["index"] == index
+    )
@@ -0,0 +1,117 @@
+"""测试用的最小 RESP 服务器，只实现 RedisLeaseBackend 用到的命令"""
+
+import socketserver
+import threading
+import time
+
+
+class RespStub(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, password=None):
+        super().__init__(("127.0.0.1", 0), RespHandler)
+        self.password = password
+        self.data = {}
+        self.expires = {}
+        self.commands = []
+        self.lock = threading.Lock()
+        self.drop_next = False
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        auth = f":{self.password}@" if self.password else ""
+        return f"redis://{auth}127.0.0.1:{self.server_address[1]}/2"
+
+    def alive(self, key):
+        if key in self.expires and self.expires[key] <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def execute(self, args, session):
+        name, key = args[0].upper(), args[1] if len(args) > 1 else None
+        self.commands.append(name)
+        if name == "AUTH":
+            if args[-1] != self.password:
+                return ValueError("WRONGPASS invalid password")
+            session["authed"] = True
+            return "OK"
+        if self.password and not session.get("authed"):
+            return ValueError("NOAUTH Authentication required.")
+        if name == "SELECT":
+            return "OK"
+        if name == "ZREMRANGEBYSCORE":
+            if not self.alive(key):
+                return 0
+            members = self.data[key]
+            removed = [m for m, score in members.items() if score <= float(args[3])]
+            for member in removed:
+                del members[member]
+            return len(removed)
+        if name == "ZCARD":
+            return len(self.data[key]) if self.alive(key) else 0
+        if name == "ZADD":
+            self.alive(key)
+            self.data.setdefault(key, {})[args[3]] = float(args[2])
+            return 1
+        if name == "ZREM":
+            return int(
+                self.alive(key) and self.data[key].pop(args[2], None) is not None
+            )
+        if name == "GET":
+            return self.data[key] if self.alive(key) else None
+        if name == "EXISTS":
+            return int(self.alive(key))
+        if name == "SET":
+            self.data[key] = args[2]
+            self.expires.pop(key, None)
+            if len(args) > 4 and args[3].upper() == "PX":
+                self.expires[key] = time.time() + int(args[4]) / 1000
+            return "OK"
+        if name == "PEXPIRE":
+            if not self.alive(key):
+                return 0
+            self.expires[key] = time.time() + int(args[2]) / 1000
+            return 1
+        if name == "PTTL":
+            if not self.alive(key):
+                return -2
+            if key not in self.expires:
+                return -1
+            return int((self.expires[key] - time.time()) * 1000)
+        return ValueError(f"ERR unknown command '{name}'")
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        session = {}
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2].decode())
+            with self.server.lock:
+                if self.server.drop_next:
+                    # 模拟服务端断开空闲连接
+                    self.server.drop_next = False
+                    return
+                reply = self.server.execute(args, session)
+            self.wfile.write(encode(reply))
+
+
+def encode(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, ValueError):
+        return f"-{value}\r\n".encode()
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if value == "OK":
+        return b"+OK\r\n"
+    data = str(value).encode()
+    return b"$%d\r\n%s\r\n" % (len(data), data)
@@ -0,0 +1,196 @@
+import base64
+import hashlib
+
+import pytest
+
+from attachments import (
+    ATTACHMENT_REF_PREFIX,
+    AttachmentCache,
+    AttachmentError,
+    attachment_refs,
+    check_type,
+    content_text,
+    decode_attachments,
+    decode_base64,
+)
+from fake_yupp import AUTH
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 40
+PNG_B64 = base64.b64encode(PNG).decode()
+PNG_SHA = hashlib.sha256(PNG).hexdigest()
+
+
+def image(url):
+    return {"type": "image_url", "image_url": {"url": url}}
+
+
+def test_decode_base64_in_chunks_matches_stdlib():
+    data = bytes(range(256)) * 1000
+    text = "prefix," + base64.b64encode(data).decode()
+    decoded, digest = decode_base64(text, 0, start=len("prefix,"))
+    assert decoded == data
+    assert digest == hashlib.sha256(data).hexdigest()
+
+
+def test_decode_base64_accepts_line_breaks():
+    encoded = base64.encodebytes(PNG).decode()
+    assert "\n" in encoded
+    assert decode_base64(encoded, 0)[0] == PNG
+
+
+def test_decode_base64_rejects_oversized_data_before_decoding():
+    with pytest.raises(AttachmentError) as exc:
+        decode_base64("A" * 4000, 100)
+    assert exc.value.status_code == 413
+
+
+def test_decode_base64_rejects_invalid_data():
+    with pytest.raises(AttachmentError) as exc:
+        decode_base64("not base64!!", 0)
+    assert exc.value.status_code == 400
+
+
+def test_decode_attachments_replaces_data_with_references():
+    contents = [
+        [
+            {"type": "text", "text": "what is this?"},
+            image(f"data:image/png;base64,{PNG_B64}"),
+        ],
+        [image(f"data:image/png;base64,{PNG_B64}")],
+    ]
+    attachments = decode_attachments(contents, 0, 0)
+    assert list(attachments) == [PNG_SHA]
+    attachment = attachments[PNG_SHA]
+    assert attachment.data == PNG
+    assert attachment.content_type == "image/png"
+    assert attachment.file_name.endswith(".png")
+    assert contents[0][1]["image_url"]["url"] == ATTACHMENT_REF_PREFIX + PNG_SHA
+    assert attachment_refs(contents) == [PNG_SHA]
+
+
+@pytest.mark.parametrize(
+    "part",
+    [
+        image(ATTACHMENT_REF_PREFIX + "deadbeef"),
+        {"type": "file", "file": {"file_data": ATTACHMENT_REF_PREFIX + PNG_SHA}},
+    ],
+)
+def test_decode_attachments_rejects_client_references(part):
+    with pytest.raises(AttachmentError) as exc:
+        decode_attachments([[part]], 0, 0)
+    assert exc.value.status_code == 400
+
+
+def test_decode_attachments_audio_and_files():
+    audio = {"type": "input_audio", "input_audio": {"data": PNG_B64, "format": "mp3"}}
+    document = {
+        "type": "file",
+        "file": {"file_data": PNG_B64, "filename": "report.pdf"},
+    }
+    attachments = decode_attachments([[audio, document]], 0, 0)
+    (only,) = attachments.values()
+    # 内容相同按哈希去重，保留第一次出现时的类型
+    assert only.content_type == "audio/mp3"
+
+
+def test_decode_attachments_limits():
+    other = base64.b64encode(b"other image data").decode()
+    contents = [
+        [
+            image(f"data:image/png;base64,{PNG_B64}"),
+            image(f"data:image/png;base64,{other}"),
+        ]
+    ]
+    with pytest.raises(AttachmentError) as exc:
+        decode_attachments(contents, 0, 1)
+    assert exc.value.status_code == 413
+    with pytest.raises(AttachmentError) as exc:
+        decode_attachments([[image(f"data:image/png;base64,{PNG_B64}")]], 100, 0)
+    assert exc.value.status_code == 413
+
+
+def test_decode_attachments_rejects_unsupported_inputs():
+    with pytest.raises(AttachmentError, match="base64"):
+        decode_attachments([[image("data:image/svg+xml,<svg/>")]], 0, 0)
+    with pytest.raises(AttachmentError, match="not supported"):
+        decode_attachments(
+            [[image(f"data:image/png;base64,{PNG_B64}")]], 0, 0, ["image/jpeg"]
+        )
+    with pytest.raises(AttachmentError, match="does not accept"):
+        decode_attachments([[image(f"data:image/png;base64,{PNG_B64}")]], 0, 0, [])
+
+
+@pytest.mark.parametrize(
+    "part",
+    [
+        {"type": "image_url", "image_url": {}},
+        {"type": "image_url"},
+        {"type": "image_url", "image_url": {"url": 42}},
+    ],
+)
+def test_malformed_image_parts_are_rejected(part):
+    with pytest.raises(AttachmentError) as exc:
+        decode_attachments([[part]], 0, 0)
+    assert exc.value.status_code == 400
+    # content_text 对同样的片段不会抛出 KeyError
+    content_text([part])
+
+
+def test_remote_images_stay_in_the_text():
+    contents = [
+        [
+            {"type": "text", "text": "look"},
+            {"type": "image_url", "image_url": "https://x/y.png"},
+        ]
+    ]
+    assert decode_attachments(contents, 0, 0) == {}
+    assert content_text(contents[0]) == "look\nhttps://x/y.png"
+
+
+def test_content_text_skips_inline_parts():
+    parts = [
+        {"type": "text", "text": "a"},
+        image(ATTACHMENT_REF_PREFIX + PNG_SHA),
+        {"type": "text", "text": "b"},
+    ]
+    assert content_text(parts) == "a\nb"
+
+
+def test_check_type_wildcards():
+    check_type("image/webp", ["image/*"])
+    check_type("application/pdf", None)
+    with pytest.raises(AttachmentError):
+        check_type("audio/wav", ["image/*"])
+
+
+def test_attachment_cache_evicts_least_recently_used():
+    cache = AttachmentCache(2)
+    cache.put("a", {"id": 1})
+    cache.put("b", {"id": 2})
+    assert cache.get("a") == {"id": 1}
+    cache.put("c", {"id": 3})
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+
+
+def test_client_reference_is_a_bad_request(serve, yupp):
+    client = serve()
+    response = client.post(
+        "/v1/chat/completions",
+        headers=AUTH,
+        json={
+            "model": "M",
+            "stream": False,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": "what is this?"},
+                        image(ATTACHMENT_REF_PREFIX + "deadbeef"),
+                    ],
+                }
+            ],
+        },
+    )
+    assert response.status_code == 400
+    assert not yupp.calls
@@ -0,0 +1,161 @@
+import json
+import threading
+import time
+
+from fake_yupp import AUTH, stream_lines
+
+
+def request(content, model="M"):
+    return {"model": model, "messages": [{"role": "user", "content": content}]}
+
+
+def wait_for_job(client, batch_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f"/v1/batches/{batch_id}", headers=AUTH).json()
+        if (
+            job["status"] not in ("in_progress", "cancelling")
+            or time.monotonic() > deadline
+        ):
+            return job
+        time.sleep(0.02)
+
+
+def test_batch_streams_ndjson_results_with_index(serve, yupp):
+    client = serve(BATCH_CONCURRENCY=2)
+    items = [request(f"q{i}") for i in range(4)] + [request("x", model="missing")]
+    response = client.post(
+        "/v1/chat/completions/batch", headers=AUTH, json={"requests": items}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    results = {
+        line["index"]: line for line in map(json.loads, response.text.splitlines())
+    }
+    assert sorted(results) == [0, 1, 2, 3, 4]
+    for index in range(4):
+        message = results[index]["response"]["choices"][0]["message"]
+        assert message["content"] == "Hello world"
+    assert results[4]["error"]["status"] == 404
+    assert len(yupp.chat_calls()) == 4
+
+
+def test_batch_size_limits(serve):
+    client = serve(BATCH_MAX_REQUESTS=2)
+    empty = client.post(
+        "/v1/chat/completions/batch", headers=AUTH, json={"requests": []}
+    )
+    assert empty.status_code == 400
+    large = client.post(
+        "/v1/chat/completions/batch",
+        headers=AUTH,
+        json={"requests": [request("q")] * 3},
+    )
+    assert large.status_code == 413
+
+
+def test_batch_job_lifecycle(serve, yupp):
+    client = serve(CLIENT_API_KEYS="test-key,other-key")
+    lines = [
+        json.dumps({"custom_id": f"c{i}", "body": request(f"q{i}")}) for i in range(3)
+    ]
+    lines.append(json.dumps(request("plain body")))
+    created = client.post(
+        "/v1/batches",
+        headers=AUTH,
+        files={"file": ("batch.jsonl", "\n".join(lines) + "\n\n")},
+    )
+    assert created.status_code == 200
+    batch_id = created.json()["id"]
+    assert created.json()["request_counts"]["total"] == 4
+
+    job = wait_for_job(client, batch_id)
+    assert job["status"] == "completed"
+    assert job["request_counts"] == {"total": 4, "completed": 4, "failed": 0}
+    assert not any(key.startswith("_") for key in job)
+
+    results = client.get(f"/v1/batches/{batch_id}/results", headers=AUTH)
+    custom_ids = {json.loads(line)["custom_id"] for line in results.text.splitlines()}
+    assert custom_ids == {"c0", "c1", "c2", None}
+
+    # 其他密钥看不到这个任务
+    other = {"Authorization": "Bearer other-key"}
+    assert client.get(f"/v1/batches/{batch_id}", headers=other).status_code == 404
+
+
+def test_batch_job_rejects_invalid_lines(serve):
+    client = serve()
+    response = client.post(
+        "/v1/batches",
+        headers=AUTH,
+        files={"file": ("batch.jsonl", json.dumps(request("ok")) + "\n{broken\n")},
+    )
+    assert response.status_code == 400
+    assert "line 2" in response.json()["detail"]
+
+
+def upload(client, *items):
+    lines = "\n".join(json.dumps(item) for item in items)
+    return client.post(
+        "/v1/batches", headers=AUTH, files={"file": ("batch.jsonl", lines)}
+    )
+
+
+def blocked_upstream(yupp):
+    """让上游请求等到测试放行，批量任务在此期间保持进行中"""
+    gate = threading.Event()
+
+    def plan():
+        gate.wait(5)
+        return stream_lines()
+
+    yupp.default = plan
+    return gate
+
+
+def test_batch_job_holds_the_key_concurrency_slot(serve, yupp):
+    client = serve(CLIENT_MAX_CONCURRENT=1)
+    gate = blocked_upstream(yupp)
+    batch_id = upload(client, request("q0"), request("q1")).json()["id"]
+
+    chat = {**request("hi"), "stream": False}
+    assert (
+        client.post("/v1/chat/completions", headers=AUTH, json=chat).status_code == 429
+    )
+    assert upload(client, request("q2")).status_code == 429
+
+    gate.set()
+    assert wait_for_job(client, batch_id)["status"] == "completed"
+    assert (
+        client.post("/v1/chat/completions", headers=AUTH, json=chat).status_code == 200
+    )
+
+
+def test_batch_stream_releases_the_slot_when_done(serve):
+    client = serve(CLIENT_MAX_CONCURRENT=1)
+    for _ in range(2):
+        response = client.post(
+            "/v1/chat/completions/batch",
+            headers=AUTH,
+            json={"requests": [request("q0"), request("q1")]},
+        )
+        assert response.status_code == 200
+        assert len(response.text.splitlines()) == 2
+
+
+def test_active_jobs_per_key_are_capped(serve, yupp):
+    client = serve(BATCH_MAX_ACTIVE_JOBS=1)
+    gate = blocked_upstream(yupp)
+    first = upload(client, request("q0")).json()["id"]
+    rejected = upload(client, request("q1"))
+    assert rejected.status_code == 429
+    assert "retry-after" in rejected.headers
+
+    # 取消后的任务不再占用名额
+    client.post(f"/v1/batches/{first}/cancel", headers=AUTH)
+    gate.set()
+    assert wait_for_job(client, first)["status"] == "cancelled"
+    second = upload(client, request("q1"))
+    assert second.status_code == 200
+    assert wait_for_job(client, second.json()["id"])["status"] == "completed"
@@ -0,0 +1,86 @@
+import time
+
+from cache import CompletionCache
+from fake_yupp import AUTH, sse_events, stream_content, stream_lines
+
+BODY = {"model": "M", "messages": [{"role": "user", "content": "hi"}]}
+CACHE = {**AUTH, "X-Completion-Cache": "1"}
+
+
+def test_make_key_normalizes_whitespace():
+    assert CompletionCache.make_key("M", "a  \nb\n") == CompletionCache.make_key(
+        "M", "  a\nb"
+    )
+    assert CompletionCache.make_key("M", "a") != CompletionCache.make_key("N", "a")
+
+
+def test_memory_tier_evicts_and_expires():
+    cache = CompletionCache(max_entries=2, ttl=60)
+    for key in ("a", "b", "c"):
+        cache.put(key, {"content": key})
+    assert cache.get("a") is None
+    entry, size = cache.get("c")
+    assert entry == {"content": "c"} and size > 0
+
+    cache.ttl = 0
+    time.sleep(0.01)
+    assert cache.get("c") is None
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    cache = CompletionCache(max_entries=1, disk_dir=str(tmp_path))
+    cache.put("a", {"content": "first"})
+    cache.put("b", {"content": "second"})
+    reopened = CompletionCache(max_entries=1, disk_dir=str(tmp_path))
+    assert reopened.get("a")[0] == {"content": "first"}
+    assert reopened.stats()["disk_entries"] == 2
+
+
+def test_miss_then_hit_replays_without_upstream(serve, yupp):
+    client = serve()
+    yupp.plans.append(
+        lambda: stream_lines(left=("<think>hmm</think>", "cached answer"))
+    )
+    first = client.post(
+        "/v1/chat/completions", headers=CACHE, json={**BODY, "stream": False}
+    )
+    assert first.headers["x-completion-cache"] == "miss"
+    assert len(yupp.chat_calls()) == 1
+
+    second = client.post(
+        "/v1/chat/completions", headers=CACHE, json={**BODY, "stream": False}
+    )
+    assert second.headers["x-completion-cache"] == "hit"
+    message = second.json()["choices"][0]["message"]
+    assert message["content"] == "cached answer"
+    assert message["reasoning_content"] == "hmm"
+    assert second.json()["usage"] == first.json()["usage"]
+
+    replay = client.post(
+        "/v1/chat/completions",
+        headers=CACHE,
+        json={**BODY, "stream": True, "stream_options": {"include_usage": True}},
+    )
+    assert replay.headers["x-completion-cache"] == "hit"
+    assert stream_content(replay.text) == "cached answer"
+    assert sse_events(replay.text)[-1]["usage"] == first.json()["usage"]
+    assert replay.text.endswith("data: [DONE]\n\n")
+    assert len(yupp.chat_calls()) == 1
+
+    metrics = client.get("/metrics", headers=AUTH).text
+    assert 'yupp_cache_requests_total{result="hit"}' in metrics
+
+
+def test_cache_is_opt_in_and_hits_count_against_rate_limit(serve, yupp):
+    client = serve(CLIENT_RATE_LIMIT="0.01", CLIENT_RATE_BURST="2")
+    response = client.post(
+        "/v1/chat/completions", headers=AUTH, json={**BODY, "stream": False}
+    )
+    assert "x-completion-cache" not in response.headers
+
+    client.post("/v1/chat/completions", headers=CACHE, json={**BODY, "stream": False})
+    limited = client.post(
+        "/v1/chat/completions", headers=CACHE, json={**BODY, "stream": False}
+    )
+    assert limited.status_code == 429
+    assert len(yupp.chat_calls()) == 2
@@ -0,0 +1,121 @@
+import pytest
+from fastapi import HTTPException
+
+from tokenizer import estimate_tokens
+from yyapi import (
+    ChatMessage,
+    compact_messages,
+    get_prompt_budget,
+    message_text,
+    truncate_text,
+)
+
+
+def chat(*pairs):
+    return [ChatMessage(role=role, content=content) for role, content in pairs]
+
+
+def size(messages):
+    return sum(len(message_text(msg)) for msg in messages)
+
+
+@pytest.fixture(autouse=True)
+def keep_recent(monkeypatch):
+    monkeypatch.setenv("PROMPT_KEEP_RECENT", "4")
+
+
+def test_prompt_within_budget_is_untouched():
+    messages = chat(("system", "be brief"), ("user", "hi"))
+    assert compact_messages(messages, "chars", 100) == (messages, 0, 0)
+
+
+def test_older_history_is_dropped_first():
+    messages = chat(
+        ("system", "s" * 20),
+        *[("user" if i % 2 == 0 else "assistant", str(i) * 40) for i in range(8)],
+    )
+    compacted, dropped, affected = compact_messages(messages, "chars", 200)
+    assert size(compacted) <= 200
+    assert compacted[0].role == "system"
+    # 最近 4 条完整保留
+    assert [msg.content for msg in compacted[-4:]] == [
+        msg.content for msg in messages[-4:]
+    ]
+    assert affected >= 1
+    assert dropped == size(messages) - size(compacted)
+
+
+def test_older_message_is_truncated_to_fill_the_budget():
+    messages = chat(("user", "a" * 500), ("assistant", "b" * 20), ("user", "c" * 20))
+    compacted, _, affected = compact_messages(messages, "chars", 150)
+    assert len(compacted) == 3
+    assert compacted[0].content.endswith("...[truncated]")
+    assert size(compacted) <= 150
+    assert affected == 1
+
+
+@pytest.mark.parametrize("text", ["中" * 1000, "x" * 5000, "中文 mixed text " * 300])
+def test_truncate_text_fills_the_token_budget(text):
+    truncated = truncate_text(text, 200, "tokens")
+    assert truncated.endswith(" ...[truncated]")
+    assert 198 <= estimate_tokens(truncated) <= 200
+
+
+def test_truncate_text_chars():
+    assert len(truncate_text("x" * 500, 100, "chars")) == 100
+    assert truncate_text("x" * 500, 63, "chars") is None
+
+
+def test_single_oversized_message_is_truncated():
+    messages = chat(("user", "x" * 5000))
+    compacted, dropped, affected = compact_messages(messages, "chars", 200)
+    assert size(compacted) <= 200
+    assert compacted[0].content.startswith("x" * 100)
+    assert dropped > 4000
+    assert affected == 1
+
+
+def test_kept_messages_are_cut_from_the_oldest():
+    messages = chat(("user", "a" * 500), ("assistant", "b" * 50), ("user", "c" * 500))
+    compacted, _, affected = compact_messages(messages, "chars", 200)
+    assert size(compacted) <= 200
+    assert [msg.role for msg in compacted] == ["user"]
+    assert compacted[0].content.startswith("c")
+    assert affected == 3
+
+
+def test_token_budget():
+    messages = chat(("user", "word " * 2000))
+    compacted, _, _ = compact_messages(messages, "tokens", 100)
+    assert len(message_text(compacted[0])) <= 400
+
+
+def test_last_message_that_cannot_fit_is_rejected():
+    with pytest.raises(HTTPException) as exc:
+        compact_messages(chat(("user", "x" * 100)), "chars", 20)
+    assert exc.value.status_code == 413
+
+
+def test_system_messages_over_budget_are_rejected():
+    with pytest.raises(HTTPException) as exc:
+        compact_messages(chat(("system", "s" * 500), ("user", "hi")), "chars", 200)
+    assert exc.value.status_code == 413
+
+
+def test_truncation_keeps_inline_attachments():
+    image = {"type": "image_url", "image_url": {"url": "attachment:abc"}}
+    messages = [
+        ChatMessage(role="user", content=[{"type": "text", "text": "q" * 500}, image])
+    ]
+    compacted, _, _ = compact_messages(messages, "chars", 200)
+    assert compacted[0].content[-1] == image
+    assert size(compacted) <= 200
+
+
+def test_prompt_budget_prefers_model_settings(monkeypatch):
+    monkeypatch.setenv("MAX_PROMPT_TOKENS", "0")
+    monkeypatch.setenv("MAX_PROMPT_CHARS", "0")
+    assert get_prompt_budget({}) is None
+    assert get_prompt_budget({"maxPromptChars": 300}) == ("chars", 300)
+    monkeypatch.setenv("MAX_PROMPT_TOKENS", "1000")
+    assert get_prompt_budget({}) == ("tokens", 1000)
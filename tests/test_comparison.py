@@ -0,0 +1,66 @@
+from fake_yupp import AUTH, sse_events, stream_content, stream_lines
+
+BODY = {"model": "M", "messages": [{"role": "user", "content": "hi"}], "n": 2}
+
+
+def both_answers():
+    return stream_lines(
+        left=("<think>hmm</think>", "Left ", "answer"),
+        right=("Right ", "answer"),
+        models=("m-left", "m-right"),
+    )
+
+
+def test_non_stream_returns_both_generations(serve, yupp):
+    client = serve()
+    yupp.plans.append(both_answers)
+    response = client.post(
+        "/v1/chat/completions", headers=AUTH, json={**BODY, "stream": False}
+    )
+    assert response.status_code == 200
+    left, right = response.json()["choices"]
+    assert (left["index"], left["model"]) == (0, "m-left")
+    assert left["message"]["content"] == "Left answer"
+    assert left["message"]["reasoning_content"] == "hmm"
+    assert (right["index"], right["model"]) == (1, "m-right")
+    assert right["message"]["content"] == "Right answer"
+    assert len(yupp.chat_calls()) == 1
+
+
+def test_stream_interleaves_choices_by_index(serve, yupp):
+    client = serve()
+    yupp.plans.append(both_answers)
+    response = client.post(
+        "/v1/chat/completions",
+        headers=AUTH,
+        json={**BODY, "stream": True, "stream_options": {"include_usage": True}},
+    )
+    assert stream_content(response.text, 0) == "Left answer"
+    assert stream_content(response.text, 1) == "Right answer"
+
+    events = sse_events(response.text)
+    finished = {
+        choice["index"]
+        for event in events
+        for choice in event["choices"]
+        if choice["finish_reason"] == "stop"
+    }
+    assert finished == {0, 1}
+    models = {
+        choice["index"]: choice.get("model")
+        for event in events
+        for choice in event["choices"]
+        if choice["delta"].get("content")
+    }
+    assert models == {0: "m-left", 1: "m-right"}
+    # usage 包含两个选项的 token
+    usage = events[-1]["usage"]
+    assert usage["completion_tokens"] >= 4
+
+
+def test_other_n_values_are_rejected(serve):
+    client = serve()
+    response = client.post(
+        "/v1/chat/completions", headers=AUTH, json={**BODY, "n": 3, "stream": False}
+    )
+    assert response.status_code == 400
@@ -0,0 +1,132 @@
+from conversations import Conversation, ConversationTable
+from fake_yupp import AUTH, stream_content, stream_lines
+from yyapi import ChatMessage, claim_conversation, conversation_key
+
+
+def test_table_claims_once_and_evicts_oldest():
+    table = ConversationTable(max_entries=2)
+    for key in ("a", "b", "c"):
+        table.record(key, Conversation("tok", f"chat-{key}"))
+    assert table.claim("a") is None
+    assert table.claim("b").chat_id == "chat-b"
+    assert table.claim("b") is None
+
+
+def test_prefix_key_ignores_surrounding_whitespace():
+    assert ConversationTable.prefix_key(
+        "M", [("user", " hi\n")]
+    ) == ConversationTable.prefix_key("M", [("user", "hi")])
+    assert ConversationTable.prefix_key(
+        "M", [("user", "hi")]
+    ) != ConversationTable.prefix_key("N", [("user", "hi")])
+
+
+def test_claim_returns_messages_after_last_reply():
+    table = ConversationTable(max_entries=4)
+    history = [
+        ChatMessage(role="user", content="hi"),
+        ChatMessage(role="assistant", content="hello"),
+    ]
+    table.record(conversation_key("M", history), Conversation("tok", "chat-1"))
+    new = [
+        ChatMessage(role="user", content="more"),
+        ChatMessage(role="user", content="please"),
+    ]
+    conversation, messages = claim_conversation(table, "M", history + new)
+    assert conversation.chat_id == "chat-1"
+    assert messages == new
+
+    # 已经领取过的前缀完整重发
+    conversation, messages = claim_conversation(table, "M", history + new)
+    assert conversation is None
+    assert messages == history + new
+
+
+def test_followup_reuses_upstream_chat(serve, yupp):
+    client = serve(CONVERSATION_TABLE_SIZE=10, YUPP_TOKENS="tok-a,tok-b,tok-c")
+    messages = [
+        {"role": "system", "content": "be brief"},
+        {"role": "user", "content": "hi"},
+    ]
+
+    def send(stream):
+        response = client.post(
+            "/v1/chat/completions",
+            headers=AUTH,
+            json={"model": "M", "messages": messages, "stream": stream},
+        )
+        if stream:
+            return stream_content(response.text)
+        return response.json()["choices"][0]["message"]["content"]
+
+    yupp.plans.append(lambda: stream_lines(left=("first reply",)))
+    messages += [
+        {"role": "assistant", "content": send(True)},
+        {"role": "user", "content": "and then?"},
+    ]
+    yupp.plans.append(lambda: stream_lines(left=("second reply",)))
+    send(False)
+    # 重新生成同一轮：映射已被领取，完整重发到新的上游对话
+    send(True)
+
+    first, followup, regenerate = yupp.chat_calls()
+    chat_id = first["payload"][0]
+    assert followup["payload"][0] == chat_id
+    assert f"/chat/{chat_id}?" in followup["url"]
+    assert followup["headers"]["Cookie"] == first["headers"]["Cookie"]
+    assert "and then?" in followup["payload"][2]
+    assert "be brief" not in followup["payload"][2]
+    assert regenerate["payload"][0] != chat_id
+    assert "be brief" in regenerate["payload"][2]
+
+    metrics = client.get("/metrics", headers=AUTH).text
+    assert 'yupp_conversation_requests_total{result="reused"}' in metrics
+
+
+def test_edited_history_is_sent_in_full(serve, yupp):
+    client = serve(CONVERSATION_TABLE_SIZE=10)
+    messages = [{"role": "user", "content": "hi"}]
+    client.post(
+        "/v1/chat/completions",
+        headers=AUTH,
+        json={"model": "M", "messages": messages, "stream": False},
+    )
+    messages += [
+        {"role": "assistant", "content": "something else"},
+        {"role": "user", "content": "next"},
+    ]
+    client.post(
+        "/v1/chat/completions",
+        headers=AUTH,
+        json={"model": "M", "messages": messages, "stream": False},
+    )
+    first, second = yupp.chat_calls()
+    assert second["payload"][0] != first["payload"][0]
+    assert "something else" in second["payload"][2]
+
+
+def test_each_followup_continues_the_same_chat(serve, yupp):
+    client = serve(CONVERSATION_TABLE_SIZE=10)
+    messages = [{"role": "user", "content": "hi"}]
+    for reply, question in (("one", "more"), ("two", "again")):
+        yupp.plans.append(lambda reply=reply: stream_lines(left=(reply,)))
+        client.post(
+            "/v1/chat/completions",
+            headers=AUTH,
+            json={"model": "M", "messages": messages, "stream": False},
+        )
+        messages += [
+            {"role": "assistant", "content": reply},
+            {"role": "user", "content": question},
+        ]
+    client.post(
+        "/v1/chat/completions",
+        headers=AUTH,
+        json={"model": "M", "messages": messages, "stream": False},
+    )
+    # 服务端保存历史：每轮只发送新消息，chat id 和账户不变
+    first, second, third = yupp.chat_calls()
+    assert first["payload"][0] == second["payload"][0] == third["payload"][0]
+    assert len({call["headers"]["Cookie"] for call in (first, second, third)}) == 1
+    assert "more" in second["payload"][2] and "hi" not in second["payload"][2]
+    assert "again" in third["payload"][2] and "more" not in third["payload"][2]
@@ -0,0 +1,69 @@
+import pytest
+
+import yyapi
+from fake_yupp import AUTH, stream_lines
+
+
+def pick(preferred=None, cost=1.0):
+    account = yyapi.get_best_yupp_account(preferred, cost)
+    if account is None:
+        return None
+    yyapi.release_yupp_account(account)
+    return account.token
+
+
+def test_model_credit_cost():
+    assert yyapi.get_model_credit_cost({}) == 1
+    assert yyapi.get_model_credit_cost({"isPro": True}) == 5
+    assert yyapi.get_model_credit_cost({"isMax": True}) == 20
+    assert yyapi.get_model_credit_cost({"isMax": True, "creditCost": 2}) == 2
+
+
+def test_find_credit_balance_searches_nested_response():
+    data = [{"result": {"data": {"json": {"creditBalance": 42}}}}]
+    assert yyapi.find_credit_balance(data) == 42
+    assert yyapi.find_credit_balance({"other": 1}) is None
+
+
+def test_selection_skips_accounts_without_credits(serve):
+    serve()
+    a, b = yyapi.YUPP_ACCOUNTS
+    yyapi.update_account_credits(a, 0)
+    assert {pick() for _ in range(3)} == {"tok-b"}
+    # 选中后按估算消耗扣减已知余额
+    yyapi.update_account_credits(b, 10)
+    pick(cost=4)
+    assert b.credits == pytest.approx(6)
+
+    yyapi.update_account_credits(b, 0)
+    assert pick() is None
+    # 余额过期后账户重新参与选择
+    a.credits_updated -= 7200
+    assert pick() == "tok-a"
+
+
+def test_expensive_models_prefer_headroom(serve):
+    serve()
+    a, b = yyapi.YUPP_ACCOUNTS
+    yyapi.update_account_credits(a, 10)
+    yyapi.update_account_credits(b, 1000)
+    assert [pick(cost=5) for _ in range(4)] == ["tok-b"] * 4
+    # 对话所在的账户优先，只要余额足够
+    assert pick("tok-a", cost=5) == "tok-a"
+
+
+def test_reward_claim_updates_balance(serve, yupp):
+    client = serve()
+    yupp.plans.append(lambda: stream_lines(reward_id="reward-1"))
+    response = client.post(
+        "/v1/chat/completions",
+        headers=AUTH,
+        json={"model": "M", "messages": [{"role": "user", "content": "hi"}]},
+    )
+    assert response.status_code == 200
+    yyapi.REWARD_EXECUTOR.shutdown(wait=True)
+    claims = [call for call in yupp.calls if "reward.claim" in call["url"]]
+    assert claims[0]["payload"] == {"0": {"json": {"rewardId": "reward-1"}}}
+    assert {acc.credits for acc in yyapi.YUPP_ACCOUNTS} >= {100}
+    metrics = client.get("/metrics", headers=AUTH).text
+    assert "yupp_account_credit_balance" in metrics
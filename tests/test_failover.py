@@ -0,0 +1,87 @@
+import yyapi
+from fake_yupp import AUTH, sse_events, stream_content, stream_lines
+
+BODY = {"model": "M", "messages": [{"role": "user", "content": "fox?"}], "stream": True}
+
+
+def start(serve):
+    return serve(STREAM_FAILOVER_ATTEMPTS=2, YUPP_TOKENS="tok-a,tok-b,tok-c")
+
+
+def reasoning(text):
+    return "".join(
+        choice["delta"].get("reasoning_content") or ""
+        for event in sse_events(text)
+        for choice in event.get("choices", [])
+    )
+
+
+def test_broken_stream_continues_on_another_account(serve, yupp):
+    client = start(serve)
+    yupp.plans += [
+        lambda: stream_lines(left=("The quick brown fox ", "jumps over"), fail=True),
+        lambda: stream_lines(left=("jumps over", " the lazy dog.")),
+    ]
+    response = client.post("/v1/chat/completions", headers=AUTH, json=BODY)
+    assert (
+        stream_content(response.text) == "The quick brown fox jumps over the lazy dog."
+    )
+    assert "error" not in response.text
+
+    first, second = yupp.tokens()
+    assert first != second
+    question = yupp.chat_calls()[1]["payload"][2]
+    assert "The quick brown fox jumps over" in question
+    assert all(acc.in_flight == 0 and not acc.leases for acc in yyapi.YUPP_ACCOUNTS)
+
+
+def test_restarted_answer_and_reasoning_are_trimmed(serve, yupp):
+    client = start(serve)
+    yupp.plans += [
+        lambda: stream_lines(
+            left=("<think>Let me think ", "about foxes.</think>", "The quick "),
+            fail=True,
+            reward_id="reward-old",
+        ),
+        lambda: stream_lines(
+            left=(
+                "<think>Let me think about foxes.</think>",
+                "The quick brown fox.",
+            )
+        ),
+    ]
+    response = client.post("/v1/chat/completions", headers=AUTH, json=BODY)
+    assert stream_content(response.text) == "The quick brown fox."
+    assert reasoning(response.text) == "Let me think about foxes."
+    # 断开的上游流的奖励不会用续写账户领取
+    yyapi.REWARD_EXECUTOR.shutdown(wait=True)
+    assert not [call for call in yupp.calls if "reward.claim" in call["url"]]
+
+
+def test_non_stream_failover(serve, yupp):
+    client = start(serve)
+    yupp.plans += [
+        lambda: stream_lines(left=("Hi ",), fail=True),
+        lambda: stream_lines(left=("there",)),
+    ]
+    response = client.post(
+        "/v1/chat/completions", headers=AUTH, json={**BODY, "stream": False}
+    )
+    assert response.json()["choices"][0]["message"]["content"] == "Hi there"
+
+
+def test_failover_gives_up_after_configured_attempts(serve, yupp):
+    client = start(serve)
+    yupp.plans += [lambda: stream_lines(left=("a",), fail=True)] * 3
+    response = client.post("/v1/chat/completions", headers=AUTH, json=BODY)
+    assert '"error"' in response.text
+    assert len(set(yupp.tokens())) == 3
+    assert all(acc.in_flight == 0 for acc in yyapi.YUPP_ACCOUNTS)
+
+
+def test_failover_is_off_by_default(serve, yupp):
+    client = serve()
+    yupp.plans.append(lambda: stream_lines(left=("a",), fail=True))
+    response = client.post("/v1/chat/completions", headers=AUTH, json=BODY)
+    assert '"error"' in response.text
+    assert len(yupp.chat_calls()) == 1
@@ -0,0 +1,280 @@
+import asyncio
+import time
+
+import pytest
+
+from fake_yupp import AUTH
+
+from leases import (
+    CircuitBreakerLeaseBackend,
+    LeaseBackend,
+    LeaseBackendUnavailable,
+    RedisError,
+    RedisLeaseBackend,
+    SQLiteLeaseBackend,
+    create_lease_backend,
+    token_id,
+)
+from resp_stub import RespStub
+
+
+@pytest.fixture
+def resp_server():
+    server = RespStub()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        backend = LeaseBackend(lease_ttl=60)
+    elif request.param == "sqlite":
+        backend = SQLiteLeaseBackend(str(tmp_path / "leases.db"), lease_ttl=60)
+    else:
+        server = RespStub()
+        request.addfinalizer(server.server_close)
+        request.addfinalizer(server.shutdown)
+        backend = RedisLeaseBackend(server.url, lease_ttl=60)
+    yield backend
+    backend.close()
+
+
+def test_lease_spreads_across_tokens(backend):
+    tokens = ["tok-a", "tok-b", "tok-c"]
+    leased = [backend.lease(tokens)[0] for _ in range(3)]
+    assert sorted(leased) == tokens
+
+
+def test_release_makes_token_least_loaded(backend):
+    tokens = ["tok-a", "tok-b"]
+    first, lease_a = backend.lease(tokens)
+    second, _ = backend.lease(tokens)
+    assert first != second
+    backend.release(first, lease_a)
+    assert backend.lease(tokens)[0] == first
+
+
+def test_preferred_token_wins_while_not_blocked(backend):
+    tokens = ["tok-a", "tok-b"]
+    backend.lease(tokens, preferred="tok-b")
+    assert backend.lease(tokens, preferred="tok-b")[0] == "tok-b"
+    backend.block("tok-b", 60)
+    assert backend.lease(tokens, preferred="tok-b")[0] == "tok-a"
+
+
+def test_block_skips_token_until_it_expires(backend):
+    backend.block("tok-a", 0.2)
+    assert backend.lease(["tok-a"]) is None
+    assert backend.lease(["tok-a", "tok-b"])[0] == "tok-b"
+    time.sleep(0.3)
+    assert backend.lease(["tok-a"])[0] == "tok-a"
+
+
+def test_block_keeps_the_longer_period(backend):
+    backend.block("tok-a", 60)
+    backend.block("tok-a", 0.1)
+    time.sleep(0.2)
+    assert backend.lease(["tok-a"]) is None
+
+
+def test_expired_leases_no_longer_count(backend):
+    backend.lease_ttl = 0.1
+    backend.lease(["tok-a"])
+    backend.lease_ttl = 60
+    backend.lease(["tok-b"])
+    time.sleep(0.2)
+    # tok-a 的租约已过期，tok-b 仍有一个租约
+    assert backend.lease(["tok-a", "tok-b"])[0] == "tok-a"
+
+
+def test_no_tokens(backend):
+    assert backend.lease([]) is None
+
+
+def test_sqlite_backend_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "leases.db")
+    first, second = SQLiteLeaseBackend(path), SQLiteLeaseBackend(path)
+    try:
+        tokens = ["tok-a", "tok-b"]
+        assert first.lease(tokens)[0] != second.lease(tokens)[0]
+        first.block("tok-a", 60)
+        assert second.lease(["tok-a"]) is None
+    finally:
+        first.close()
+        second.close()
+
+
+def test_redis_backend_stores_only_token_digests(resp_server):
+    backend = RedisLeaseBackend(resp_server.url)
+    try:
+        backend.lease(["secret-token"])
+        backend.block("secret-token", 60)
+    finally:
+        backend.close()
+    assert resp_server.data
+    assert all("secret-token" not in key for key in resp_server.data)
+    assert any(token_id("secret-token") in key for key in resp_server.data)
+
+
+def test_redis_backend_authenticates_and_selects_db():
+    server = RespStub(password="p@ss")
+    try:
+        backend = RedisLeaseBackend(server.url.replace("p@ss", "p%40ss"))
+        assert backend.lease(["tok-a"])[0] == "tok-a"
+        assert server.commands[:2] == ["AUTH", "SELECT"]
+        backend.close()
+
+        wrong = RedisLeaseBackend(server.url.replace("p@ss", "wrong"))
+        with pytest.raises(RedisError, match="WRONGPASS"):
+            wrong.lease(["tok-a"])
+        wrong.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_redis_backend_reconnects_after_dropped_connection(resp_server):
+    backend = RedisLeaseBackend(resp_server.url)
+    try:
+        first, _ = backend.lease(["tok-a", "tok-b"])
+        resp_server.drop_next = True
+        second, _ = backend.lease(["tok-a", "tok-b"])
+        assert first != second
+    finally:
+        backend.close()
+
+
+def test_redis_backend_raises_when_server_is_gone(resp_server):
+    backend = RedisLeaseBackend(resp_server.url)
+    resp_server.shutdown()
+    resp_server.server_close()
+    with pytest.raises(OSError):
+        backend.lease(["tok-a"])
+
+
+def test_create_lease_backend(tmp_path):
+    assert type(create_lease_backend("")) is LeaseBackend
+    assert type(create_lease_backend("memory")) is LeaseBackend
+    sqlite = create_lease_backend(f"sqlite:///{tmp_path}/leases.db")
+    assert isinstance(sqlite, CircuitBreakerLeaseBackend)
+    assert isinstance(sqlite.backend, SQLiteLeaseBackend)
+    sqlite.close()
+    redis = create_lease_backend("redis://127.0.0.1:1/0", breaker_seconds=0)
+    assert isinstance(redis, RedisLeaseBackend)
+    with pytest.raises(ValueError):
+        create_lease_backend("rediss://127.0.0.1:6380/0")
+    with pytest.raises(ValueError):
+        create_lease_backend("etcd://127.0.0.1")
+
+
+class FlakyBackend(LeaseBackend):
+    """按 fail 决定 lease 是否出错，并统计调用次数"""
+
+    def __init__(self):
+        super().__init__()
+        self.fail = True
+        self.calls = 0
+
+    def lease(self, tokens, preferred=None):
+        self.calls += 1
+        if self.fail:
+            raise OSError("connection refused")
+        return super().lease(tokens, preferred)
+
+
+def test_breaker_skips_a_failing_backend():
+    flaky = FlakyBackend()
+    breaker = CircuitBreakerLeaseBackend(flaky, open_seconds=60)
+    with pytest.raises(OSError):
+        breaker.lease(["tok-a"])
+    for _ in range(3):
+        with pytest.raises(LeaseBackendUnavailable):
+            breaker.lease(["tok-a"])
+        with pytest.raises(LeaseBackendUnavailable):
+            breaker.release("tok-a", "lease")
+    assert flaky.calls == 1
+
+
+def test_breaker_probes_once_then_recovers():
+    flaky = FlakyBackend()
+    breaker = CircuitBreakerLeaseBackend(flaky, open_seconds=0.05)
+    with pytest.raises(OSError):
+        breaker.lease(["tok-a"])
+    time.sleep(0.06)
+    # 试探失败后重新熔断
+    with pytest.raises(OSError):
+        breaker.lease(["tok-a"])
+    with pytest.raises(LeaseBackendUnavailable):
+        breaker.lease(["tok-a"])
+    time.sleep(0.06)
+    flaky.fail = False
+    assert breaker.lease(["tok-a"])[0] == "tok-a"
+    assert breaker.lease(["tok-a"])[0] == "tok-a"
+    assert flaky.calls == 4
+
+
+def test_breaker_fails_fast_when_redis_is_gone(resp_server):
+    breaker = create_lease_backend(resp_server.url)
+    resp_server.shutdown()
+    resp_server.server_close()
+    with pytest.raises(OSError):
+        breaker.lease(["tok-a"])
+    start = time.monotonic()
+    for _ in range(20):
+        with pytest.raises(LeaseBackendUnavailable):
+            breaker.lease(["tok-a"])
+    assert time.monotonic() - start < 0.5
+
+
+def test_selection_falls_back_locally_while_the_breaker_is_open(serve, monkeypatch):
+    import yyapi
+
+    serve()
+    flaky = FlakyBackend()
+    monkeypatch.setattr(yyapi, "LEASES", CircuitBreakerLeaseBackend(flaky, 60))
+    accounts = [yyapi.get_best_yupp_account(None) for _ in range(3)]
+    assert all(accounts)
+    assert flaky.calls == 1
+    for account in accounts:
+        yyapi.release_yupp_account(account)
+    assert all(account.in_flight == 0 for account in yyapi.YUPP_ACCOUNTS)
+
+
+class LoopRecordingBackend(LeaseBackend):
+    """记录每次调用是否发生在事件循环线程上"""
+
+    def __init__(self):
+        super().__init__()
+        self.on_loop = []
+
+    def _record(self):
+        try:
+            asyncio.get_running_loop()
+            self.on_loop.append(True)
+        except RuntimeError:
+            self.on_loop.append(False)
+
+    def lease(self, tokens, preferred=None):
+        self._record()
+        return super().lease(tokens, preferred)
+
+    def release(self, token, lease_id):
+        self._record()
+        super().release(token, lease_id)
+
+
+def test_completion_calls_the_lease_backend_off_the_event_loop(serve, monkeypatch):
+    import yyapi
+
+    client = serve()
+    recording = LoopRecordingBackend()
+    monkeypatch.setattr(yyapi, "LEASES", recording)
+    response = client.post(
+        "/v1/chat/completions",
+        json={"model": "M", "messages": [{"role": "user", "content": "hi"}]},
+        headers=AUTH,
+    )
+    assert response.status_code == 200
+    assert recording.on_loop == [False, False]
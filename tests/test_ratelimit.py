@@ -0,0 +1,184 @@
+import asyncio
+
+import pytest
+
+from ratelimit import (
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    AdmissionController,
+    ClientRateLimiter,
+    RateLimitExceeded,
+    TokenBucket,
+    call_once,
+    parse_key_priorities,
+    parse_key_weights,
+)
+
+
+def test_parse_key_weights_and_priorities():
+    assert parse_key_weights("sk-a:2, sk-b:0.5,bad,sk-c:x") == {
+        "sk-a": 2.0,
+        "sk-b": 0.5,
+    }
+    assert parse_key_weights(None) == {}
+    assert parse_key_priorities("sk-etl:batch,sk-app:interactive,sk-x:urgent") == {
+        "sk-etl": "batch",
+        "sk-app": "interactive",
+    }
+
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(rate=2, capacity=2)
+    now = bucket.updated
+    assert bucket.take(now) == 0
+    assert bucket.take(now) == 0
+    assert bucket.take(now) == pytest.approx(0.5)
+    assert bucket.take(now + 0.5) == 0
+
+
+def test_rate_limit_per_key_with_weights():
+    limiter = ClientRateLimiter(
+        rate=0.001, burst=2, max_concurrent=0, weights={"big": 2}
+    )
+    for _ in range(2):
+        limiter.acquire("small")
+    with pytest.raises(RateLimitExceeded) as exc:
+        limiter.acquire("small")
+    assert exc.value.retry_after >= 1
+    for _ in range(4):
+        limiter.acquire("big")
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire("big")
+
+
+def test_concurrency_limit_per_key():
+    limiter = ClientRateLimiter(rate=0, burst=5, max_concurrent=1, weights={})
+    limiter.acquire("k")
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire("k")
+    limiter.acquire("other")
+    limiter.release("k")
+    limiter.acquire("k")
+
+
+def test_disabled_limiter_admits_everything():
+    limiter = ClientRateLimiter(rate=0, burst=5, max_concurrent=0, weights={})
+    assert not limiter.enabled
+    for _ in range(100):
+        limiter.acquire("k")
+
+
+def test_call_once():
+    calls = []
+    release = call_once(lambda: calls.append(1))
+    release()
+    release()
+    assert calls == [1]
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_admission_queues_and_hands_over_slots():
+    async def scenario():
+        admission = AdmissionController(1)
+        await admission.acquire("a", 1, 1)
+        waiter = asyncio.create_task(admission.acquire("b", 1, 1))
+        await asyncio.sleep(0.01)
+        assert admission.queued == 1 and not waiter.done()
+        admission.release()
+        await waiter
+        assert admission.active == 1
+
+    run(scenario())
+
+
+def test_admission_times_out():
+    async def scenario():
+        admission = AdmissionController(1)
+        await admission.acquire("a", 1, 1)
+        with pytest.raises(RateLimitExceeded):
+            await admission.acquire("b", 1, 0.05)
+        admission.release()
+        # 超时的等待者不会占用名额
+        assert admission.active == 0
+
+    run(scenario())
+
+
+def test_admission_is_weighted_fair_between_keys():
+    async def scenario():
+        admission = AdmissionController(1)
+        await admission.acquire("holder", 1, 1)
+        order = []
+
+        async def request(key):
+            await admission.acquire(key, 1, 5)
+            order.append(key)
+
+        # 一个密钥先排入大量请求，另一个密钥随后的请求不会排在它们全部之后
+        tasks = [asyncio.create_task(request("heavy")) for _ in range(4)]
+        await asyncio.sleep(0.01)
+        tasks.append(asyncio.create_task(request("light")))
+        await asyncio.sleep(0.01)
+        for _ in range(5):
+            admission.release()
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*tasks)
+        assert order.index("light") <= 1
+
+    run(scenario())
+
+
+def test_batch_cannot_use_interactive_reserve():
+    async def scenario():
+        admission = AdmissionController(4, interactive_reserve=0.5)
+        assert admission.limit(PRIORITY_INTERACTIVE) == 4
+        assert admission.limit(PRIORITY_BATCH) == 2
+        await admission.acquire("etl", 1, 1, PRIORITY_BATCH)
+        await admission.acquire("etl", 1, 1, PRIORITY_BATCH)
+        with pytest.raises(RateLimitExceeded):
+            await admission.acquire("etl", 1, 0.05, PRIORITY_BATCH)
+        await admission.acquire("app", 1, 1, PRIORITY_INTERACTIVE)
+        await admission.acquire("app", 1, 1, PRIORITY_INTERACTIVE)
+        assert admission.active_by_priority == {
+            PRIORITY_INTERACTIVE: 2,
+            PRIORITY_BATCH: 2,
+        }
+
+    run(scenario())
+
+
+def test_interactive_waiters_go_before_batch():
+    async def scenario():
+        admission = AdmissionController(
+            1, priority_weights={PRIORITY_INTERACTIVE: 4, PRIORITY_BATCH: 1}
+        )
+        await admission.acquire("holder", 1, 1)
+        order = []
+
+        async def request(key, priority):
+            await admission.acquire(key, 1, 5, priority)
+            order.append(priority)
+            admission.release(priority)
+
+        tasks = [asyncio.create_task(request("etl", PRIORITY_BATCH))]
+        await asyncio.sleep(0.01)
+        tasks.append(asyncio.create_task(request("app", PRIORITY_INTERACTIVE)))
+        await asyncio.sleep(0.01)
+        admission.release()
+        await asyncio.gather(*tasks)
+        assert order == [PRIORITY_INTERACTIVE, PRIORITY_BATCH]
+
+    run(scenario())
+
+
+def test_unlimited_admission_does_not_queue():
+    async def scenario():
+        admission = AdmissionController(0)
+        for _ in range(10):
+            await admission.acquire("k", 1, 0.01)
+        assert admission.queued == 0
+
+    run(scenario())
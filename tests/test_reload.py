@@ -0,0 +1,79 @@
+import yyapi
+from fake_yupp import AUTH
+
+
+def write_config(directory, **lists):
+    for name, items in lists.items():
+        (directory / name).write_text("".join(f"{item}\n" for item in items))
+
+
+def test_reload_keeps_state_and_drains_removed_tokens(serve, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = tmp_path / "config"
+    config.mkdir()
+    write_config(
+        config,
+        CLIENT_API_KEYS=["test-key"],
+        ADMIN_API_KEYS=["admin-key"],
+        YUPP_TOKENS=["tok-a", "tok-b"],
+    )
+    client = serve(CONFIG_DIR=config, CONFIG_WATCH_INTERVAL=3600)
+    accounts = {acc.token: acc for acc in yyapi.YUPP_ACCOUNTS}
+    accounts["tok-b"].error_count = 2
+    busy = yyapi.get_best_yupp_account("tok-a")
+    assert busy.token == "tok-a"
+
+    write_config(
+        config, CLIENT_API_KEYS=["test-key", "new-key"], YUPP_TOKENS=["tok-b", "tok-c"]
+    )
+    response = client.post(
+        "/admin/reload", headers={"Authorization": "Bearer admin-key"}
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        "status": "reloaded",
+        "client_keys": 2,
+        "accounts": 2,
+        "draining_accounts": 1,
+    }
+
+    current = {acc.token: acc for acc in yyapi.YUPP_ACCOUNTS}
+    assert current["tok-b"] is accounts["tok-b"]
+    assert current["tok-b"].error_count == 2
+    assert current["tok-a"].draining
+    # draining 账户不再分配新请求
+    for _ in range(3):
+        acc = yyapi.get_best_yupp_account(None)
+        assert acc.token != "tok-a"
+        yyapi.release_yupp_account(acc)
+
+    yyapi.release_yupp_account(busy)
+    assert sorted(acc.token for acc in yyapi.YUPP_ACCOUNTS) == ["tok-b", "tok-c"]
+    assert (
+        client.get(
+            "/v1/models", headers={"Authorization": "Bearer new-key"}
+        ).status_code
+        == 200
+    )
+
+
+def test_reload_keeps_previous_lists_when_empty(serve, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = tmp_path / "config"
+    config.mkdir()
+    write_config(config, CLIENT_API_KEYS=["test-key"], YUPP_TOKENS=["tok-a"])
+    client = serve(CONFIG_DIR=config, CONFIG_WATCH_INTERVAL=3600)
+
+    (config / "CLIENT_API_KEYS").write_text("")
+    (config / "YUPP_TOKENS").write_text("# all commented out\n")
+    assert yyapi.reload_config("test") == {
+        "client_keys": 1,
+        "accounts": 1,
+        "draining_accounts": 0,
+    }
+    assert client.get("/v1/models", headers=AUTH).status_code == 200
+
+
+def test_admin_reload_requires_admin_key(serve):
+    client = serve(ADMIN_API_KEYS="admin-key")
+    assert client.post("/admin/reload", headers=AUTH).status_code in (401, 403)
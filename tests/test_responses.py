@@ -0,0 +1,111 @@
+import gzip
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+import responses
+import yyapi
+from fake_yupp import AUTH
+from responses import CompressionMiddleware, choose_encoding, parse_accept_encoding
+
+LARGE = "compressible text " * 200
+
+
+def compressed_app(encodings=("gzip",), minimum_size=100):
+    app = FastAPI()
+
+    @app.get("/large")
+    async def large():
+        return PlainTextResponse(LARGE)
+
+    @app.get("/small")
+    async def small():
+        return PlainTextResponse("tiny")
+
+    @app.get("/stream")
+    async def stream():
+        return StreamingResponse(iter([LARGE, LARGE]), media_type="text/event-stream")
+
+    app.add_middleware(
+        CompressionMiddleware, encodings=encodings, minimum_size=minimum_size
+    )
+    return TestClient(app)
+
+
+def test_accept_encoding_negotiation():
+    assert parse_accept_encoding("gzip;q=0.5, zstd, br;q=x") == {
+        "gzip": 0.5,
+        "zstd": 1.0,
+        "br": 0.0,
+    }
+    assert choose_encoding("gzip, zstd", ("zstd", "gzip")) == "zstd"
+    assert choose_encoding("gzip, zstd;q=0.5", ("zstd", "gzip")) == "gzip"
+    assert choose_encoding("*", ("gzip",)) == "gzip"
+    assert choose_encoding("gzip;q=0, identity", ("gzip",)) is None
+    assert choose_encoding("", ("gzip",)) is None
+
+
+def test_large_responses_are_compressed():
+    client = compressed_app()
+    response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) < len(LARGE)
+    assert response.text == LARGE
+
+    plain = client.get("/large", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert plain.text == LARGE
+
+
+def test_small_and_streaming_responses_pass_through():
+    client = compressed_app()
+    small = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+    stream = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in stream.headers
+    assert stream.text == LARGE * 2
+
+
+@pytest.mark.skipif(responses.zstandard is None, reason="zstandard not installed")
+def test_zstd_is_preferred_when_installed():
+    client = compressed_app(encodings=("zstd", "gzip"))
+    response = client.get("/large", headers={"Accept-Encoding": "gzip, zstd"})
+    assert response.headers["content-encoding"] == "zstd"
+
+
+def test_compress_gzip_round_trip():
+    body = LARGE.encode()
+    assert gzip.decompress(responses.compress(body, "gzip")) == body
+
+
+def test_model_list_is_compressed(serve, monkeypatch):
+    client = serve()
+    monkeypatch.setattr(
+        yyapi,
+        "YUPP_MODELS",
+        [
+            {"label": f"model-{i}", "name": "m-name", "publisher": "p"}
+            for i in range(50)
+        ],
+    )
+    response = client.get("/models", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.json()["data"]) == 50
+
+
+def test_chat_stream_is_not_compressed(serve):
+    client = serve()
+    response = client.post(
+        "/v1/chat/completions",
+        headers={**AUTH, "Accept-Encoding": "gzip"},
+        json={
+            "model": "M",
+            "messages": [{"role": "user", "content": "hi"}],
+            "stream": True,
+        },
+    )
+    assert "content-encoding" not in response.headers
+    assert response.text.endswith("data: [DONE]\n\n")
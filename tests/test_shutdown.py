@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import yyapi
+from fake_yupp import AUTH, stream_content, stream_lines
+
+BODY = {"model": "M", "messages": [{"role": "user", "content": "hi"}]}
+
+
+def test_drain_waits_for_stream_in_progress(serve, yupp):
+    client = serve()
+    seen = {}
+
+    def plan():
+        lines = stream_lines(left=("Hello ", "world"))
+
+        def generate():
+            yield from lines[:3]
+            # 流进行中开始排空：仍计入 ACTIVE_REQUESTS，宽限期内不能结束
+            seen["active"] = yyapi.ACTIVE_REQUESTS
+            yyapi.begin_drain()
+            seen["drained"] = yyapi.wait_for_drain(0)
+            yield from lines[3:]
+
+        return generate()
+
+    yupp.plans.append(plan)
+    response = client.post(
+        "/v1/chat/completions", headers=AUTH, json={**BODY, "stream": True}
+    )
+    assert seen == {"active": 1, "drained": False}
+    assert stream_content(response.text) == "Hello world"
+    assert yyapi.ACTIVE_REQUESTS == 0
+    assert yyapi.wait_for_drain(0)
+
+
+def test_draining_rejects_new_requests(serve):
+    client = serve()
+    assert client.get("/readyz").status_code == 200
+    yyapi.begin_drain()
+
+    response = client.post(
+        "/v1/chat/completions", headers=AUTH, json={**BODY, "stream": False}
+    )
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+    assert client.get("/models").status_code == 503
+    assert client.get("/healthz").status_code == 200
+    ready = client.get("/readyz")
+    assert ready.status_code == 503
+    assert ready.json()["checks"]["accepting"] is False
+
+
+def test_admission_release_is_counted_once(serve):
+    serve()
+
+    async def admit():
+        release = await yyapi.admit_client_request("test-key")
+        assert yyapi.ACTIVE_REQUESTS == 1
+        release()
+        release()
+        assert yyapi.ACTIVE_REQUESTS == 0
+
+        # 排空后批量子请求不再开始，交互式请求由 DrainMiddleware 拒绝
+        yyapi.begin_drain()
+        with pytest.raises(HTTPException) as exc:
+            await yyapi.admit_client_request("test-key", rate_limited=False)
+        assert exc.value.status_code == 503
+        assert yyapi.ACTIVE_REQUESTS == 0
+
+    asyncio.run(admit())
@@ -0,0 +1,55 @@
+from yyapi import ContinuationStitcher
+
+
+def stitch(sent, pieces, **kwargs):
+    stitcher = ContinuationStitcher(sent, **kwargs)
+    return "".join(stitcher.feed(piece) for piece in pieces) + stitcher.flush()
+
+
+def test_overlap_with_the_tail_is_removed():
+    assert stitch(
+        "The quick brown fox jumps over", ["jumps over", " the lazy dog."]
+    ) == (" the lazy dog.")
+
+
+def test_restart_from_the_beginning_is_skipped():
+    sent = "The quick brown fox jumps over"
+    assert stitch(sent, ["The quick ", "brown fox jumps over", " the lazy dog."]) == (
+        " the lazy dog."
+    )
+
+
+def test_exact_replay_emits_nothing():
+    assert stitch("Hello there", ["Hello ", "there"]) == ""
+
+
+def test_continuation_without_overlap_is_kept():
+    assert stitch("Hi there", ["!"]) == "!"
+    assert (
+        stitch("The answer is", [" 42 because ", "of reasons"])
+        == " 42 because of reasons"
+    )
+
+
+def test_short_overlaps_are_not_trimmed():
+    # 少于 min_overlap 个字符的重叠可能只是巧合
+    assert stitch("a cat", ["at home"], min_overlap=8) == "at home"
+
+
+def test_undecided_text_is_released_once_the_window_fills():
+    stitcher = ContinuationStitcher("some earlier output", window=10)
+    assert stitcher.feed("completely ") != ""
+    assert stitcher.feed("new") == "new"
+
+
+def test_nothing_sent_passes_text_through():
+    stitcher = ContinuationStitcher("")
+    assert stitcher.feed("fresh") == "fresh"
+    assert stitcher.flush() == ""
+
+
+def test_flush_is_idempotent():
+    stitcher = ContinuationStitcher("The quick brown fox")
+    assert stitcher.feed("brown fox and more") == ""
+    assert stitcher.flush() == " and more"
+    assert stitcher.flush() == ""
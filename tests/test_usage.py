@@ -0,0 +1,45 @@
+from fake_yupp import AUTH, sse_events
+
+BODY = {"model": "M", "messages": [{"role": "user", "content": "hi"}]}
+
+
+def test_non_stream_reports_usage(serve):
+    client = serve()
+    response = client.post(
+        "/v1/chat/completions", headers=AUTH, json={**BODY, "stream": False}
+    )
+    assert response.status_code == 200
+    usage = response.json()["usage"]
+    assert usage["prompt_tokens"] > 0
+    assert usage["completion_tokens"] > 0
+    assert usage["total_tokens"] == usage["prompt_tokens"] + usage["completion_tokens"]
+
+
+def test_stream_usage_chunk_only_when_requested(serve):
+    client = serve()
+    plain = sse_events(
+        client.post(
+            "/v1/chat/completions", headers=AUTH, json={**BODY, "stream": True}
+        ).text
+    )
+    assert all("usage" not in event for event in plain)
+
+    events = sse_events(
+        client.post(
+            "/v1/chat/completions",
+            headers=AUTH,
+            json={**BODY, "stream": True, "stream_options": {"include_usage": True}},
+        ).text
+    )
+    last = events[-1]
+    assert last["choices"] == []
+    assert last["usage"]["completion_tokens"] > 0
+    assert all("usage" not in event for event in events[:-1])
+
+
+def test_usage_is_exported_per_key(serve):
+    client = serve()
+    client.post("/v1/chat/completions", headers=AUTH, json={**BODY, "stream": False})
+    metrics = client.get("/metrics", headers=AUTH).text
+    assert 'yupp_client_requests_total{key="...-key"}' in metrics
+    assert 'yupp_client_completion_tokens_total{key="...-key"}' in metrics
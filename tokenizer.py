@@ -0,0 +1,63 @@
+from functools import lru_cache
+
+
+# 近似分词器：不依赖具体模型词表，只用于预算检查和用量估算
+# 经验值：英文等 ASCII 文本约 4 个字符 1 个 token，中日韩等非 ASCII 字符约 1 个字符 1 个 token
+ASCII_CHARS_PER_TOKEN = 4
+
+# 只缓存不超过该长度的文本：缓存键是完整字符串，限制长度才能限制缓存的内存占用
+CACHE_MAX_CHARS = 1024
+
+
+def estimate_tokens(text: str) -> int:
+    """快速估算文本的 token 数"""
+    if not text:
+        return 0
+    # str.isascii() 在 CPython 中是 O(1) 的标志位检查，纯 ASCII 文本无需逐字符扫描
+    if text.isascii():
+        return (len(text) + ASCII_CHARS_PER_TOKEN - 1) // ASCII_CHARS_PER_TOKEN
+    ascii_len = len(text.encode("ascii", "ignore"))
+    return (ascii_len + ASCII_CHARS_PER_TOKEN - 1) // ASCII_CHARS_PER_TOKEN + (
+        len(text) - ascii_len
+    )
+
+
+@lru_cache(maxsize=4096)
+def _estimate_tokens_lru(text: str) -> int:
+    return estimate_tokens(text)
+
+
+def estimate_tokens_cached(text: str) -> int:
+    """带缓存的 token 估算，用于多轮对话中反复出现的历史消息前缀
+
+    纯 ASCII 文本的估算本身是 O(1) 的，不进缓存；超过 CACHE_MAX_CHARS 的长文本直接计算。
+    """
+    if text.isascii() or len(text) > CACHE_MAX_CHARS:
+        return estimate_tokens(text)
+    return _estimate_tokens_lru(text)
+
+
+class TokenCounter:
+    """流式增量计数器，分别累计 ASCII 与非 ASCII 字符数，避免逐块取整带来的误差"""
+
+    __slots__ = ("ascii_chars", "other_chars")
+
+    def __init__(self):
+        self.ascii_chars = 0
+        self.other_chars = 0
+
+    def add(self, text: str):
+        if not text:
+            return
+        if text.isascii():
+            self.ascii_chars += len(text)
+            return
+        ascii_len = len(text.encode("ascii", "ignore"))
+        self.ascii_chars += ascii_len
+        self.other_chars += len(text) - ascii_len
+
+    @property
+    def tokens(self) -> int:
+        return (
+            self.ascii_chars + ASCII_CHARS_PER_TOKEN - 1
+        ) // ASCII_CHARS_PER_TOKEN + self.other_chars
@@ -0,0 +1,209 @@
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import requests
+
+
+class Span:
+    __slots__ = ("name", "start_ns", "end_ns", "attributes")
+
+    def __init__(self, name: str, start_ns: int, end_ns: int = 0):
+        self.name = name
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+        self.attributes: Dict[str, Any] = {}
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    """单个请求的轻量级计时记录
+
+    阶段用 span() 记录；流式处理中高频累加的耗时（例如编码）用 add_time() 合并为一个阶段。
+    墙钟时间只在创建时读取一次，其余使用单调时钟。
+    """
+
+    def __init__(self, name: str, sampled: bool = False):
+        self.name = name
+        self.sampled = sampled
+        self.trace_id = uuid.uuid4().hex
+        self.root_span_id = uuid.uuid4().hex[:16]
+        self.start_ns = time.perf_counter_ns()
+        self.start_epoch_ns = time.time_ns()
+        self.spans: List[Span] = []
+        self._totals: Dict[str, int] = {}
+
+    @contextmanager
+    def span(self, name: str):
+        span = Span(name, time.perf_counter_ns())
+        try:
+            yield span
+        finally:
+            span.end_ns = time.perf_counter_ns()
+            self.spans.append(span)
+
+    def start(self, name: str) -> Span:
+        """开始一个跨越多个函数的阶段，需手动调用 end()"""
+        return Span(name, time.perf_counter_ns())
+
+    def end(self, span: Span):
+        if not span.end_ns:
+            span.end_ns = time.perf_counter_ns()
+            self.spans.append(span)
+
+    def elapsed(self, name: str) -> Optional[float]:
+        """从请求开始到指定阶段结束的秒数，阶段尚未结束时返回 None"""
+        for span in self.spans:
+            if span.name == name:
+                return (span.end_ns - self.start_ns) / 1e9
+        return None
+
+    def add_time(self, name: str, duration_ns: int):
+        self._totals[name] = self._totals.get(name, 0) + duration_ns
+
+    def server_timing(self) -> str:
+        """生成 Server-Timing 头的值，单位毫秒"""
+        parts = [f"{span.name};dur={span.duration_ms:.1f}" for span in self.spans]
+        parts.extend(
+            f"{name};dur={total / 1e6:.1f}" for name, total in self._totals.items()
+        )
+        parts.append(
+            f"total;dur={(time.perf_counter_ns() - self.start_ns) / 1e6:.1f}"
+        )
+        return ", ".join(parts)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """转换为 OTLP/JSON 格式（resourceSpans），可直接发送到 OpenTelemetry collector"""
+        offset = self.start_epoch_ns - self.start_ns
+        end_ns = time.perf_counter_ns()
+
+        def otlp_span(name, span_id, parent_id, start_ns, end_ns, attributes):
+            item = {
+                "traceId": self.trace_id,
+                "spanId": span_id,
+                "name": name,
+                "kind": 1,
+                "startTimeUnixNano": str(start_ns + offset),
+                "endTimeUnixNano": str(end_ns + offset),
+                "attributes": [
+                    {"key": key, "value": {"stringValue": str(value)}}
+                    for key, value in attributes.items()
+                ],
+            }
+            if parent_id:
+                item["parentSpanId"] = parent_id
+            return item
+
+        spans = [
+            otlp_span(self.name, self.root_span_id, None, self.start_ns, end_ns, {})
+        ]
+        for span in self.spans:
+            spans.append(
+                otlp_span(
+                    span.name,
+                    uuid.uuid4().hex[:16],
+                    self.root_span_id,
+                    span.start_ns,
+                    span.end_ns,
+                    span.attributes,
+                )
+            )
+        for name, total in self._totals.items():
+            # 累计耗时没有确切的起止时间，挂在根 span 末尾展示
+            spans.append(
+                otlp_span(
+                    name,
+                    uuid.uuid4().hex[:16],
+                    self.root_span_id,
+                    end_ns - total,
+                    end_ns,
+                    {"aggregated": True},
+                )
+            )
+
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": "yupp2api"},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [{"scope": {"name": "yupp2api"}, "spans": spans}],
+                }
+            ]
+        }
+
+
+class TraceExporter:
+    """后台线程导出采样到的 trace，写入 JSONL 文件或 POST 到 OTLP/HTTP 端点"""
+
+    def __init__(
+        self,
+        sample_rate: float,
+        file_path: Optional[str] = None,
+        endpoint: Optional[str] = None,
+    ):
+        self.sample_rate = sample_rate
+        self.file_path = file_path
+        self.endpoint = endpoint
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=1000)
+        self._thread: Optional[threading.Thread] = None
+        if self.enabled:
+            self._thread = threading.Thread(
+                target=self._run, name="trace-exporter", daemon=True
+            )
+            self._thread.start()
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 and bool(self.file_path or self.endpoint)
+
+    def new_trace(self, name: str) -> Trace:
+        sampled = self.enabled and random.random() < self.sample_rate
+        return Trace(name, sampled)
+
+    def export(self, trace: Trace):
+        if not trace.sampled:
+            return
+        try:
+            self._queue.put_nowait(trace.to_otlp())
+        except queue.Full:
+            pass
+
+    def _run(self):
+        session = requests.Session() if self.endpoint else None
+        while True:
+            payload = self._queue.get()
+            try:
+                if self.file_path:
+                    with open(self.file_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(payload) + "\n")
+                if session:
+                    session.post(self.endpoint, json=payload, timeout=5)
+            except Exception as e:
+                print(f"Failed to export trace: {e}")
+
+
+def load_trace_exporter() -> TraceExporter:
+    """从环境变量创建 trace 导出器"""
+    endpoint = os.getenv("TRACE_EXPORT_ENDPOINT")
+    if endpoint and not endpoint.rstrip("/").endswith("/v1/traces"):
+        endpoint = endpoint.rstrip("/") + "/v1/traces"
+    return TraceExporter(
+        sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "0")),
+        file_path=os.getenv("TRACE_EXPORT_FILE") or None,
+        endpoint=endpoint,
+    )
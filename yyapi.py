@@ -1,18 +1,80 @@
+import asyncio
+import functools
 import json
+import math
 import os
 import re
+import signal
 import time
 import uuid
 import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from typing import Any, Dict, List, Optional, TypedDict, Union, Generator
+from http.cookiejar import DefaultCookiePolicy
+from typing import (
+    Any,
+    AsyncGenerator,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+    Generator,
+)
+import anyio
 import requests
-from fastapi import FastAPI, HTTPException, Depends, Query
-from fastapi.responses import StreamingResponse
+from fastapi import (
+    FastAPI,
+    HTTPException,
+    Depends,
+    File,
+    Header,
+    Query,
+    Response,
+    UploadFile,
+)
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
+from attachments import (
+    Attachment,
+    AttachmentCache,
+    AttachmentError,
+    attachment_refs,
+    is_inline,
+    content_text,
+    decode_attachments,
+)
+from cache import CompletionCache
+from conversations import Conversation, ConversationTable
+from leases import (
+    LeaseBackend,
+    LeaseBackendUnavailable,
+    create_lease_backend,
+    token_id,
+)
+from metrics import registry as metrics
+from monitor import LoopMonitor, configure_threadpool
+from ratelimit import (
+    PRIORITY_BATCH,
+    PRIORITY_CLASSES,
+    PRIORITY_INTERACTIVE,
+    AdmissionController,
+    ClientRateLimiter,
+    RateLimitExceeded,
+    call_once,
+    parse_key_priorities,
+    parse_key_weights,
+)
+from responses import CompressionMiddleware, ModelJSONResponse
+from tracing import Trace, TraceExporter, load_trace_exporter
+from tokenizer import TokenCounter, estimate_tokens, estimate_tokens_cached
 
 
 def create_requests_session():
@@ -22,21 +84,173 @@ def create_requests_session():
     adapter = requests.adapters.HTTPAdapter(max_retries=3)
     session.mount("http://", adapter)
     session.mount("https://", adapter)
+    # 多个账户共用连接池，不在 session 中保存任何 cookie，账户 token 只通过请求头传递
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+_session_local = threading.local()
+_pooled_sessions: List[requests.Session] = []
+
+
+def get_requests_session() -> requests.Session:
+    """获取当前线程复用的 requests session，复用与 Yupp 的 TLS 连接"""
+    session = getattr(_session_local, "session", None)
+    if session is None:
+        session = create_requests_session()
+        _session_local.session = session
+        with lifecycle_lock:
+            _pooled_sessions.append(session)
     return session
 
 
-class YuppAccount(TypedDict):
-    token: str
-    is_valid: bool
-    last_used: float
-    error_count: int
+def close_requests_sessions():
+    """关闭所有复用的 session 及其连接池"""
+    with lifecycle_lock:
+        sessions = list(_pooled_sessions)
+        _pooled_sessions.clear()
+    for session in sessions:
+        try:
+            session.close()
+        except Exception as e:
+            print(f"Error closing session: {e}")
+
+
+class YuppAccount:
+    """Yupp 账户及其调度状态，调度时频繁读写，使用 __slots__ 减少内存和属性查找开销"""
+
+    __slots__ = (
+        "token",
+        "is_valid",
+        "last_used",
+        "error_count",
+        "in_flight",
+        "draining",
+        "leases",
+        "credits",
+        "credits_updated",
+    )
+
+    def __init__(self, token: str):
+        self.token = token
+        self.is_valid = True
+        self.last_used = 0.0
+        self.error_count = 0
+        self.in_flight = 0
+        self.draining = False
+        self.leases: List[str] = []  # 租约后端返回的租约 ID，随请求结束逐个归还
+        self.credits: Optional[float] = None  # 最近一次得知的积分余额，None 表示未知
+        self.credits_updated = 0.0
 
 
-VALID_CLIENT_KEYS: set = set()
+VALID_CLIENT_KEYS: frozenset = frozenset()
+ADMIN_API_KEYS: frozenset = frozenset()
 YUPP_ACCOUNTS: List[YuppAccount] = []
 YUPP_MODELS: List[Dict[str, Any]] = []
 account_rotation_lock = threading.Lock()
+model_refresh_lock = threading.Lock()
 DEBUG_MODE = False
+RATE_LIMITER = ClientRateLimiter(0, 0, 0, {})
+ADMISSION = AdmissionController(0)
+lifecycle_lock = threading.Lock()
+DRAINING = threading.Event()
+ACTIVE_REQUESTS = 0
+ACTIVE_BY_PRIORITY: Dict[str, int] = {p: 0 for p in PRIORITY_CLASSES}
+CLIENT_KEY_PRIORITIES: Dict[str, str] = {}
+PENDING_REWARD_CLAIMS = 0
+REWARD_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="reward")
+COMPLETION_CACHE: Optional[CompletionCache] = None
+LEASES = LeaseBackend()
+CONVERSATIONS: Optional[ConversationTable] = None
+ATTACHMENT_UPLOADS = AttachmentCache(256)
+BATCH_JOBS: Dict[str, Dict[str, Any]] = {}
+TRACER = TraceExporter(0)
+LOOP_MONITOR: Optional[LoopMonitor] = None
+
+# 每条消息的角色前缀等格式开销（近似 token 数）
+MESSAGE_OVERHEAD_TOKENS = 3
+
+# 故障转移时附在部分回答之后的续写指令
+CONTINUATION_PROMPT = (
+    "Your previous answer was cut off. Continue it exactly where it stopped, "
+    "without repeating any of it."
+)
+
+metrics.describe(
+    "yupp_cache_requests_total", "counter", "Completion cache lookups by result"
+)
+metrics.describe(
+    "yupp_cache_bytes_saved_total",
+    "counter",
+    "Bytes of completions served from the cache",
+)
+metrics.describe(
+    "yupp_conversation_requests_total",
+    "counter",
+    "Follow-up turns by upstream chat reuse result",
+)
+metrics.describe(
+    "yupp_account_credit_balance",
+    "gauge",
+    "Last known (or locally estimated) credit balance per Yupp account",
+)
+metrics.describe(
+    "yupp_account_credit_skipped_total",
+    "counter",
+    "Account selections that skipped an account with too few credits",
+)
+metrics.describe(
+    "yupp_attachment_uploads_total",
+    "counter",
+    "Attachments sent upstream, uploaded or reused from the cache",
+)
+metrics.describe(
+    "yupp_attachment_bytes_total", "counter", "Attachment bytes uploaded to Yupp"
+)
+metrics.describe(
+    "yupp_stream_failovers_total",
+    "counter",
+    "Mid-stream upstream failures by failover result",
+)
+metrics.describe(
+    "yupp_priority_requests_total", "counter", "Admitted completions per priority class"
+)
+metrics.describe(
+    "yupp_priority_active_requests", "gauge", "In-flight completions per priority class"
+)
+metrics.describe(
+    "yupp_admission_wait_seconds",
+    "histogram",
+    "Time spent waiting for admission per priority class",
+)
+metrics.describe(
+    "yupp_time_to_first_token_seconds",
+    "histogram",
+    "Time from request arrival to the first streamed token per priority class",
+)
+metrics.describe(
+    "yupp_slo_violations_total",
+    "counter",
+    "Completions whose time to first token exceeded the class SLO",
+)
+metrics.describe(
+    "yupp_client_rate_limited_total",
+    "counter",
+    "Requests rejected with 429 per client key",
+)
+metrics.describe(
+    "yupp_client_requests_total", "counter", "Completed completions per client key"
+)
+metrics.describe(
+    "yupp_client_prompt_tokens_total",
+    "counter",
+    "Approximate prompt tokens per client key",
+)
+metrics.describe(
+    "yupp_client_completion_tokens_total",
+    "counter",
+    "Approximate completion tokens per client key",
+)
 
 
 class ChatMessage(BaseModel):
@@ -52,6 +266,12 @@ class ChatCompletionRequest(BaseModel):
     temperature: Optional[float] = None
     max_tokens: Optional[int] = None
     top_p: Optional[float] = None
+    n: Optional[int] = None
+    stream_options: Optional[Dict[str, Any]] = None
+
+
+class BatchCompletionRequest(BaseModel):
+    requests: List[ChatCompletionRequest]
 
 
 class ModelInfo(BaseModel):
@@ -72,6 +292,12 @@ class ChatCompletionChoice(BaseModel):
     finish_reason: str = "stop"
 
 
+class ComparisonChoice(ChatCompletionChoice):
+    """n=2 时的选项，附带生成该选项的模型"""
+
+    model: Optional[str] = None
+
+
 class ChatCompletionResponse(BaseModel):
     id: str = Field(default_factory=lambda: f"chatcmpl-{uuid.uuid4().hex}")
     object: str = "chat.completion"
@@ -87,6 +313,10 @@ class ChatCompletionResponse(BaseModel):
     )
 
 
+class ComparisonCompletionResponse(ChatCompletionResponse):
+    choices: List[ComparisonChoice]
+
+
 class StreamChoice(BaseModel):
     delta: Dict[str, Any] = Field(default_factory=dict)
     index: int = 0
@@ -101,21 +331,101 @@ class StreamResponse(BaseModel):
     choices: List[StreamChoice]
 
 
+class ComparisonStreamChoice(StreamChoice):
+    model: Optional[str] = None
+
+
+class ComparisonStreamResponse(StreamResponse):
+    choices: List[ComparisonStreamChoice]
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用启动和关闭时的生命周期管理"""
+    global TRACER, LOOP_MONITOR
     # 启动时执行
     print("Starting Yupp.ai OpenAI API Adapter server...")
+    configure_threadpool(int(os.getenv("THREADPOOL_SIZE", "0")))
+    LOOP_MONITOR = LoopMonitor(
+        interval=float(os.getenv("LOOP_MONITOR_INTERVAL", "1")),
+        alert_threshold=float(os.getenv("LOOP_LAG_ALERT_THRESHOLD", "0.25")),
+    )
+    LOOP_MONITOR.start()
     load_client_api_keys()
+    load_rate_limits()
+    load_completion_cache()
+    load_conversation_table()
+    load_attachment_cache()
+    load_lease_backend()
+    TRACER = load_trace_exporter()
     load_yupp_accounts()
     load_yupp_models()
+
+    # SIGHUP 触发配置热加载
+    if hasattr(signal, "SIGHUP"):
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGHUP, reload_config, "SIGHUP"
+            )
+        except (RuntimeError, ValueError, NotImplementedError) as e:
+            # 非主线程运行事件循环时（例如嵌入测试客户端）无法注册信号
+            print(f"Warning: SIGHUP reload unavailable: {e}")
+    if os.getenv("CONFIG_DIR"):
+        threading.Thread(
+            target=watch_config_dir,
+            args=(float(os.getenv("CONFIG_WATCH_INTERVAL", "5")),),
+            daemon=True,
+        ).start()
+    credit_balance_url = os.getenv("CREDIT_BALANCE_URL")
+    credit_refresh_interval = float(os.getenv("CREDIT_REFRESH_INTERVAL", "600"))
+    if credit_balance_url and credit_refresh_interval > 0:
+        threading.Thread(
+            target=refresh_credit_balances,
+            args=(credit_balance_url, credit_refresh_interval),
+            name="credit-refresh",
+            daemon=True,
+        ).start()
     print("Server initialization completed.")
 
     yield
-    # 关闭时执行
+    # 关闭时执行：排空进行中的请求和奖励队列，再关闭连接池
+    begin_drain()
+    await LOOP_MONITOR.stop()
+    await asyncio.get_running_loop().run_in_executor(
+        None, wait_for_drain, float(os.getenv("SHUTDOWN_GRACE_PERIOD", "30"))
+    )
+    REWARD_EXECUTOR.shutdown(wait=False)
+    close_requests_sessions()
+    LEASES.close()
     print("Server shutdown completed.")
 
 
+class DrainMiddleware:
+    """排空模式下拒绝新请求（包括 /models），让负载均衡把流量切走
+
+    使用纯 ASGI 中间件，避免 BaseHTTPMiddleware 对流式响应的额外转发开销。
+    健康检查端点不受影响：排空期间 /healthz 仍然存活，/readyz 报告未就绪。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] == "http"
+            and DRAINING.is_set()
+            and scope["path"] not in ("/healthz", "/readyz")
+        ):
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "Server is shutting down."},
+                headers={"Connection": "close", "Retry-After": "5"},
+            )
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
 app = FastAPI(title="Yupp.ai OpenAI API Adapter", lifespan=lifespan)
 
 app.add_middleware(TrustedHostMiddleware, allowed_hosts=["*"])
@@ -126,6 +436,16 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(DrainMiddleware)
+app.add_middleware(
+    CompressionMiddleware,
+    encodings=[
+        name.strip()
+        for name in os.getenv("RESPONSE_COMPRESSION", "zstd,gzip").split(",")
+        if name.strip()
+    ],
+    minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")),
+)
 security = HTTPBearer(auto_error=False)
 
 
@@ -135,96 +455,378 @@ def log_debug(message: str):
         print(f"[DEBUG] {message}")
 
 
-def load_client_api_keys():
-    """Load client API keys from environment variables"""
-    global VALID_CLIENT_KEYS
+def begin_drain():
+    """进入排空模式：不再接受新请求，/models 返回未就绪"""
+    if not DRAINING.is_set():
+        DRAINING.set()
+        print("Draining: no longer accepting new requests.")
+
+
+def wait_for_drain(grace_period: float) -> bool:
+    """等待进行中的流和奖励队列完成，超过宽限期返回 False"""
+    deadline = time.monotonic() + grace_period
+    while True:
+        with lifecycle_lock:
+            active, pending = ACTIVE_REQUESTS, PENDING_REWARD_CLAIMS
+        if active == 0 and pending == 0:
+            return True
+        if time.monotonic() >= deadline:
+            print(
+                f"Drain grace period expired with {active} active requests "
+                f"and {pending} pending reward claims."
+            )
+            return False
+        time.sleep(0.2)
+
+
+def read_config_list(name: str, strict: bool = False) -> Optional[List[str]]:
+    """读取逗号或换行分隔的列表配置，未配置时返回 None
 
-    env_keys = os.getenv("CLIENT_API_KEYS")
-    if not env_keys:
+    优先级：CONFIG_DIR 目录下的同名文件（如 CONFIG_DIR/YUPP_TOKENS）> {name}_FILE 指定的文件 > 环境变量
+    strict 为 True 时文件读取失败抛出 OSError，否则视为未配置。
+    """
+    path = None
+    config_dir = os.getenv("CONFIG_DIR")
+    if config_dir and os.path.isfile(os.path.join(config_dir, name)):
+        path = os.path.join(config_dir, name)
+    elif os.getenv(f"{name}_FILE"):
+        path = os.getenv(f"{name}_FILE")
+
+    if path:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                raw = f.read()
+        except OSError as e:
+            print(f"Error reading {name} from {path}: {e}")
+            if strict:
+                raise
+            return None
+        lines = [line.split("#", 1)[0] for line in raw.splitlines()]
+        raw = ",".join(lines)
+    else:
+        raw = os.getenv(name)
+        if not raw:
+            return None
+
+    return [item.strip() for item in raw.split(",") if item.strip()]
+
+
+def load_client_api_keys(reload: bool = False):
+    """Load client and admin API keys, swapping the key sets atomically
+
+    热加载时读到空列表或文件读取失败（例如编辑器写入到一半）保留原来的密钥集合。
+    """
+    global VALID_CLIENT_KEYS, ADMIN_API_KEYS
+
+    try:
+        admin_keys = read_config_list("ADMIN_API_KEYS", strict=reload)
+    except OSError:
+        admin_keys = None
+    if reload and not admin_keys and ADMIN_API_KEYS:
+        print(
+            "Warning: ADMIN_API_KEYS is empty or unreadable, keeping the previous admin keys."
+        )
+    else:
+        ADMIN_API_KEYS = frozenset(admin_keys or [])
+
+    try:
+        keys = read_config_list("CLIENT_API_KEYS", strict=reload)
+    except OSError:
+        keys = None
+    if reload and not keys and VALID_CLIENT_KEYS:
+        print(
+            "Warning: CLIENT_API_KEYS is empty or unreadable, keeping the previous client keys."
+        )
+        return
+    if not keys:
         print(
             "Error: CLIENT_API_KEYS environment variable not found. Client authentication will fail."
         )
-        VALID_CLIENT_KEYS = set()
+        VALID_CLIENT_KEYS = frozenset()
         return
 
-    try:
-        # 支持逗号分隔的多个密钥
-        keys = [key.strip() for key in env_keys.split(",") if key.strip()]
-        VALID_CLIENT_KEYS = set(keys)
+    # 整体替换集合，请求处理中读取到的总是完整的旧集合或新集合
+    VALID_CLIENT_KEYS = frozenset(keys)
+    print(f"Successfully loaded {len(VALID_CLIENT_KEYS)} client API keys.")
+
+
+def load_rate_limits():
+    """Load per-client-key rate limits and admission settings from environment variables"""
+    global RATE_LIMITER, ADMISSION
+
+    RATE_LIMITER = ClientRateLimiter(
+        rate=float(os.getenv("CLIENT_RATE_LIMIT", "0")),
+        burst=float(os.getenv("CLIENT_RATE_BURST", "5")),
+        max_concurrent=int(os.getenv("CLIENT_MAX_CONCURRENT", "0")),
+        weights=parse_key_weights(os.getenv("CLIENT_KEY_WEIGHTS")),
+    )
+    ADMISSION = AdmissionController(
+        int(os.getenv("MAX_CONCURRENT_REQUESTS", "0")),
+        interactive_reserve=float(os.getenv("INTERACTIVE_RESERVE", "0.25")),
+        priority_weights=parse_key_weights(
+            os.getenv("PRIORITY_WEIGHTS", "interactive:4,batch:1")
+        ),
+    )
+    CLIENT_KEY_PRIORITIES.clear()
+    CLIENT_KEY_PRIORITIES.update(parse_key_priorities(os.getenv("CLIENT_KEY_PRIORITIES")))
+    if RATE_LIMITER.enabled or ADMISSION.max_concurrent > 0:
         print(
-            f"Successfully loaded {len(VALID_CLIENT_KEYS)} client API keys from environment variables."
+            f"Rate limits: {RATE_LIMITER.rate} req/s per key, "
+            f"{RATE_LIMITER.max_concurrent} concurrent per key, "
+            f"{ADMISSION.max_concurrent} concurrent in total "
+            f"({ADMISSION.limit(PRIORITY_BATCH)} for batch)."
         )
-    except Exception as e:
-        print(f"Error parsing CLIENT_API_KEYS environment variable: {e}")
-        VALID_CLIENT_KEYS = set()
 
 
-def load_yupp_accounts():
-    """Load Yupp accounts from environment variables"""
+def load_yupp_accounts(reload: bool = False):
+    """Load Yupp accounts, keeping the state of tokens that are still configured
+
+    新增的 token 加入账户池；已移除的 token 标记为 draining，不再分配新请求，
+    等进行中的流结束后再从账户池中删除。
+    热加载时读到空列表或文件读取失败保留原来的账户池。
+    """
     global YUPP_ACCOUNTS
-    YUPP_ACCOUNTS = []
 
-    env_tokens = os.getenv("YUPP_TOKENS")
-    if not env_tokens:
+    try:
+        tokens = read_config_list("YUPP_TOKENS", strict=reload)
+    except OSError:
+        tokens = None
+    if reload and not tokens and YUPP_ACCOUNTS:
+        print(
+            "Warning: YUPP_TOKENS is empty or unreadable, keeping the previous accounts."
+        )
+        return
+    if not tokens:
         print("Error: YUPP_TOKENS environment variable not found. API calls will fail.")
+        tokens = []
+
+    with account_rotation_lock:
+        existing = {acc.token: acc for acc in YUPP_ACCOUNTS}
+        wanted = set(tokens)
+        accounts = []
+        for token in dict.fromkeys(tokens):
+            acc = existing.get(token)
+            if acc is None:
+                acc = YuppAccount(token)
+            acc.draining = False
+            accounts.append(acc)
+
+        draining = 0
+        for token, acc in existing.items():
+            if token in wanted:
+                continue
+            if acc.in_flight > 0:
+                acc.draining = True
+                accounts.append(acc)
+                draining += 1
+
+        YUPP_ACCOUNTS = accounts
+
+    added = len(wanted - existing.keys())
+    removed = len(existing.keys() - wanted)
+    print(
+        f"Successfully loaded {len(wanted)} Yupp accounts "
+        f"({added} added, {removed} removed, {draining} draining)."
+    )
+
+
+def release_yupp_account(account: YuppAccount):
+    """请求结束后归还账户，draining 账户在最后一个流结束后移出账户池"""
+    global YUPP_ACCOUNTS
+
+    with account_rotation_lock:
+        account.in_flight = max(account.in_flight - 1, 0)
+        lease_id = account.leases.pop() if account.leases else None
+        if account.draining and account.in_flight == 0:
+            YUPP_ACCOUNTS = [acc for acc in YUPP_ACCOUNTS if acc is not account]
+            log_debug(f"Drained account ...{account.token[-4:]}")
+
+    if lease_id:
+        try:
+            LEASES.release(account.token, lease_id)
+        except LeaseBackendUnavailable as e:
+            log_debug(f"Account lease not released: {e}")
+        except Exception as e:
+            print(f"Failed to release account lease: {e}")
+
+
+def invalidate_yupp_account(account: YuppAccount):
+    """标记账户失效，并通过租约后端通知其他副本"""
+    with account_rotation_lock:
+        account.is_valid = False
+    print(f"Account ...{account.token[-4:]} marked as invalid due to auth error.")
+    try:
+        LEASES.block(account.token, float(os.getenv("INVALID_TOKEN_BLOCK", "86400")))
+    except LeaseBackendUnavailable as e:
+        log_debug(f"Account invalidation not shared: {e}")
+    except Exception as e:
+        print(f"Failed to share account invalidation: {e}")
+
+
+def record_yupp_account_error(account: YuppAccount):
+    """累计账户错误次数，达到上限时让所有副本一起冷却该账户"""
+    max_error_count = int(os.getenv("MAX_ERROR_COUNT", "3"))
+    with account_rotation_lock:
+        account.error_count += 1
+        error_count = account.error_count
+    print(f"Account ...{account.token[-4:]} error count: {error_count}")
+    if error_count == max_error_count:
+        try:
+            LEASES.block(account.token, float(os.getenv("ERROR_COOLDOWN", "300")))
+        except LeaseBackendUnavailable as e:
+            log_debug(f"Account cooldown not shared: {e}")
+        except Exception as e:
+            print(f"Failed to share account cooldown: {e}")
+
+
+async def run_account_call(func: Callable[..., Any], *args) -> Any:
+    """在线程池中执行账户选择、归还和错误记录
+
+    租约后端可能需要网络往返，不能阻塞事件循环；调用屏蔽取消，
+    客户端断开时归还账户等收尾操作仍会执行完，不泄漏 in_flight 和租约。
+    """
+    with anyio.CancelScope(shield=True):
+        return await run_in_threadpool(func, *args)
+
+
+def reload_config(source: str = "manual") -> Dict[str, int]:
+    """重新加载客户端密钥和 Yupp token，不中断进行中的请求"""
+    if os.path.exists(".env"):
+        from dotenv import load_dotenv
+
+        load_dotenv(override=True)
+
+    print(f"Reloading configuration ({source})...")
+    load_client_api_keys(reload=True)
+    load_yupp_accounts(reload=True)
+    return {
+        "client_keys": len(VALID_CLIENT_KEYS),
+        "accounts": sum(1 for acc in YUPP_ACCOUNTS if not acc.draining),
+        "draining_accounts": sum(1 for acc in YUPP_ACCOUNTS if acc.draining),
+    }
+
+
+def watch_config_dir(interval: float):
+    """轮询 CONFIG_DIR 中配置文件的修改时间，变化时自动重新加载"""
+
+    def snapshot():
+        config_dir = os.getenv("CONFIG_DIR")
+        result = {}
+        for name in ("CLIENT_API_KEYS", "ADMIN_API_KEYS", "YUPP_TOKENS"):
+            path = os.path.join(config_dir, name)
+            try:
+                stat = os.stat(path)
+                result[name] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                result[name] = None
+        return result
+
+    last = snapshot()
+    while True:
+        time.sleep(interval)
+        current = snapshot()
+        if current != last:
+            last = current
+            try:
+                reload_config("config dir changed")
+            except Exception as e:
+                print(f"Error reloading configuration: {e}")
+
+
+def load_completion_cache():
+    """Configure the opt-in completion cache from environment variables"""
+    global COMPLETION_CACHE
+
+    max_entries = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", "1024"))
+    if max_entries <= 0:
+        COMPLETION_CACHE = None
+        return
+
+    disk_dir = os.getenv("COMPLETION_CACHE_DIR") or None
+    COMPLETION_CACHE = CompletionCache(
+        max_entries=max_entries,
+        max_bytes=int(os.getenv("COMPLETION_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+        ttl=float(os.getenv("COMPLETION_CACHE_TTL", "3600")),
+        disk_dir=disk_dir,
+        disk_max_bytes=int(
+            os.getenv("COMPLETION_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024))
+        ),
+    )
+    print(
+        f"Completion cache: {max_entries} entries in memory"
+        + (f", disk tier at {disk_dir}" if disk_dir else "")
+        + "."
+    )
+
+
+def load_conversation_table():
+    """Configure sticky conversation routing from environment variables"""
+    global CONVERSATIONS
+
+    max_entries = int(os.getenv("CONVERSATION_TABLE_SIZE", "0"))
+    if max_entries <= 0:
+        CONVERSATIONS = None
         return
 
+    CONVERSATIONS = ConversationTable(max_entries)
+    print(f"Sticky conversation routing: up to {max_entries} conversations.")
+
+
+def load_attachment_cache():
+    """Configure the uploaded attachment cache from environment variables"""
+    global ATTACHMENT_UPLOADS
+
+    ATTACHMENT_UPLOADS = AttachmentCache(int(os.getenv("ATTACHMENT_CACHE_SIZE", "256")))
+
+
+def load_lease_backend():
+    """Configure the account lease backend shared between replicas"""
+    global LEASES
+
+    spec = os.getenv("LEASE_BACKEND", "memory")
     try:
-        # 支持逗号分隔的多个token
-        tokens = [token.strip() for token in env_tokens.split(",") if token.strip()]
-        for token in tokens:
-            YUPP_ACCOUNTS.append(
-                {
-                    "token": token,
-                    "is_valid": True,
-                    "last_used": 0,
-                    "error_count": 0,
-                }
-            )
-        print(
-            f"Successfully loaded {len(YUPP_ACCOUNTS)} Yupp accounts from environment variables."
+        LEASES = create_lease_backend(
+            spec,
+            float(os.getenv("LEASE_TTL", "600")),
+            float(os.getenv("LEASE_BREAKER_SECONDS", "30")),
         )
     except Exception as e:
-        print(f"Error parsing YUPP_TOKENS environment variable: {e}")
+        print(f"Error configuring LEASE_BACKEND={spec}: {e}. Using in-process leases.")
+        LEASES = LeaseBackend()
+        return
+    backend = getattr(LEASES, "backend", LEASES)
+    print(f"Account lease backend: {type(backend).__name__}.")
 
 
 def load_yupp_models():
-    """Load Yupp models from model.json, auto-fetch if file doesn't exist"""
-    global YUPP_MODELS
+    """Load Yupp models from the on-disk snapshot, fetching in the background if missing
+
+    Startup never waits on the network: the service becomes ready as soon as a
+    catalog is available (see /readyz).
+    """
     model_file = os.getenv("MODEL_FILE", "./model/model.json")
 
-    # 检查模型文件是否存在
-    if not os.path.exists(model_file):
-        print(f"模型文件 {model_file} 不存在，尝试自动获取模型数据...")
-        try:
-            # 导入并调用 model.py 中的函数
-            from model import fetch_and_save_models
+    if os.path.exists(model_file):
+        read_model_snapshot(model_file)
+        if os.getenv("MODEL_REFRESH_ON_START", "false").lower() == "true":
+            start_model_refresh(model_file)
+    else:
+        print(f"模型文件 {model_file} 不存在，将在后台自动获取模型数据...")
+        start_model_refresh(model_file)
 
-            success = fetch_and_save_models(model_file)
-            if success:
-                print(f"成功自动获取并保存模型数据到 {model_file}")
-            else:
-                print(f"自动获取模型数据失败，将使用空的模型列表")
-                YUPP_MODELS = []
-                return
-        except ImportError as e:
-            print(f"无法导入 model.py 模块: {e}")
-            YUPP_MODELS = []
-            return
-        except Exception as e:
-            print(f"自动获取模型数据时发生错误: {e}")
-            YUPP_MODELS = []
-            return
 
-    # 加载模型文件
+def read_model_snapshot(model_file: str):
+    """Load the model catalog from a model.json snapshot"""
+    global YUPP_MODELS
     try:
         with open(model_file, "r", encoding="utf-8") as f:
-            YUPP_MODELS = json.load(f)
-            if not isinstance(YUPP_MODELS, list):
-                YUPP_MODELS = []
-                print(f"Warning: {model_file} should contain a list of model objects.")
-                return
-            print(f"Successfully loaded {len(YUPP_MODELS)} models from {model_file}.")
+            models = json.load(f)
+        if not isinstance(models, list):
+            YUPP_MODELS = []
+            print(f"Warning: {model_file} should contain a list of model objects.")
+            return
+        YUPP_MODELS = models
+        print(f"Successfully loaded {len(YUPP_MODELS)} models from {model_file}.")
     except FileNotFoundError:
         print(f"Error: {model_file} not found. Model list will be empty.")
         YUPP_MODELS = []
@@ -233,20 +835,113 @@ def load_yupp_models():
         YUPP_MODELS = []
 
 
-def get_best_yupp_account() -> Optional[YuppAccount]:
-    """Get the best available Yupp account using a smart selection algorithm."""
+def start_model_refresh(model_file: str):
+    threading.Thread(
+        target=refresh_yupp_models, args=(model_file,), name="model-refresh", daemon=True
+    ).start()
+
+
+def refresh_yupp_models(model_file: str):
+    """从 Yupp 获取最新模型数据写入快照并重新加载，失败时保留当前模型列表"""
+    if not model_refresh_lock.acquire(blocking=False):
+        return
+    try:
+        # 导入并调用 model.py 中的函数
+        from model import fetch_and_save_models
+
+        if fetch_and_save_models(model_file):
+            print(f"成功自动获取并保存模型数据到 {model_file}")
+            read_model_snapshot(model_file)
+        else:
+            print("自动获取模型数据失败，保留当前的模型列表")
+    except ImportError as e:
+        print(f"无法导入 model.py 模块: {e}")
+    except Exception as e:
+        print(f"自动获取模型数据时发生错误: {e}")
+    finally:
+        model_refresh_lock.release()
+
+
+def get_model_credit_cost(model_info: Dict[str, Any]) -> float:
+    """估算模型单次请求消耗的积分
+
+    优先使用 model.json 中模型条目的 creditCost，其次按目录中的 isMax / isPro 标记
+    使用环境变量 CREDIT_COST_MAX / CREDIT_COST_PRO，其余模型使用 CREDIT_COST_DEFAULT。
+    """
+    cost = model_info.get("creditCost")
+    if cost is None:
+        if model_info.get("isMax"):
+            cost = os.getenv("CREDIT_COST_MAX", "20")
+        elif model_info.get("isPro"):
+            cost = os.getenv("CREDIT_COST_PRO", "5")
+        else:
+            cost = os.getenv("CREDIT_COST_DEFAULT", "1")
+    return max(float(cost), 0.0)
+
+
+def update_account_credits(account: YuppAccount, balance: float):
+    """记录账户的积分余额，并更新指标"""
+    with account_rotation_lock:
+        account.credits = float(balance)
+        account.credits_updated = time.time()
+    metrics.set("yupp_account_credit_balance", account.credits, account=mask_key(account.token))
+
+
+def known_credits(account: YuppAccount, now: float) -> Optional[float]:
+    """返回仍在有效期内的积分余额，过期或从未得知时返回 None
+
+    余额过期后账户重新参与调度，耗尽的账户在积分恢复后不会被一直跳过。
+    """
+    if account.credits is None:
+        return None
+    if now - account.credits_updated > float(os.getenv("CREDIT_BALANCE_TTL", "3600")):
+        return None
+    return account.credits
+
+
+def get_best_yupp_account(
+    preferred_token: Optional[str] = None,
+    credit_cost: float = 0.0,
+    priority: str = PRIORITY_INTERACTIVE,
+    exclude_tokens: Iterable[str] = (),
+) -> Optional[YuppAccount]:
+    """Get the best available Yupp account using a smart selection algorithm.
+
+    Locally usable accounts are offered to the lease backend, which picks the
+    token with the fewest active leases across replicas (then least recently
+    used) and skips tokens another replica has invalidated or put in cooldown.
+    If preferred_token names an available account it is chosen regardless of
+    rotation order, so a conversation can stay on the account holding its chat.
+    Accounts in exclude_tokens are never chosen, e.g. when failing over.
+
+    Accounts whose known credit balance is below credit_cost are skipped. For
+    models that cost credits, accounts holding at least CREDIT_HEADROOM times
+    the cost (or with an unknown balance) are preferred, so expensive models do
+    not drain nearly empty tokens. The chosen account's known balance is
+    reduced by the cost until the next reward claim or refresh reports the
+    real balance.
+
+    An INTERACTIVE_RESERVE share of the usable accounts is kept for interactive
+    traffic: batch requests only borrow those accounts while no interactive
+    request is in flight. The reserved accounts are picked by token digest, so
+    every replica reserves the same ones.
+    """
     max_error_count = int(os.getenv("MAX_ERROR_COUNT", "3"))
     error_cooldown = int(os.getenv("ERROR_COOLDOWN", "300"))
+    headroom = float(os.getenv("CREDIT_HEADROOM", "5"))
 
+    exclude_tokens = set(exclude_tokens)
     with account_rotation_lock:
         now = time.time()
         valid_accounts = [
             acc
             for acc in YUPP_ACCOUNTS
-            if acc["is_valid"]
+            if acc.is_valid
+            and not acc.draining
+            and acc.token not in exclude_tokens
             and (
-                acc["error_count"] < max_error_count
-                or now - acc["last_used"] > error_cooldown
+                acc.error_count < max_error_count
+                or now - acc.last_used > error_cooldown
             )
         ]
 
@@ -256,16 +951,207 @@ def get_best_yupp_account() -> Optional[YuppAccount]:
         # Reset error count for accounts that have been in cooldown
         for acc in valid_accounts:
             if (
-                acc["error_count"] >= max_error_count
-                and now - acc["last_used"] > error_cooldown
+                acc.error_count >= max_error_count
+                and now - acc.last_used > error_cooldown
             ):
-                acc["error_count"] = 0
+                acc.error_count = 0
+
+        funded = []
+        for acc in valid_accounts:
+            credits = known_credits(acc, now)
+            if credits is not None and credits < credit_cost:
+                continue
+            funded.append(acc)
+        if len(funded) < len(valid_accounts):
+            metrics.inc(
+                "yupp_account_credit_skipped_total", len(valid_accounts) - len(funded)
+            )
+        if not funded:
+            return None
+        valid_accounts = funded
+
+        reserve = float(os.getenv("INTERACTIVE_RESERVE", "0.25"))
+        if (
+            priority == PRIORITY_BATCH
+            and reserve > 0
+            and len(valid_accounts) > 1
+            and ACTIVE_BY_PRIORITY[PRIORITY_INTERACTIVE] > 0
+        ):
+            reserved = min(math.ceil(len(valid_accounts) * reserve), len(valid_accounts) - 1)
+            valid_accounts = sorted(valid_accounts, key=lambda acc: token_id(acc.token))[
+                reserved:
+            ]
 
-        # Sort by last used (oldest first) and error count (lowest first)
-        valid_accounts.sort(key=lambda x: (x["last_used"], x["error_count"]))
-        account = valid_accounts[0]
-        account["last_used"] = now
-        return account
+        if credit_cost > 0:
+            well_funded = [
+                acc
+                for acc in valid_accounts
+                if acc.token == preferred_token
+                or (known_credits(acc, now) or float("inf")) >= credit_cost * headroom
+            ]
+            if well_funded:
+                valid_accounts = well_funded
+
+    by_token = {acc.token: acc for acc in valid_accounts}
+    lease_id = None
+    try:
+        leased = LEASES.lease(list(by_token), preferred_token)
+        if leased is None:
+            return None
+        token, lease_id = leased
+        account = by_token[token]
+    except Exception as e:
+        # 共享后端不可用时退回本地选择，不影响请求；熔断期间不重复打印
+        if isinstance(e, LeaseBackendUnavailable):
+            log_debug(f"Account lease backend {e}, selecting locally")
+        else:
+            print(f"Account lease backend error, selecting locally: {e}")
+        account = by_token.get(preferred_token)
+        if account is None:
+            # Sort by last used (oldest first) and error count (lowest first)
+            account = min(valid_accounts, key=lambda x: (x.last_used, x.error_count))
+
+    with account_rotation_lock:
+        account.last_used = time.time()
+        account.in_flight += 1
+        if lease_id:
+            account.leases.append(lease_id)
+        if account.credits is not None and credit_cost > 0:
+            account.credits = max(account.credits - credit_cost, 0.0)
+            credits = account.credits
+        else:
+            credits = None
+    if credits is not None:
+        metrics.set("yupp_account_credit_balance", credits, account=mask_key(account.token))
+    return account
+
+
+def message_text(msg: ChatMessage) -> str:
+    """获取消息的文本内容，列表形式的 content 只取文本片段，附件随 payload 单独上传"""
+    return msg.content if isinstance(msg.content, str) else content_text(msg.content)
+
+
+def get_prompt_budget(model_info: Dict[str, Any]) -> Optional[Tuple[str, int]]:
+    """获取模型的提示词预算，返回 (单位, 上限)，未配置时返回 None
+
+    优先使用 model.json 中模型条目的 maxPromptTokens / maxPromptChars，
+    其次使用环境变量 MAX_PROMPT_TOKENS / MAX_PROMPT_CHARS，0 表示不限制。
+    """
+    for unit, key, env_name in (
+        ("tokens", "maxPromptTokens", "MAX_PROMPT_TOKENS"),
+        ("chars", "maxPromptChars", "MAX_PROMPT_CHARS"),
+    ):
+        limit = model_info.get(key) or int(os.getenv(env_name, "0"))
+        if limit and int(limit) > 0:
+            return unit, int(limit)
+    return None
+
+
+def truncate_text(text: str, budget: int, unit: str) -> Optional[str]:
+    """截断文本，保留开头部分使其用量不超过 budget；预算不足 64 个单位时返回 None"""
+    # 至少保留 64 个单位才有意义
+    if budget < 64:
+        return None
+    measure = estimate_tokens if unit == "tokens" else len
+    suffix = " ...[truncated]"
+    # 用量随前缀长度单调增加，二分查找放得进预算的最长前缀；
+    # 中日韩字符约 1 个字符 1 个 token，不能按 ASCII 的 4 个字符 1 个 token 估算截断位置
+    low, high = 0, min(len(text), budget * 4 if unit == "tokens" else budget)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if measure(text[:mid] + suffix) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + suffix
+
+
+def truncated_message(msg: ChatMessage, text: str) -> ChatMessage:
+    """用截断后的文本替换消息内容，列表形式 content 中的内联附件保留"""
+    if isinstance(msg.content, str):
+        return ChatMessage(role=msg.role, content=text)
+    parts = [part for part in msg.content if isinstance(part, dict) and is_inline(part)]
+    return ChatMessage(role=msg.role, content=[{"type": "text", "text": text}, *parts])
+
+
+def compact_messages(
+    messages: List[ChatMessage], unit: str, limit: int
+) -> Tuple[List[ChatMessage], int, int]:
+    """按预算压缩对话历史
+
+    保留所有系统消息和最近 PROMPT_KEEP_RECENT 条消息，更早的消息从新到旧依次放入剩余预算，
+    放不下的第一条截断保留开头部分，其余丢弃。
+    系统消息和最近的消息本身已超出预算时，从最早的一条开始截断或丢弃最近的消息，
+    最后一条消息也放不下时返回 413。
+    返回 (压缩后的消息列表, 丢弃的用量, 丢弃或截断的消息数)，用量单位与预算一致。
+    """
+    measure = estimate_tokens if unit == "tokens" else len
+    keep_recent = int(os.getenv("PROMPT_KEEP_RECENT", "4"))
+
+    costs = [measure(message_text(msg)) for msg in messages]
+    total = sum(costs)
+    if total <= limit:
+        return messages, 0, 0
+
+    system_idx = [i for i, msg in enumerate(messages) if msg.role == "system"]
+    dialog_idx = [i for i, msg in enumerate(messages) if msg.role != "system"]
+    recent_idx = dialog_idx[-keep_recent:] if keep_recent > 0 else []
+    older_idx = dialog_idx[: len(dialog_idx) - len(recent_idx)]
+
+    remaining = limit - sum(costs[i] for i in system_idx + recent_idx)
+    kept: Dict[int, ChatMessage] = {i: messages[i] for i in system_idx + recent_idx}
+    affected = 0
+
+    for i in reversed(older_idx):
+        if costs[i] <= remaining:
+            kept[i] = messages[i]
+            remaining -= costs[i]
+            continue
+
+        affected += 1
+        truncated = truncate_text(message_text(messages[i]), remaining, unit)
+        if truncated is not None:
+            kept[i] = truncated_message(messages[i], truncated)
+            remaining -= measure(truncated)
+        # 截断一条之后更早的消息全部丢弃
+        affected += sum(1 for j in older_idx if j < i)
+        break
+
+    # 保护的消息本身超出预算：从最早的一条开始截断，放不下的丢弃
+    for i in recent_idx:
+        if remaining >= 0:
+            break
+        affected += 1
+        truncated = truncate_text(message_text(messages[i]), costs[i] + remaining, unit)
+        if truncated is not None:
+            kept[i] = truncated_message(messages[i], truncated)
+            remaining += costs[i] - measure(truncated)
+        elif i == dialog_idx[-1]:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Prompt exceeds the {limit} {unit} budget for this model.",
+            )
+        else:
+            del kept[i]
+            remaining += costs[i]
+    if remaining < 0:
+        # 没有可压缩的对话消息（例如只有系统消息）
+        raise HTTPException(
+            status_code=413,
+            detail=f"Prompt exceeds the {limit} {unit} budget for this model.",
+        )
+
+    compacted = [kept[i] for i in sorted(kept)]
+    dropped = total - sum(measure(message_text(msg)) for msg in compacted)
+    return compacted, dropped, affected
+
+
+def count_prompt_tokens(messages: List[ChatMessage]) -> int:
+    """估算提示词 token 数，历史消息的估算结果会被缓存，多轮对话只需计算新增消息"""
+    return sum(
+        estimate_tokens_cached(message_text(msg)) + MESSAGE_OVERHEAD_TOKENS
+        for msg in messages
+    )
 
 
 def format_messages_for_yupp(messages: List[ChatMessage]) -> str:
@@ -276,21 +1162,13 @@ def format_messages_for_yupp(messages: List[ChatMessage]) -> str:
     system_messages = [msg for msg in messages if msg.role == "system"]
     if system_messages:
         for sys_msg in system_messages:
-            content = (
-                sys_msg.content
-                if isinstance(sys_msg.content, str)
-                else json.dumps(sys_msg.content)
-            )
-            formatted.append(content)
+            formatted.append(message_text(sys_msg))
 
     # 处理用户和助手消息
     user_assistant_msgs = [msg for msg in messages if msg.role != "system"]
     for msg in user_assistant_msgs:
         role = "Human" if msg.role == "user" else "Assistant"
-        content = (
-            msg.content if isinstance(msg.content, str) else json.dumps(msg.content)
-        )
-        formatted.append(f"\n\n{role}: {content}")
+        formatted.append(f"\n\n{role}: {message_text(msg)}")
 
     # 确保以Assistant:结尾
     if not formatted or not formatted[-1].strip().startswith("Assistant:"):
@@ -304,6 +1182,31 @@ def format_messages_for_yupp(messages: List[ChatMessage]) -> str:
     return result
 
 
+def conversation_key(model: str, messages: List[ChatMessage]) -> str:
+    return ConversationTable.prefix_key(
+        model, ((msg.role, message_text(msg)) for msg in messages)
+    )
+
+
+def claim_conversation(
+    table: ConversationTable, model: str, messages: List[ChatMessage]
+) -> Tuple[Optional[Conversation], List[ChatMessage]]:
+    """查找可以续接的上游对话，返回 (对话, 需要发送的新消息)
+
+    以最后一条助手回复之前（含）的消息前缀查表，命中时只需发送其后的新消息。
+    """
+    last_assistant = next(
+        (i for i in range(len(messages) - 2, -1, -1) if messages[i].role == "assistant"),
+        -1,
+    )
+    if last_assistant < 0:
+        return None, messages
+    conversation = table.claim(conversation_key(model, messages[: last_assistant + 1]))
+    if conversation is None:
+        return None, messages
+    return conversation, messages[last_assistant + 1 :]
+
+
 async def authenticate_client(
     auth: Optional[HTTPAuthorizationCredentials] = Depends(security),
 ):
@@ -324,34 +1227,257 @@ async def authenticate_client(
     if auth.credentials not in VALID_CLIENT_KEYS:
         raise HTTPException(status_code=403, detail="Invalid client API key.")
 
+    return auth.credentials
 
-def get_models_list_response() -> ModelList:
-    """Helper to construct ModelList response from cached models."""
-    model_infos = [
-        ModelInfo(
-            id=model.get("label", "unknown"),
-            created=int(time.time()),
-            owned_by=model.get("publisher", "unknown"),
+
+async def authenticate_admin(
+    auth: Optional[HTTPAuthorizationCredentials] = Depends(security),
+):
+    """Authenticate admin endpoints against ADMIN_API_KEYS"""
+    if not ADMIN_API_KEYS:
+        raise HTTPException(
+            status_code=503,
+            detail="Service unavailable: Admin API keys not configured on server.",
         )
-        for model in YUPP_MODELS
-    ]
-    return ModelList(data=model_infos)
 
+    if not auth or not auth.credentials:
+        raise HTTPException(
+            status_code=401,
+            detail="API key required in Authorization header.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
 
-@app.get("/v1/models", response_model=ModelList)
-async def list_v1_models(_: None = Depends(authenticate_client)):
-    """List available models - authenticated"""
-    return get_models_list_response()
+    if auth.credentials not in ADMIN_API_KEYS:
+        raise HTTPException(status_code=403, detail="Invalid admin API key.")
 
+    return auth.credentials
 
-@app.get("/models", response_model=ModelList)
-async def list_models_no_auth():
-    """List available models without authentication - for client compatibility"""
-    return get_models_list_response()
 
+def mask_key(key: Optional[str]) -> str:
+    """日志和指标中只展示密钥的末四位"""
+    return f"...{key[-4:]}" if key else "unknown"
 
-def claim_yupp_reward(account: YuppAccount, reward_id: str):
-    """同步领取Yupp奖励"""
+
+def resolve_priority(client_key: str, requested: Optional[str] = None) -> str:
+    """确定请求的优先级：X-Priority 请求头优先，其次是 CLIENT_KEY_PRIORITIES
+
+    配置为 batch 的密钥不能通过请求头提升为 interactive。
+    """
+    configured = CLIENT_KEY_PRIORITIES.get(client_key, PRIORITY_INTERACTIVE)
+    if not requested:
+        return configured
+    requested = requested.strip().lower()
+    if requested not in PRIORITY_CLASSES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid X-Priority '{requested}', expected one of: {', '.join(PRIORITY_CLASSES)}.",
+        )
+    return PRIORITY_BATCH if configured == PRIORITY_BATCH else requested
+
+
+def record_first_token(trace: Trace, priority: str):
+    """记录首 token 时延，超过该优先级的 SLO（SLO_TTFT_INTERACTIVE / SLO_TTFT_BATCH）时计数"""
+    ttft = trace.elapsed("first_token")
+    if ttft is None:
+        return
+    metrics.observe("yupp_time_to_first_token_seconds", ttft, priority=priority)
+    slo = float(os.getenv(f"SLO_TTFT_{priority.upper()}", "0"))
+    if slo > 0 and ttft > slo:
+        metrics.inc("yupp_slo_violations_total", priority=priority)
+
+
+async def admit_client_request(
+    client_key: str,
+    rate_limited: bool = True,
+    priority: str = PRIORITY_INTERACTIVE,
+):
+    """按客户端密钥限流并获取全局并发名额，返回只执行一次的释放函数
+
+    批量任务的子请求传入 rate_limited=False，只占用全局并发名额，单密钥名额由整个批量占用；
+    排空开始后不再接纳批量子请求，返回 503。
+    batch 优先级的请求排队等待 BATCH_ADMISSION_TIMEOUT，而不是 ADMISSION_TIMEOUT。
+    """
+    global ACTIVE_REQUESTS
+    limiter, admission = RATE_LIMITER, ADMISSION
+    draining_error = HTTPException(
+        status_code=503,
+        detail="Server is shutting down; batch request was not started.",
+    )
+    if not rate_limited and DRAINING.is_set():
+        raise draining_error
+    timeout = (
+        os.getenv("BATCH_ADMISSION_TIMEOUT", "600")
+        if priority == PRIORITY_BATCH
+        else os.getenv("ADMISSION_TIMEOUT", "30")
+    )
+    if rate_limited:
+        try:
+            limiter.acquire(client_key)
+        except RateLimitExceeded as e:
+            metrics.inc("yupp_client_rate_limited_total", key=mask_key(client_key))
+            raise HTTPException(
+                status_code=429,
+                detail=str(e),
+                headers={"Retry-After": str(e.retry_after)},
+            )
+
+    try:
+        await admission.acquire(
+            client_key, limiter.weight(client_key), float(timeout), priority
+        )
+    except RateLimitExceeded as e:
+        if rate_limited:
+            limiter.release(client_key)
+        metrics.inc("yupp_client_rate_limited_total", key=mask_key(client_key))
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except BaseException:
+        if rate_limited:
+            limiter.release(client_key)
+        raise
+
+    with lifecycle_lock:
+        # 与 wait_for_drain 在同一把锁下检查，排队期间开始排空的批量子请求不再执行
+        if not rate_limited and DRAINING.is_set():
+            admission.release(priority)
+            raise draining_error
+        ACTIVE_REQUESTS += 1
+        ACTIVE_BY_PRIORITY[priority] += 1
+        active = ACTIVE_BY_PRIORITY[priority]
+    metrics.inc("yupp_priority_requests_total", priority=priority)
+    metrics.set("yupp_priority_active_requests", active, priority=priority)
+
+    def release():
+        global ACTIVE_REQUESTS
+        admission.release(priority)
+        if rate_limited:
+            limiter.release(client_key)
+        with lifecycle_lock:
+            ACTIVE_REQUESTS -= 1
+            ACTIVE_BY_PRIORITY[priority] -= 1
+            active = ACTIVE_BY_PRIORITY[priority]
+        metrics.set("yupp_priority_active_requests", active, priority=priority)
+
+    return call_once(release)
+
+
+def release_on_close(iterator, release) -> Generator[str, None, None]:
+    """流式响应结束、出错或客户端断开后释放名额"""
+    try:
+        yield from iterator
+    finally:
+        release()
+
+
+def get_models_list_response() -> ModelList:
+    """Helper to construct ModelList response from cached models."""
+    model_infos = [
+        ModelInfo(
+            id=model.get("label", "unknown"),
+            created=int(time.time()),
+            owned_by=model.get("publisher", "unknown"),
+        )
+        for model in YUPP_MODELS
+    ]
+    return ModelList(data=model_infos)
+
+
+@app.get("/v1/models", response_model=ModelList)
+async def list_v1_models(_: str = Depends(authenticate_client)):
+    """List available models - authenticated"""
+    return ModelJSONResponse(get_models_list_response())
+
+
+@app.get("/models", response_model=ModelList)
+async def list_models_no_auth():
+    """List available models without authentication - for client compatibility"""
+    return ModelJSONResponse(get_models_list_response())
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness probe - the process is up and serving the event loop"""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness probe - models loaded, a usable account, client keys, not draining"""
+    checks = {
+        "models": bool(YUPP_MODELS),
+        "accounts": any(acc.is_valid and not acc.draining for acc in YUPP_ACCOUNTS),
+        "client_keys": bool(VALID_CLIENT_KEYS),
+        "accepting": not DRAINING.is_set(),
+    }
+    ready = all(checks.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not ready", "checks": checks},
+    )
+
+
+@app.post("/admin/reload")
+async def admin_reload(_: str = Depends(authenticate_admin)):
+    """Reload client keys and Yupp tokens without restarting - admin only"""
+    return {"status": "reloaded", **reload_config("admin endpoint")}
+
+
+@app.get("/admin/profile/cpu")
+async def admin_profile_cpu(
+    seconds: float = Query(10, gt=0, le=300),
+    interval: float = Query(0.005, ge=0.001, le=1),
+    _: str = Depends(authenticate_admin),
+):
+    """Sample all thread stacks for N seconds, collapsed-stack output - admin only"""
+    # 按需导入，避免启动时加载 tracemalloc
+    from profiler import ProfilerBusy, sample_cpu
+
+    try:
+        collapsed = await run_in_threadpool(sample_cpu, seconds, interval)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return Response(
+        content=collapsed,
+        media_type="text/plain",
+        headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'},
+    )
+
+
+@app.get("/admin/profile/memory")
+async def admin_profile_memory(
+    seconds: float = Query(10, gt=0, le=300),
+    top: int = Query(30, ge=1, le=500),
+    group_by: str = Query("lineno", pattern="^(lineno|filename|traceback)$"),
+    frames: int = Query(1, ge=1, le=50),
+    path: Optional[str] = Query(None),
+    _: str = Depends(authenticate_admin),
+):
+    """tracemalloc snapshot diff over N seconds - admin only"""
+    from profiler import ProfilerBusy, memory_diff
+
+    try:
+        return await run_in_threadpool(
+            memory_diff, seconds, top, group_by, frames, path
+        )
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.get("/metrics")
+async def get_metrics(_: str = Depends(authenticate_client)):
+    """Prometheus-format metrics - authenticated"""
+    if LOOP_MONITOR:
+        LOOP_MONITOR.sample_threadpool()
+    return Response(
+        content=metrics.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+def claim_yupp_reward(account: YuppAccount, reward_id: str):
+    """同步领取Yupp奖励"""
     try:
         log_debug(f"Claiming reward {reward_id}...")
         url = "https://yupp.ai/api/trpc/reward.claim?batch=1"
@@ -360,232 +1486,615 @@ def claim_yupp_reward(account: YuppAccount, reward_id: str):
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36 Edg/137.0.0.0",
             "Content-Type": "application/json",
             "sec-fetch-site": "same-origin",
-            "Cookie": f"__Secure-yupp.session-token={account['token']}",
+            "Cookie": f"__Secure-yupp.session-token={account.token}",
         }
-        session = create_requests_session()
+        session = get_requests_session()
         response = session.post(url, json=payload, headers=headers)
         response.raise_for_status()
         data = response.json()
         balance = data[0]["result"]["data"]["json"]["currentCreditBalance"]
         print(f"Reward claimed successfully. New balance: {balance}")
+        update_account_credits(account, balance)
         return balance
     except Exception as e:
         print(f"Failed to claim reward {reward_id}. Error: {e}")
         return None
 
 
+def find_credit_balance(data: Any) -> Optional[float]:
+    """在余额接口的响应中查找积分余额字段"""
+    if isinstance(data, dict):
+        for key in ("currentCreditBalance", "creditBalance", "credits", "balance"):
+            value = data.get(key)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return float(value)
+        data = list(data.values())
+    if isinstance(data, list):
+        for item in data:
+            balance = find_credit_balance(item)
+            if balance is not None:
+                return balance
+    return None
+
+
+def fetch_yupp_credit_balance(account: YuppAccount, url: str) -> Optional[float]:
+    """以账户身份请求 CREDIT_BALANCE_URL，返回积分余额"""
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36 Edg/137.0.0.0",
+        "sec-fetch-site": "same-origin",
+        "Cookie": f"__Secure-yupp.session-token={account.token}",
+    }
+    response = get_requests_session().get(url, headers=headers, timeout=30)
+    response.raise_for_status()
+    return find_credit_balance(response.json())
+
+
+def refresh_credit_balances(url: str, interval: float):
+    """定期刷新所有账户的积分余额
+
+    领取奖励的响应也会带回余额，这里补充长时间没有流量的账户，
+    以及余额耗尽被跳过、等待积分恢复的账户。
+    """
+    while True:
+        for account in list(YUPP_ACCOUNTS):
+            if not account.is_valid or account.draining:
+                continue
+            try:
+                balance = fetch_yupp_credit_balance(account, url)
+            except Exception as e:
+                log_debug(f"Credit balance refresh failed for {mask_key(account.token)}: {e}")
+                continue
+            if balance is not None:
+                update_account_credits(account, balance)
+        time.sleep(interval)
+
+
+def upload_yupp_attachment(account: YuppAccount, attachment: Attachment) -> Dict[str, Any]:
+    """上传一个附件，返回 Yupp 请求 payload 中的附件描述
+
+    与网页端一致：先申请预签名上传地址，PUT 文件内容，再登记为附件。
+    """
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36 Edg/137.0.0.0",
+        "Content-Type": "application/json",
+        "sec-fetch-site": "same-origin",
+        "Cookie": f"__Secure-yupp.session-token={account.token}",
+    }
+    session = get_requests_session()
+    response = session.post(
+        "https://yupp.ai/api/trpc/chat.createPresignedURLForUpload?batch=1",
+        json={
+            "0": {
+                "json": {
+                    "fileName": attachment.file_name,
+                    "fileSize": len(attachment.data),
+                    "contentType": attachment.content_type,
+                }
+            }
+        },
+        headers=headers,
+    )
+    response.raise_for_status()
+    upload = response.json()[0]["result"]["data"]["json"]
+
+    response = session.put(
+        upload["signedUrl"],
+        data=attachment.data,
+        headers={"Content-Type": attachment.content_type},
+    )
+    response.raise_for_status()
+
+    response = session.post(
+        "https://yupp.ai/api/trpc/chat.createAttachmentForUploadedFile?batch=1",
+        json={
+            "0": {
+                "json": {
+                    "fileName": attachment.file_name,
+                    "contentType": attachment.content_type,
+                    "fileId": upload["fileId"],
+                }
+            }
+        },
+        headers=headers,
+    )
+    response.raise_for_status()
+    info = response.json()[0]["result"]["data"]["json"]
+    return {
+        "fileName": info.get("file_name", attachment.file_name),
+        "contentType": info.get("content_type", attachment.content_type),
+        "attachmentId": info["attachment_id"],
+        "chatMessageId": "",
+    }
+
+
+def upload_attachments(
+    account: YuppAccount, attachments: List[Attachment]
+) -> List[Dict[str, Any]]:
+    """上传请求的附件，同一账户已上传过的内容直接复用"""
+    files = []
+    for attachment in attachments:
+        key = f"{token_id(account.token)}:{attachment.sha256}"
+        entry = ATTACHMENT_UPLOADS.get(key)
+        if entry is None:
+            entry = upload_yupp_attachment(account, attachment)
+            ATTACHMENT_UPLOADS.put(key, entry)
+            metrics.inc("yupp_attachment_uploads_total", result="uploaded")
+            metrics.inc("yupp_attachment_bytes_total", len(attachment.data))
+        else:
+            metrics.inc("yupp_attachment_uploads_total", result="cached")
+        files.append(entry)
+    return files
+
+
+def submit_reward_claim(account: YuppAccount, reward_id: str):
+    """把领取奖励提交到后台队列，关闭服务时会等待队列清空"""
+    global PENDING_REWARD_CLAIMS
+
+    def run():
+        global PENDING_REWARD_CLAIMS
+        try:
+            claim_yupp_reward(account, reward_id)
+        except Exception as e:
+            print(f"Failed to claim reward in background: {e}")
+        finally:
+            with lifecycle_lock:
+                PENDING_REWARD_CLAIMS -= 1
+
+    with lifecycle_lock:
+        PENDING_REWARD_CLAIMS += 1
+    try:
+        REWARD_EXECUTOR.submit(run)
+    except RuntimeError:
+        # 执行器已关闭（进程即将退出），直接在当前线程领取
+        run()
+
+
+def clean_model_name(model_name: str) -> str:
+    """清理模型名称，移除换行符和表情符号"""
+    if not model_name:
+        return model_name
+    # 移除换行符和其他不可见字符
+    cleaned = re.sub(r"[\n\r\t\f\v]", " ", model_name)
+    # 移除表情符号和其他特殊字符
+    cleaned = re.sub(r"[^\w\s\-_\(\)\.\/\[\]]+", "", cleaned)
+    # 移除多余的空格
+    cleaned = re.sub(r"\s+", " ", cleaned).strip()
+    return cleaned
+
+
+def extract_ref_id(ref):
+    """从引用字符串中提取ID，例如从'$@123'提取'123'"""
+    return (
+        ref[2:] if ref and isinstance(ref, str) and ref.startswith("$@") else None
+    )
+
+
+def is_valid_content(content: str) -> bool:
+    """检查内容是否有效，避免过度过滤"""
+    if not content or content in [None, "", "$undefined"]:
+        return False
+
+    # 移除明显的系统消息
+    if content.startswith("\\n\\<streaming stopped") or content.startswith(
+        "\n\\<streaming stopped"
+    ):
+        return False
+
+    # 移除纯UUID（更宽松的检查）
+    if re.match(
+        r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$",
+        content.strip(),
+    ):
+        return False
+
+    # 移除过短的内容（但允许单字符）
+    if len(content.strip()) == 0:
+        return False
+
+    # 移除明显的系统标记
+    if content.strip() in ["$undefined", "undefined", "null", "NULL"]:
+        return False
+
+    return True
+
+
+class StreamState:
+    """单个上游流的解析状态
+
+    大量并发流同时存活，使用 __slots__ 压缩每个流的常驻内存。只需要长度时只计数，
+    keep_text 为真时才保留文本片段，结束时一次性拼接。
+    """
+
+    __slots__ = (
+        "target_stream_id",
+        "select_stream",
+        "reward_info",
+        "is_thinking",
+        "seen_content",
+        "content_chars",
+        "reasoning_chars",
+        "content_parts",
+        "reasoning_parts",
+        "tokens",
+        "completed",
+    )
+
+    def __init__(self, keep_text: bool = False):
+        self.target_stream_id: Optional[str] = None
+        self.select_stream: List[Any] = [None, None]
+        self.reward_info: Optional[Dict[str, Any]] = None
+        self.is_thinking = False
+        self.seen_content: set = set()  # 已处理内容的哈希，避免重复输出
+        self.content_chars = 0
+        self.reasoning_chars = 0
+        self.content_parts: Optional[List[str]] = [] if keep_text else None
+        self.reasoning_parts: Optional[List[str]] = [] if keep_text else None
+        self.tokens = TokenCounter()  # 随流增量统计输出 token
+        self.completed = False  # 上游流完整读完才触发完成回调
+
+    def add_content(self, text: str):
+        self.content_chars += len(text)
+        self.tokens.add(text)
+        if self.content_parts is not None:
+            self.content_parts.append(text)
+
+    def add_reasoning(self, text: str):
+        self.reasoning_chars += len(text)
+        self.tokens.add(text)
+        if self.reasoning_parts is not None:
+            self.reasoning_parts.append(text)
+
+    def reset_upstream(self):
+        """切换到新的上游流时清空与上游流相关的解析状态，保留已输出的内容和计数
+
+        奖励信息属于出错的上游对话，一并清空，只领取新账户的奖励。
+        """
+        self.target_stream_id = None
+        self.select_stream = [None, None]
+        self.reward_info = None
+        self.is_thinking = False
+        self.seen_content = set()
+
+
+class ContinuationStitcher:
+    """把故障转移后的续写内容接到已输出的文本后面，去掉与已输出部分重叠的开头
+
+    续写的开头先缓存起来，直到足以判断重叠：
+    - 续写从头重新生成了已输出的内容时，跳过与已输出文本相同的前缀；
+    - 续写重复了已输出文本的末尾时，去掉不少于 min_overlap 个字符的最长重叠部分。
+    """
+
+    __slots__ = ("sent", "window", "min_overlap", "pending", "decided")
+
+    def __init__(self, sent: str, window: int = 200, min_overlap: int = 8):
+        self.sent = sent
+        self.window = window
+        self.min_overlap = min_overlap
+        self.pending = ""
+        self.decided = not sent
+
+    def _overlap(self) -> int:
+        for size in range(min(len(self.pending), len(self.sent)), self.min_overlap - 1, -1):
+            if self.sent.endswith(self.pending[:size]):
+                return size
+        return 0
+
+    def feed(self, text: str) -> str:
+        """返回可以输出的部分，尚在判断重叠时返回空字符串"""
+        if self.decided:
+            return text
+        self.pending += text
+        if self.sent.startswith(self.pending):
+            # 仍在重复已输出的内容
+            self.decided = len(self.pending) == len(self.sent)
+            return ""
+        if self.pending.startswith(self.sent):
+            self.decided = True
+            return self.pending[len(self.sent):]
+        if len(self.pending) < self.window:
+            return ""
+        return self.flush()
+
+    def flush(self) -> str:
+        """续写结束或缓存已满时，去掉重叠部分后输出缓存的内容"""
+        if self.decided:
+            return ""
+        self.decided = True
+        if self.sent.startswith(self.pending):
+            return ""
+        return self.pending[self._overlap():]
+
+
 def yupp_stream_generator(
-    response_lines, model_id: str, account: YuppAccount
+    response_lines,
+    model_id: str,
+    account: YuppAccount,
+    prompt_tokens: int = 0,
+    include_usage: bool = False,
+    client_key: Optional[str] = None,
+    on_complete: Optional[Callable[[Dict[str, Any]], None]] = None,
+    trace: Optional[Trace] = None,
+    n: int = 1,
+    failover: Optional[
+        Callable[[str, YuppAccount], Optional[Tuple[Iterable[bytes], YuppAccount]]]
+    ] = None,
 ) -> Generator[str, None, None]:
-    """处理Yupp的流式响应并转换为OpenAI格式"""
+    """处理Yupp的流式响应并转换为OpenAI格式
+
+    n=2 时同时跟随左右两路流，分别作为 choices[0] 和 choices[1] 输出，并附带各自的模型名称。
+    上游流中途出错时，若提供了 failover，以已输出的内容和出错的账户调用它，
+    返回新的 (上游行, 账户) 则在同一个客户端流中接着输出续写，返回 None 时按原样报错结束。
+    """
     stream_id = f"chatcmpl-{uuid.uuid4().hex}"
     created_time = int(time.time())
 
-    # 清理模型名称，移除换行符和表情符号
-    def clean_model_name(model_name: str) -> str:
-        """清理模型名称，移除换行符和表情符号"""
-        if not model_name:
-            return model_name
-        # 移除换行符和其他不可见字符
-        cleaned = re.sub(r"[\n\r\t\f\v]", " ", model_name)
-        # 移除表情符号和其他特殊字符
-        cleaned = re.sub(r"[^\w\s\-_\(\)\.\/\[\]]+", "", cleaned)
-        # 移除多余的空格
-        cleaned = re.sub(r"\s+", " ", cleaned).strip()
-        return cleaned
-
     clean_model_id = clean_model_name(model_id)
+    # n=2 时每个选项的模型名称，收到 "e" 块后更新为实际模型
+    choice_models = [clean_model_id] * n if n > 1 else None
+
+    def sse_chunk(
+        delta: Dict[str, Any], finish_reason: Optional[str] = None, index: int = 0
+    ) -> str:
+        """序列化一个 SSE 数据块，并累计编码耗时"""
+        start_ns = time.perf_counter_ns()
+        if choice_models:
+            data = ComparisonStreamResponse(
+                id=stream_id,
+                created=created_time,
+                model=clean_model_id,
+                choices=[
+                    ComparisonStreamChoice(
+                        delta=delta,
+                        index=index,
+                        finish_reason=finish_reason,
+                        model=choice_models[index],
+                    )
+                ],
+            ).model_dump_json()
+        else:
+            data = StreamResponse(
+                id=stream_id,
+                created=created_time,
+                model=clean_model_id,
+                choices=[StreamChoice(delta=delta, finish_reason=finish_reason)],
+            ).model_dump_json()
+        if trace:
+            trace.add_time("encode", time.perf_counter_ns() - start_ns)
+        return f"data: {data}\n\n"
+
+    if trace:
+        stream_span = trace.start("stream")
+        select_span = trace.start("upstream_select")
+        first_token_span = trace.start("first_token")
 
     # 发送初始角色
-    yield f"data: {StreamResponse(id=stream_id, created=created_time, model=clean_model_id, choices=[StreamChoice(delta={'role': 'assistant'})]).model_dump_json()}\n\n"
+    for index in range(n):
+        yield sse_chunk({"role": "assistant"}, index=index)
 
     line_pattern = re.compile(b"^([0-9a-fA-F]+):(.*)")
-    chunks = {}
-    target_stream_id = None
-    reward_info = None
-    is_thinking = False
-    thinking_content = ""
-    normal_content = ""
-    select_stream = [None, None]  # 初始化 select_stream
-    processed_content = set()  # 用于追踪已处理的内容，避免重复
-
-    def extract_ref_id(ref):
-        """从引用字符串中提取ID，例如从'$@123'提取'123'"""
-        return (
-            ref[2:] if ref and isinstance(ref, str) and ref.startswith("$@") else None
-        )
-
-    def is_valid_content(content: str) -> bool:
-        """检查内容是否有效，避免过度过滤"""
-        if not content or content in [None, "", "$undefined"]:
-            return False
-
-        # 移除明显的系统消息
-        if content.startswith("\\n\\<streaming stopped") or content.startswith(
-            "\n\\<streaming stopped"
-        ):
-            return False
-
-        # 移除纯UUID（更宽松的检查）
-        if re.match(
-            r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$",
-            content.strip(),
-        ):
-            return False
-
-        # 移除过短的内容（但允许单字符）
-        if len(content.strip()) == 0:
-            return False
-
-        # 移除明显的系统标记
-        if content.strip() in ["$undefined", "undefined", "null", "NULL"]:
-            return False
+    # 只有完成回调（缓存、对话亲和）和故障转移需要完整文本，其余情况只计数
+    state = StreamState(keep_text=on_complete is not None or failover is not None)
+    # 每个选项各自的解析状态，choices[0] 同时保存整个流共享的信息
+    states = [state] + [StreamState() for _ in range(n - 1)]
+    # n>1 时待读取的流块 ID -> 选项序号
+    chains: Dict[str, int] = {}
+    # 故障转移后拼接续写的正文和思考过程
+    stitcher: Optional[ContinuationStitcher] = None
+    reasoning_stitcher: Optional[ContinuationStitcher] = None
+
+    def emit_content(text: str, index: int = 0):
+        """输出正文内容，故障转移后先去掉续写与已输出部分重叠的开头"""
+        if stitcher is not None and index == 0:
+            # 正文开始时思考过程已经结束，先输出缓存的思考内容
+            yield from flush_reasoning()
+            text = stitcher.feed(text)
+            if not text:
+                return
+        states[index].add_content(text)
+        yield sse_chunk({"content": text}, index=index)
+
+    def emit_reasoning(text: str, index: int = 0):
+        """输出思考内容，故障转移后新账户重新输出的思考过程同样去重"""
+        if reasoning_stitcher is not None and index == 0:
+            text = reasoning_stitcher.feed(text)
+            if not text:
+                return
+        states[index].add_reasoning(text)
+        yield sse_chunk({"reasoning_content": text}, index=index)
 
-        return True
+    def flush_reasoning():
+        rest = reasoning_stitcher.flush() if reasoning_stitcher is not None else ""
+        if rest:
+            state.add_reasoning(rest)
+            yield sse_chunk({"reasoning_content": rest})
 
-    def process_content_chunk(content: str, chunk_id: str):
+    def process_content_chunk(content: str, chunk_id: str, index: int = 0):
         """处理单个内容块"""
-        nonlocal is_thinking, thinking_content, normal_content
-
         if not is_valid_content(content):
             return
+        state = states[index]
 
         # 避免重复处理相同的内容
         content_hash = hash(content)
-        if content_hash in processed_content:
+        if content_hash in state.seen_content:
             return
-        processed_content.add(content_hash)
+        state.seen_content.add(content_hash)
 
         log_debug(f"Processing chunk {chunk_id} with content: '{content[:50]}...'")
+        if trace:
+            trace.end(first_token_span)
 
         # 处理思考过程
         if "<think>" in content or "</think>" in content:
-            yield from process_thinking_content(content)
-        elif is_thinking:
-            thinking_content += content
-            yield f"data: {StreamResponse(id=stream_id, created=created_time, model=clean_model_id, choices=[StreamChoice(delta={'reasoning_content': content})]).model_dump_json()}\n\n"
+            yield from process_thinking_content(content, index)
+        elif state.is_thinking:
+            yield from emit_reasoning(content, index)
         else:
-            normal_content += content
-            yield f"data: {StreamResponse(id=stream_id, created=created_time, model=clean_model_id, choices=[StreamChoice(delta={'content': content})]).model_dump_json()}\n\n"
+            yield from emit_content(content, index)
 
-    def process_thinking_content(content: str):
+    def process_thinking_content(content: str, index: int = 0):
         """处理包含思考标签的内容"""
-        nonlocal is_thinking, thinking_content, normal_content
-
+        state = states[index]
         if "<think>" in content:
             parts = content.split("<think>", 1)
             if parts[0]:  # 思考标签前的内容
-                normal_content += parts[0]
-                yield f"data: {StreamResponse(id=stream_id, created=created_time, model=clean_model_id, choices=[StreamChoice(delta={'content': parts[0]})]).model_dump_json()}\n\n"
+                yield from emit_content(parts[0], index)
 
-            is_thinking = True
+            state.is_thinking = True
             thinking_part = parts[1]
 
             if "</think>" in thinking_part:
                 think_parts = thinking_part.split("</think>", 1)
-                thinking_content += think_parts[0]
-                yield f"data: {StreamResponse(id=stream_id, created=created_time, model=clean_model_id, choices=[StreamChoice(delta={'reasoning_content': think_parts[0]})]).model_dump_json()}\n\n"
+                yield from emit_reasoning(think_parts[0], index)
 
-                is_thinking = False
+                state.is_thinking = False
                 if think_parts[1]:  # 思考标签后的内容
-                    normal_content += think_parts[1]
-                    yield f"data: {StreamResponse(id=stream_id, created=created_time, model=clean_model_id, choices=[StreamChoice(delta={'content': think_parts[1]})]).model_dump_json()}\n\n"
+                    yield from emit_content(think_parts[1], index)
             else:
-                thinking_content += thinking_part
-                yield f"data: {StreamResponse(id=stream_id, created=created_time, model=clean_model_id, choices=[StreamChoice(delta={'reasoning_content': thinking_part})]).model_dump_json()}\n\n"
+                yield from emit_reasoning(thinking_part, index)
 
-        elif "</think>" in content and is_thinking:
+        elif "</think>" in content and state.is_thinking:
             parts = content.split("</think>", 1)
-            thinking_content += parts[0]
-            yield f"data: {StreamResponse(id=stream_id, created=created_time, model=clean_model_id, choices=[StreamChoice(delta={'reasoning_content': parts[0]})]).model_dump_json()}\n\n"
+            yield from emit_reasoning(parts[0], index)
 
-            is_thinking = False
+            state.is_thinking = False
             if parts[1]:  # 思考标签后的内容
-                normal_content += parts[1]
-                yield f"data: {StreamResponse(id=stream_id, created=created_time, model=clean_model_id, choices=[StreamChoice(delta={'content': parts[1]})]).model_dump_json()}\n\n"
+                yield from emit_content(parts[1], index)
 
     try:
         log_debug("Starting to process response lines...")
         line_count = 0
 
-        for line in response_lines:
-            line_count += 1
-            if not line:
-                continue
-
-            match = line_pattern.match(line)
-            if not match:
-                log_debug(
-                    f"Line {line_count}: No pattern match for line: {line[:50]}..."
-                )
-                continue
-
-            chunk_id, chunk_data = match.groups()
-            chunk_id = chunk_id.decode()
-
+        while True:
             try:
-                data = json.loads(chunk_data) if chunk_data != b"{}" else {}
-                chunks[chunk_id] = data
-                log_debug(f"Parsed chunk {chunk_id}: {str(data)[:100]}...")
-            except json.JSONDecodeError:
-                log_debug(f"Failed to parse JSON for chunk {chunk_id}: {chunk_data}")
-                continue
-
-            # 处理奖励信息
-            if chunk_id == "a":
-                reward_info = data
-                log_debug(f"Found reward info: {reward_info}")
-
-            # 处理初始设置信息
-            elif chunk_id == "1":
-                if isinstance(data, dict):
-                    left_stream = data.get("leftStream", {})
-                    right_stream = data.get("rightStream", {})
-                    select_stream = [left_stream, right_stream]
-                    log_debug(
-                        f"Found stream setup: left={left_stream}, right={right_stream}"
-                    )
+                for line in response_lines:
+                    line_count += 1
+                    if not line:
+                        continue
 
-            elif chunk_id == "e":
-                if isinstance(data, dict):
-                    for i, selection in enumerate(data.get("modelSelections", [])):
-                        if selection.get("selectionSource") == "USER_SELECTED":
-                            if i < len(select_stream) and isinstance(
-                                select_stream[i], dict
-                            ):
-                                target_stream_id = extract_ref_id(
-                                    select_stream[i].get("next")
-                                )
-                                log_debug(f"Found target stream ID: {target_stream_id}")
-                            break
-
-            # 处理目标流内容
-            elif target_stream_id and chunk_id == target_stream_id:
-                if isinstance(data, dict):
-                    content = data.get("curr", "")
-                    if content:
+                    match = line_pattern.match(line)
+                    if not match:
                         log_debug(
-                            f"Processing target stream content: '{content[:50]}...'"
+                            f"Line {line_count}: No pattern match for line: {line[:50]}..."
                         )
-                        yield from process_content_chunk(content, chunk_id)
-
-                        # 更新目标流ID
-                        target_stream_id = extract_ref_id(data.get("next"))
-                        if target_stream_id:
+                        continue
+
+                    chunk_id, chunk_data = match.groups()
+                    chunk_id = chunk_id.decode()
+
+                    try:
+                        data = json.loads(chunk_data) if chunk_data != b"{}" else {}
+                        log_debug(f"Parsed chunk {chunk_id}: {str(data)[:100]}...")
+                    except json.JSONDecodeError:
+                        log_debug(f"Failed to parse JSON for chunk {chunk_id}: {chunk_data}")
+                        continue
+
+                    # 处理奖励信息
+                    if chunk_id == "a":
+                        state.reward_info = data
+                        log_debug(f"Found reward info: {data}")
+
+                    # 处理初始设置信息
+                    elif chunk_id == "1":
+                        if isinstance(data, dict):
+                            left_stream = data.get("leftStream", {})
+                            right_stream = data.get("rightStream", {})
+                            state.select_stream = [left_stream, right_stream]
+                            if n > 1:
+                                for index, stream in enumerate(state.select_stream[:n]):
+                                    ref_id = extract_ref_id(
+                                        stream.get("next") if isinstance(stream, dict) else None
+                                    )
+                                    if ref_id:
+                                        chains[ref_id] = index
                             log_debug(
-                                f"Updated target stream ID to: {target_stream_id}"
+                                f"Found stream setup: left={left_stream}, right={right_stream}"
                             )
 
-            # 备用逻辑：处理任何包含"curr"的chunk
-            elif isinstance(data, dict) and "curr" in data:
-                content = data.get("curr", "")
-                if content:
-                    log_debug(
-                        f"Processing fallback chunk {chunk_id} with content: '{content[:50]}...'"
-                    )
-                    yield from process_content_chunk(content, chunk_id)
-
+                    elif chunk_id == "e":
+                        if trace:
+                            trace.end(select_span)
+                        if isinstance(data, dict):
+                            if choice_models:
+                                selections = data.get("modelSelections", [])[:n]
+                                for i, selection in enumerate(selections):
+                                    if selection.get("modelName"):
+                                        choice_models[i] = clean_model_name(
+                                            selection["modelName"]
+                                        )
+                            for i, selection in enumerate(data.get("modelSelections", [])):
+                                if selection.get("selectionSource") == "USER_SELECTED":
+                                    if i < len(state.select_stream) and isinstance(
+                                        state.select_stream[i], dict
+                                    ):
+                                        state.target_stream_id = extract_ref_id(
+                                            state.select_stream[i].get("next")
+                                        )
+                                        log_debug(
+                                            f"Found target stream ID: {state.target_stream_id}"
+                                        )
+                                    break
+
+                    # n>1：按各自的引用链读取每一路流
+                    elif chunk_id in chains:
+                        index = chains.pop(chunk_id)
+                        if isinstance(data, dict):
+                            content = data.get("curr", "")
+                            if content:
+                                yield from process_content_chunk(content, chunk_id, index)
+                            next_id = extract_ref_id(data.get("next"))
+                            if next_id:
+                                chains[next_id] = index
+
+                    # 处理目标流内容
+                    elif state.target_stream_id and chunk_id == state.target_stream_id:
+                        if isinstance(data, dict):
+                            content = data.get("curr", "")
+                            if content:
+                                log_debug(
+                                    f"Processing target stream content: '{content[:50]}...'"
+                                )
+                                yield from process_content_chunk(content, chunk_id)
+
+                                # 更新目标流ID
+                                state.target_stream_id = extract_ref_id(data.get("next"))
+                                if state.target_stream_id:
+                                    log_debug(
+                                        f"Updated target stream ID to: {state.target_stream_id}"
+                                    )
+
+                    # 备用逻辑：处理任何包含"curr"的chunk
+                    elif n == 1 and isinstance(data, dict) and "curr" in data:
+                        content = data.get("curr", "")
+                        if content:
+                            log_debug(
+                                f"Processing fallback chunk {chunk_id} with content: '{content[:50]}...'"
+                            )
+                            yield from process_content_chunk(content, chunk_id)
+                break
+            except Exception as e:
+                # 上游流中途断开：换一个账户续写，接在同一个客户端流后面
+                if failover is None:
+                    raise
+                resumed = failover("".join(state.content_parts), account)
+                if resumed is None:
+                    raise
+                print(f"Upstream stream failed ({e}), continuing on another account")
+                response_lines, account = resumed
+                state.reset_upstream()
+                chains.clear()
+                stitcher = ContinuationStitcher("".join(state.content_parts))
+                reasoning_stitcher = ContinuationStitcher("".join(state.reasoning_parts))
+
+        yield from flush_reasoning()
+        if stitcher is not None:
+            # 续写短于判断重叠所需的长度时，在这里输出剩余内容
+            rest = stitcher.flush()
+            if rest:
+                state.add_content(rest)
+                yield sse_chunk({"content": rest})
         log_debug(f"Finished processing {line_count} lines")
+        state.completed = True
 
     except Exception as e:
         log_debug(f"Stream processing error: {e}")
@@ -593,36 +2102,130 @@ def yupp_stream_generator(
         yield f"data: {json.dumps({'error': str(e)})}\n\n"
 
     finally:
-        # 发送完成信号
-        yield f"data: {StreamResponse(id=stream_id, created=created_time, model=clean_model_id, choices=[StreamChoice(delta={}, finish_reason='stop')]).model_dump_json()}\n\n"
-        yield "data: [DONE]\n\n"
+        completion_tokens = sum(st.tokens.tokens for st in states)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        key_label = mask_key(client_key)
+        metrics.inc("yupp_client_requests_total", key=key_label)
+        metrics.inc("yupp_client_prompt_tokens_total", prompt_tokens, key=key_label)
+        metrics.inc(
+            "yupp_client_completion_tokens_total", completion_tokens, key=key_label
+        )
+
+        if on_complete and state.completed and (
+            state.content_chars or state.reasoning_chars
+        ):
+            try:
+                on_complete(
+                    {
+                        "model": clean_model_id,
+                        "content": "".join(state.content_parts),
+                        "reasoning_content": "".join(state.reasoning_parts),
+                        "usage": usage,
+                    }
+                )
+            except Exception as e:
+                print(f"Completion callback failed: {e}")
 
-        # 领取奖励
-        if reward_info and "unclaimedRewardInfo" in reward_info:
-            reward_id = reward_info["unclaimedRewardInfo"].get("rewardId")
+        # 领取奖励（后台队列执行，不阻塞流结束）
+        if state.reward_info and "unclaimedRewardInfo" in state.reward_info:
+            reward_id = state.reward_info["unclaimedRewardInfo"].get("rewardId")
             if reward_id:
-                try:
-                    claim_yupp_reward(account, reward_id)
-                except Exception as e:
-                    print(f"Failed to claim reward in background: {e}")
+                submit_reward_claim(account, reward_id)
+
+        # 发送完成信号
+        for index in range(n):
+            yield sse_chunk({}, finish_reason="stop", index=index)
+        if include_usage:
+            yield f"data: {json.dumps({'id': stream_id, 'object': 'chat.completion.chunk', 'created': created_time, 'model': clean_model_id, 'choices': [], 'usage': usage})}\n\n"
+        if trace:
+            trace.end(stream_span)
+            # SSE 注释行，客户端会忽略，便于排查慢请求
+            yield f": server-timing {trace.server_timing()}\n\n"
+            TRACER.export(trace)
+        yield "data: [DONE]\n\n"
 
         log_debug(
-            f"Stream processing completed. Total content: {len(normal_content)} chars, thinking: {len(thinking_content)} chars"
+            f"Stream processing completed. Total content: {sum(st.content_chars for st in states)} chars, thinking: {sum(st.reasoning_chars for st in states)} chars"
         )
 
 
+def cached_stream_generator(
+    entry: Dict[str, Any], include_usage: bool = False
+) -> Generator[str, None, None]:
+    """将缓存的完成结果重放为流式响应"""
+    stream_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created_time = int(time.time())
+    model = entry.get("model", "")
+
+    def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+        return f"data: {StreamResponse(id=stream_id, created=created_time, model=model, choices=[StreamChoice(delta=delta, finish_reason=finish_reason)]).model_dump_json()}\n\n"
+
+    yield chunk({"role": "assistant"})
+    if entry.get("reasoning_content"):
+        yield chunk({"reasoning_content": entry["reasoning_content"]})
+    if entry.get("content"):
+        yield chunk({"content": entry["content"]})
+    yield chunk({}, "stop")
+    if include_usage and entry.get("usage"):
+        yield f"data: {json.dumps({'id': stream_id, 'object': 'chat.completion.chunk', 'created': created_time, 'model': model, 'choices': [], 'usage': entry['usage']})}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def build_cached_response(entry: Dict[str, Any]) -> ChatCompletionResponse:
+    """由缓存条目构建非流式响应"""
+    return ChatCompletionResponse(
+        model=entry.get("model", ""),
+        choices=[
+            ChatCompletionChoice(
+                message=ChatMessage(
+                    role="assistant",
+                    content=entry.get("content", ""),
+                    reasoning_content=entry.get("reasoning_content") or None,
+                )
+            )
+        ],
+        **({"usage": entry["usage"]} if entry.get("usage") else {}),
+    )
+
+
 def build_yupp_non_stream_response(
-    response_lines, model_id: str, account: YuppAccount
+    response_lines,
+    model_id: str,
+    account: YuppAccount,
+    prompt_tokens: int = 0,
+    client_key: Optional[str] = None,
+    on_complete: Optional[Callable[[Dict[str, Any]], None]] = None,
+    trace: Optional[Trace] = None,
+    n: int = 1,
+    failover: Optional[
+        Callable[[str, YuppAccount], Optional[Tuple[Iterable[bytes], YuppAccount]]]
+    ] = None,
 ) -> ChatCompletionResponse:
     """构建非流式响应"""
-    full_content = ""
-    full_reasoning_content = ""
-    reward_id = None
+    contents: List[List[str]] = [[] for _ in range(n)]
+    reasoning_contents: List[List[str]] = [[] for _ in range(n)]
+    choice_models: List[Optional[str]] = [None] * n
+    usage = None
 
     # 用于存储从流式响应中获取的模型名称
     response_model_name = model_id
 
-    for event in yupp_stream_generator(response_lines, model_id, account):
+    for event in yupp_stream_generator(
+        response_lines,
+        model_id,
+        account,
+        prompt_tokens=prompt_tokens,
+        include_usage=True,
+        client_key=client_key,
+        on_complete=on_complete,
+        trace=trace,
+        n=n,
+        failover=failover,
+    ):
         if event.startswith("data:"):
             data_str = event[5:].strip()
             if data_str == "[DONE]":
@@ -639,36 +2242,203 @@ def build_yupp_non_stream_response(
                 if "model" in data and not response_model_name:
                     response_model_name = data["model"]
 
-                delta = data.get("choices", [{}])[0].get("delta", {})
+                if data.get("usage"):
+                    usage = data["usage"]
+                    continue
+
+                choice = data.get("choices", [{}])[0]
+                index = choice.get("index", 0)
+                delta = choice.get("delta", {})
                 if "content" in delta:
-                    full_content += delta["content"]
+                    contents[index].append(delta["content"])
                 if "reasoning_content" in delta:
-                    full_reasoning_content += delta["reasoning_content"]
+                    reasoning_contents[index].append(delta["reasoning_content"])
+                if choice.get("model"):
+                    choice_models[index] = choice["model"]
             except json.JSONDecodeError:
                 continue
 
     # 构建完整响应
+    messages = [
+        ChatMessage(
+            role="assistant",
+            content="".join(contents[index]),
+            reasoning_content="".join(reasoning_contents[index]) or None,
+        )
+        for index in range(n)
+    ]
+    usage_kwargs = {"usage": usage} if usage else {}
+    if n > 1:
+        return ComparisonCompletionResponse(
+            model=response_model_name,
+            choices=[
+                ComparisonChoice(
+                    message=message, index=index, model=choice_models[index]
+                )
+                for index, message in enumerate(messages)
+            ],
+            **usage_kwargs,
+        )
     return ChatCompletionResponse(
         model=response_model_name,
-        choices=[
-            ChatCompletionChoice(
-                message=ChatMessage(
-                    role="assistant",
-                    content=full_content,
-                    reasoning_content=(
-                        full_reasoning_content if full_reasoning_content else None
-                    ),
-                )
-            )
-        ],
+        choices=[ChatCompletionChoice(message=messages[0])],
+        **usage_kwargs,
     )
 
 
 @app.post("/v1/chat/completions")
 async def chat_completions(
-    request: ChatCompletionRequest, _: None = Depends(authenticate_client)
+    request: ChatCompletionRequest,
+    http_response: Response,
+    client_key: str = Depends(authenticate_client),
+    x_completion_cache: Optional[str] = Header(None),
+    x_priority: Optional[str] = Header(None),
 ):
     """使用Yupp.ai创建聊天完成"""
+    result = await process_chat_completion(
+        request,
+        http_response,
+        client_key,
+        x_completion_cache,
+        priority=resolve_priority(client_key, x_priority),
+    )
+    if isinstance(result, BaseModel):
+        # 非流式结果直接序列化，直接返回响应时需要自行带上 http_response 中设置的响应头
+        return ModelJSONResponse(result, headers=http_response.headers)
+    return result
+
+
+def build_yupp_request(
+    account: YuppAccount,
+    url_uuid: str,
+    question: str,
+    model_name: str,
+    files: Optional[List[Dict[str, Any]]] = None,
+) -> Tuple[str, List[Any], Dict[str, str]]:
+    """构建 Yupp 流式请求的 URL、payload 和请求头，files 为已上传的附件描述"""
+    url = f"https://yupp.ai/chat/{url_uuid}?stream=true"
+
+    payload = [
+        url_uuid,
+        str(uuid.uuid4()),
+        question,
+        "$undefined",
+        "$undefined",
+        files or [],
+        "$undefined",
+        [{"modelName": model_name, "promptModifierId": "$undefined"}],
+        "text",
+        False,
+        "$undefined",
+    ]
+
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36 Edg/137.0.0.0",
+        "Accept": "text/x-component",
+        "Accept-Encoding": "gzip, deflate, br, zstd",
+        "Content-Type": "application/json",
+        "next-action": "7fbcb7bc0fcb4b0833ac4d1a1981315749f0dc7c09",
+        "sec-fetch-site": "same-origin",
+        "Cookie": f"__Secure-yupp.session-token={account.token}",
+    }
+    return url, payload, headers
+
+
+def post_yupp_stream(
+    url: str, payload: List[Any], headers: Dict[str, str]
+) -> requests.Response:
+    """发起 Yupp 流式请求，在线程池中调用以免阻塞事件循环"""
+    session = get_requests_session()
+    response = session.post(
+        url,
+        data=json.dumps(payload),
+        headers=headers,
+        stream=True,
+    )
+    response.raise_for_status()
+    return response
+
+
+def make_stream_failover(
+    messages: List[ChatMessage],
+    model_name: str,
+    credit_cost: float,
+    priority: str,
+    max_attempts: int,
+    attachments: Optional[List[Attachment]] = None,
+) -> Tuple[
+    Callable[[str, YuppAccount], Optional[Tuple[Iterable[bytes], YuppAccount]]],
+    List[YuppAccount],
+]:
+    """创建流中途故障转移的回调，返回 (回调, 转移时占用的账户列表)
+
+    回调把出错的账户记一次错误，换一个未尝试过的账户，以原始消息加上已输出的部分回答
+    和续写指令发起新的上游请求。最多占用 max_attempts 个账户，调用方负责在流结束后释放它们。
+    """
+    accounts: List[YuppAccount] = []
+    tried = set()
+
+    def failover(
+        partial: str, failed: YuppAccount
+    ) -> Optional[Tuple[Iterable[bytes], YuppAccount]]:
+        tried.add(failed.token)
+        record_yupp_account_error(failed)
+        continued = list(messages)
+        if partial:
+            continued += [
+                ChatMessage(role="assistant", content=partial),
+                ChatMessage(role="user", content=CONTINUATION_PROMPT),
+            ]
+        question = format_messages_for_yupp(continued)
+
+        while len(accounts) < max_attempts:
+            account = get_best_yupp_account(
+                None, credit_cost, priority, exclude_tokens=tried
+            )
+            if account is None:
+                metrics.inc("yupp_stream_failovers_total", result="unavailable")
+                return None
+            accounts.append(account)
+            tried.add(account.token)
+            try:
+                files = upload_attachments(account, attachments) if attachments else []
+                response = post_yupp_stream(
+                    *build_yupp_request(
+                        account, str(uuid.uuid4()), question, model_name, files
+                    )
+                )
+            except requests.exceptions.HTTPError as e:
+                print(f"Failover request error ({e.response.status_code}): {e}")
+                if e.response.status_code in [401, 403]:
+                    invalidate_yupp_account(account)
+                else:
+                    record_yupp_account_error(account)
+                continue
+            except Exception as e:
+                print(f"Failover request error: {e}")
+                record_yupp_account_error(account)
+                continue
+            metrics.inc("yupp_stream_failovers_total", result="resumed")
+            return response.iter_lines(), account
+
+        metrics.inc("yupp_stream_failovers_total", result="exhausted")
+        return None
+
+    return failover, accounts
+
+
+async def process_chat_completion(
+    request: ChatCompletionRequest,
+    http_response: Response,
+    client_key: str,
+    x_completion_cache: Optional[str] = None,
+    rate_limited: bool = True,
+    priority: str = PRIORITY_INTERACTIVE,
+):
+    """处理一次聊天完成请求，供单个请求和批量接口共用"""
+    trace = TRACER.new_trace("chat.completions")
+    prepare_span = trace.start("prepare")
+
     # 查找模型
     model_info = next((m for m in YUPP_MODELS if m.get("label") == request.model), None)
     if not model_info:
@@ -681,121 +2451,554 @@ async def chat_completions(
         raise HTTPException(
             status_code=404, detail=f"Model '{request.model}' has no 'name' field."
         )
+    credit_cost = get_model_credit_cost(model_info)
 
     if not request.messages:
         raise HTTPException(
             status_code=400, detail="No messages provided in the request."
         )
 
+    # Yupp 每次请求生成左右两路回答，n=2 时一并返回
+    n = request.n or 1
+    if n not in (1, 2):
+        raise HTTPException(
+            status_code=400,
+            detail="n must be 1 or 2: each Yupp request produces two generations.",
+        )
+
     log_debug(
         f"Processing request for model: {request.model} (Yupp name: {model_name})"
     )
 
+    # 解码内联附件（图片、音频、文件），超限或模型不支持时在占用名额之前拒绝
+    decoded_attachments: Dict[str, Attachment] = {}
+    contents = [msg.content for msg in request.messages if isinstance(msg.content, list)]
+    if contents:
+        try:
+            # 大附件的 base64 解码和哈希耗时较长，放到线程池中执行，不阻塞事件循环
+            decoded_attachments = await run_in_threadpool(
+                decode_attachments,
+                contents,
+                int(os.getenv("MAX_ATTACHMENT_BYTES", str(10 * 1024 * 1024))),
+                int(os.getenv("MAX_ATTACHMENTS", "10")),
+                model_info.get("supportedAttachmentMimeTypes"),
+            )
+        except AttachmentError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    # 按模型预算压缩过长的历史
+    messages = request.messages
+    compaction_headers = {}
+    budget = get_prompt_budget(model_info)
+    if budget:
+        unit, limit = budget
+        messages, dropped, affected = compact_messages(messages, unit, limit)
+        if affected:
+            compaction_headers = {
+                "X-Prompt-Compacted": f"dropped={dropped}; unit={unit}; messages={affected}"
+            }
+            log_debug(
+                f"Compacted prompt: dropped {dropped} {unit} across {affected} messages"
+            )
+
     # 格式化消息
-    question = format_messages_for_yupp(request.messages)
+    question = format_messages_for_yupp(messages)
     log_debug(f"Formatted question: {question[:100]}...")
-
-    # 尝试所有账户
-    for attempt in range(len(YUPP_ACCOUNTS)):
-        account = get_best_yupp_account()
-        if not account:
-            raise HTTPException(
-                status_code=503, detail="No valid Yupp.ai accounts available."
+    attachments = [
+        decoded_attachments[sha256]
+        for sha256 in attachment_refs(msg.content for msg in messages)
+        if sha256 in decoded_attachments
+    ]
+    prompt_tokens = count_prompt_tokens(messages)
+    include_usage = bool(
+        request.stream_options and request.stream_options.get("include_usage")
+    )
+    trace.end(prepare_span)
+
+    # 限流并获取并发名额，流式响应在流结束时释放
+    with trace.span("admission") as admission_span:
+        release = await admit_client_request(client_key, rate_limited, priority)
+    metrics.observe(
+        "yupp_admission_wait_seconds",
+        (time.perf_counter_ns() - admission_span.start_ns) / 1e9,
+        priority=priority,
+    )
+    try:
+        # 可选的完成结果缓存，通过请求头 X-Completion-Cache 按请求开启
+        cache = COMPLETION_CACHE
+        on_complete = None
+        cache_headers = {}
+        if (
+            cache
+            and n == 1
+            and (x_completion_cache or "").lower() in ("1", "true", "yes", "use")
+        ):
+            # 附件不在问题文本中，以内容哈希区分
+            cache_key = cache.make_key(
+                request.model, question + "".join("\0" + a.sha256 for a in attachments)
             )
+            # 磁盘层读取文件，放到线程池中执行
+            cached = await run_in_threadpool(cache.get, cache_key)
+            if cached:
+                entry, size = cached
+                metrics.inc("yupp_cache_requests_total", result="hit")
+                metrics.inc("yupp_cache_bytes_saved_total", size)
+                log_debug(f"Completion cache hit ({size} bytes)")
+                headers = {"X-Completion-Cache": "hit", **compaction_headers}
+                if request.stream:
+                    stream = release_on_close(
+                        cached_stream_generator(entry, include_usage), release
+                    )
+                    weakref.finalize(stream, release)
+                    return StreamingResponse(
+                        stream,
+                        media_type="text/event-stream",
+                        headers={"Cache-Control": "no-cache", **headers},
+                    )
+                release()
+                http_response.headers.update(headers)
+                http_response.headers["Server-Timing"] = trace.server_timing()
+                return build_cached_response(entry)
 
-        try:
-            # 构建请求
-            url_uuid = str(uuid.uuid4())
-            url = f"https://yupp.ai/chat/{url_uuid}?stream=true"
-
-            payload = [
-                url_uuid,
-                str(uuid.uuid4()),
-                question,
-                "$undefined",
-                "$undefined",
-                [],
-                "$undefined",
-                [{"modelName": model_name, "promptModifierId": "$undefined"}],
-                "text",
-                False,
-                "$undefined",
-            ]
+            metrics.inc("yupp_cache_requests_total", result="miss")
+            cache_headers = {"X-Completion-Cache": "miss"}
 
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36 Edg/137.0.0.0",
-                "Accept": "text/x-component",
-                "Accept-Encoding": "gzip, deflate, br, zstd",
-                "Content-Type": "application/json",
-                "next-action": "7fbcb7bc0fcb4b0833ac4d1a1981315749f0dc7c09",
-                "sec-fetch-site": "same-origin",
-                "Cookie": f"__Secure-yupp.session-token={account['token']}",
-            }
+            def store_completion(entry: Dict[str, Any], cache_key=cache_key):
+                cache.put(cache_key, entry)
 
-            log_debug(
-                f"Sending request to Yupp.ai with account token ending in ...{account['token'][-4:]}"
-            )
+            on_complete = store_completion
 
-            # 发送请求
-            session = create_requests_session()
-            response = session.post(
-                url,
-                data=json.dumps(payload),
-                headers=headers,
-                stream=True,
+        # 续接同一对话时复用上游 chat，只发送新增的消息；映射缺失或原账户不可用时完整重发
+        conversations = CONVERSATIONS if n == 1 else None
+        conversation = None
+        if conversations:
+            conversation, new_messages = claim_conversation(
+                conversations, request.model, request.messages
             )
-            response.raise_for_status()
-
-            # 处理响应
-            if request.stream:
-                log_debug("Returning processed response stream")
-                return StreamingResponse(
-                    yupp_stream_generator(
-                        response.iter_lines(), request.model, account
-                    ),
-                    media_type="text/event-stream",
-                    headers={
-                        "Cache-Control": "no-cache",
-                        "Connection": "keep-alive",
-                        "X-Accel-Buffering": "no",
-                    },
+            if conversation:
+                followup_question = format_messages_for_yupp(new_messages)
+                followup_attachments = [
+                    decoded_attachments[sha256]
+                    for sha256 in attachment_refs(msg.content for msg in new_messages)
+                    if sha256 in decoded_attachments
+                ]
+            elif any(msg.role == "assistant" for msg in request.messages):
+                metrics.inc("yupp_conversation_requests_total", result="miss")
+    except BaseException:
+        release()
+        raise
+
+    # 流中途故障转移（仅 n=1），0 表示关闭
+    max_failovers = int(os.getenv("STREAM_FAILOVER_ATTEMPTS", "0")) if n == 1 else 0
+    stream_handed_off = False
+    try:
+        # 尝试所有账户
+        for attempt in range(len(YUPP_ACCOUNTS)):
+            with trace.span("account"):
+                account = await run_account_call(
+                    get_best_yupp_account,
+                    conversation.token if conversation else None,
+                    credit_cost,
+                    priority,
                 )
+            if not account:
+                raise HTTPException(
+                    status_code=503, detail="No valid Yupp.ai accounts available."
+                )
+
+            # 上游对话只尝试续接一次，失败后的重试一律完整重发
+            if conversation and account.token == conversation.token:
+                metrics.inc("yupp_conversation_requests_total", result="reused")
+                url_uuid = conversation.chat_id
+                turn_question = followup_question
+                turn_attachments = followup_attachments
+                log_debug(f"Continuing Yupp chat {url_uuid}")
             else:
-                log_debug("Building non-stream response")
+                if conversation:
+                    metrics.inc("yupp_conversation_requests_total", result="fallback")
+                url_uuid = str(uuid.uuid4())
+                turn_question = question
+                turn_attachments = attachments
+            conversation = None
+
+            failover, failover_accounts = None, []
+            if max_failovers > 0:
+                failover, failover_accounts = make_stream_failover(
+                    messages,
+                    model_name,
+                    credit_cost,
+                    priority,
+                    max_failovers,
+                    attachments,
+                )
+
+            attempt_on_complete = on_complete
+            if conversations:
+
+                def record_conversation(
+                    entry: Dict[str, Any],
+                    token=account.token,
+                    chat_id=url_uuid,
+                    failover_accounts=failover_accounts,
+                ):
+                    if on_complete:
+                        on_complete(entry)
+                    # 故障转移后回答分散在多个上游对话中，不再登记续接
+                    if entry.get("content") and not failover_accounts:
+                        reply = ChatMessage(role="assistant", content=entry["content"])
+                        conversations.record(
+                            conversation_key(request.model, [*request.messages, reply]),
+                            Conversation(token, chat_id),
+                        )
+
+                attempt_on_complete = record_conversation
 
-                return build_yupp_non_stream_response(
-                    response.iter_lines(), request.model, account
+            try:
+                # 上传附件（同一账户上传过的内容直接复用）并构建请求
+                files = []
+                if turn_attachments:
+                    with trace.span("upload"):
+                        files = await run_in_threadpool(
+                            upload_attachments, account, turn_attachments
+                        )
+                url, payload, headers = build_yupp_request(
+                    account, url_uuid, turn_question, model_name, files
                 )
 
-        except requests.exceptions.HTTPError as e:
-            status_code = e.response.status_code
-            error_detail = e.response.text
-            print(f"Yupp.ai API error ({status_code}): {error_detail}")
+                log_debug(
+                    f"Sending request to Yupp.ai with account token ending in ...{account.token[-4:]}"
+                )
 
-            with account_rotation_lock:
-                if status_code in [401, 403]:
-                    account["is_valid"] = False
-                    print(
-                        f"Account ...{account['token'][-4:]} marked as invalid due to auth error."
+                # 发送请求（包含建连、TLS 握手和等待响应头）
+                with trace.span("connect"):
+                    response = await run_in_threadpool(
+                        post_yupp_stream, url, payload, headers
                     )
-                elif status_code in [429, 500, 502, 503, 504]:
-                    account["error_count"] += 1
-                    print(
-                        f"Account ...{account['token'][-4:]} error count: {account['error_count']}"
+
+                # 处理响应
+                if request.stream:
+                    log_debug("Returning processed response stream")
+
+                    def release_stream(
+                        account=account, failover_accounts=failover_accounts
+                    ):
+                        release()
+                        release_yupp_account(account)
+                        for failover_account in failover_accounts:
+                            release_yupp_account(failover_account)
+                        record_first_token(trace, priority)
+
+                    release_stream = call_once(release_stream)
+                    stream = release_on_close(
+                        yupp_stream_generator(
+                            response.iter_lines(),
+                            request.model,
+                            account,
+                            prompt_tokens=prompt_tokens,
+                            include_usage=include_usage,
+                            client_key=client_key,
+                            on_complete=attempt_on_complete,
+                            trace=trace,
+                            n=n,
+                            failover=failover,
+                        ),
+                        release_stream,
+                    )
+                    # 客户端在流开始前断开时生成器不会执行 finally，回收时兜底释放名额
+                    weakref.finalize(stream, release_stream)
+                    stream_handed_off = True
+                    return StreamingResponse(
+                        stream,
+                        media_type="text/event-stream",
+                        headers={
+                            "Cache-Control": "no-cache",
+                            "Connection": "keep-alive",
+                            "X-Accel-Buffering": "no",
+                            **compaction_headers,
+                            **cache_headers,
+                        },
                     )
+                else:
+                    log_debug("Building non-stream response")
+
+                    http_response.headers.update(compaction_headers)
+                    http_response.headers.update(cache_headers)
+                    result = await run_in_threadpool(
+                        build_yupp_non_stream_response,
+                        response.iter_lines(),
+                        request.model,
+                        account,
+                        prompt_tokens=prompt_tokens,
+                        client_key=client_key,
+                        on_complete=attempt_on_complete,
+                        trace=trace,
+                        n=n,
+                        failover=failover,
+                    )
+                    record_first_token(trace, priority)
+                    http_response.headers["Server-Timing"] = trace.server_timing()
+                    return result
+
+            except requests.exceptions.HTTPError as e:
+                status_code = e.response.status_code
+                error_detail = e.response.text
+                print(f"Yupp.ai API error ({status_code}): {error_detail}")
+
+                if status_code in [401, 403]:
+                    await run_account_call(invalidate_yupp_account, account)
+                elif status_code in [429, 500, 502, 503, 504]:
+                    await run_account_call(record_yupp_account_error, account)
                 else:
                     # 客户端错误，不尝试使用其他账户
                     raise HTTPException(status_code=status_code, detail=error_detail)
 
-        except Exception as e:
-            print(f"Request error: {e}")
-            with account_rotation_lock:
-                account["error_count"] += 1
+            except Exception as e:
+                print(f"Request error: {e}")
+                await run_account_call(record_yupp_account_error, account)
+
+            finally:
+                if not stream_handed_off:
+                    await run_account_call(release_yupp_account, account)
+                    for failover_account in failover_accounts:
+                        await run_account_call(release_yupp_account, failover_account)
+
+        # 所有尝试都失败
+        raise HTTPException(
+            status_code=503, detail="All attempts to contact Yupp.ai API failed."
+        )
+    finally:
+        if not stream_handed_off:
+            release()
+
+
+def acquire_client_slot(client_key: str) -> Callable[[], None]:
+    """为批量请求或任务占用单密钥的一个速率令牌和并发名额，返回只执行一次的释放函数
+
+    名额在整个批量执行期间保持占用，子请求不再单独计入单密钥限额，
+    同一密钥不能靠拆成多个批量绕过 CLIENT_MAX_CONCURRENT。
+    """
+    limiter = RATE_LIMITER
+    try:
+        limiter.acquire(client_key)
+    except RateLimitExceeded as e:
+        metrics.inc("yupp_client_rate_limited_total", key=mask_key(client_key))
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    return call_once(lambda: limiter.release(client_key))
+
+
+async def run_batch_item(
+    index: int, item: ChatCompletionRequest, client_key: str
+) -> Dict[str, Any]:
+    """执行批量任务中的单个请求，错误作为结果返回而不是抛出"""
+    try:
+        result = await process_chat_completion(
+            item.model_copy(update={"stream": False}),
+            Response(),
+            client_key,
+            rate_limited=False,
+            priority=PRIORITY_BATCH,
+        )
+        return {"index": index, "response": result.model_dump()}
+    except HTTPException as e:
+        return {"index": index, "error": {"status": e.status_code, "message": e.detail}}
+    except Exception as e:
+        print(f"Batch item {index} failed: {e}")
+        return {"index": index, "error": {"status": 500, "message": str(e)}}
+
+
+async def iter_batch_results(
+    items: List[ChatCompletionRequest], client_key: str
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """以有限并发执行批量请求，按完成顺序产出结果"""
+    semaphore = asyncio.Semaphore(max(int(os.getenv("BATCH_CONCURRENCY", "4")), 1))
+
+    async def run(index: int, item: ChatCompletionRequest):
+        async with semaphore:
+            return await run_batch_item(index, item, client_key)
+
+    tasks = [asyncio.create_task(run(i, item)) for i, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # 客户端断开时取消尚未完成的请求
+        for task in tasks:
+            task.cancel()
+
 
-    # 所有尝试都失败
-    raise HTTPException(
-        status_code=503, detail="All attempts to contact Yupp.ai API failed."
+def check_batch_size(count: int):
+    max_requests = int(os.getenv("BATCH_MAX_REQUESTS", "1000"))
+    if count == 0:
+        raise HTTPException(status_code=400, detail="Batch contains no requests.")
+    if count > max_requests:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch contains {count} requests, the limit is {max_requests}.",
+        )
+
+
+@app.post("/v1/chat/completions/batch")
+async def batch_chat_completions(
+    batch: BatchCompletionRequest, client_key: str = Depends(authenticate_client)
+):
+    """批量创建聊天完成，以 NDJSON 按完成顺序流式返回，每行带输入序号"""
+    check_batch_size(len(batch.requests))
+    release = acquire_client_slot(client_key)
+
+    async def ndjson():
+        try:
+            async for result in iter_batch_results(batch.requests, client_key):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        finally:
+            release()
+
+    stream = ndjson()
+    # 响应未开始发送就被丢弃时，生成器的 finally 不会执行
+    weakref.finalize(stream, release)
+    return StreamingResponse(stream, media_type="application/x-ndjson")
+
+
+def batch_job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """批量任务的对外展示字段"""
+    return {key: value for key, value in job.items() if not key.startswith("_")}
+
+
+def prune_batch_jobs():
+    """清理超过保留期限的已完成批量任务"""
+    retention = float(os.getenv("BATCH_RETENTION", "86400"))
+    now = time.time()
+    for job_id in [
+        job_id
+        for job_id, job in BATCH_JOBS.items()
+        if job["completed_at"] and now - job["completed_at"] > retention
+    ]:
+        BATCH_JOBS.pop(job_id, None)
+
+
+def check_active_jobs(client_key: str):
+    """限制每个密钥同时进行的 JSONL 批量任务数"""
+    max_jobs = int(os.getenv("BATCH_MAX_ACTIVE_JOBS", "2"))
+    active = sum(
+        1
+        for job in BATCH_JOBS.values()
+        if job["_owner"] == client_key and job["status"] in ("in_progress", "cancelling")
     )
+    if max_jobs > 0 and active >= max_jobs:
+        metrics.inc("yupp_client_rate_limited_total", key=mask_key(client_key))
+        raise HTTPException(
+            status_code=429,
+            detail=f"{active} batch jobs are already in progress, the limit is {max_jobs}.",
+            headers={"Retry-After": "60"},
+        )
+
+
+async def run_batch_job(job: Dict[str, Any], items: List[ChatCompletionRequest]):
+    """后台执行 JSONL 批量任务，逐条记录结果和进度"""
+    counts = job["request_counts"]
+    custom_ids = job["_custom_ids"]
+    try:
+        async for result in iter_batch_results(items, job["_owner"]):
+            result["custom_id"] = custom_ids[result["index"]]
+            job["_results"].append(json.dumps(result, ensure_ascii=False))
+            counts["failed" if "error" in result else "completed"] += 1
+        job["status"] = "completed"
+    except asyncio.CancelledError:
+        job["status"] = "cancelled"
+        raise
+    except Exception as e:
+        print(f"Batch job {job['id']} failed: {e}")
+        job["status"] = "failed"
+    finally:
+        job["completed_at"] = int(time.time())
+
+
+def settle_batch_job(
+    job: Dict[str, Any], release: Callable[[], None], task: asyncio.Task
+):
+    """任务结束后释放单密钥名额；开始执行前就被取消的任务不会运行 run_batch_job 的 finally"""
+    if job["completed_at"] is None:
+        job["status"] = "cancelled"
+        job["completed_at"] = int(time.time())
+    release()
+
+
+@app.post("/v1/batches")
+async def create_batch(
+    file: UploadFile = File(...), client_key: str = Depends(authenticate_client)
+):
+    """提交 JSONL 批量任务，每行是一个聊天完成请求或 {"custom_id", "body"} 对象"""
+    prune_batch_jobs()
+    check_active_jobs(client_key)
+
+    items: List[ChatCompletionRequest] = []
+    custom_ids: List[Optional[str]] = []
+    for line_no, line in enumerate((await file.read()).splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+            body = data.get("body", data) if isinstance(data, dict) else data
+            items.append(ChatCompletionRequest.model_validate(body))
+            custom_ids.append(data.get("custom_id") if isinstance(data, dict) else None)
+        except Exception as e:
+            raise HTTPException(
+                status_code=400, detail=f"Invalid request on line {line_no}: {e}"
+            )
+    check_batch_size(len(items))
+    release = acquire_client_slot(client_key)
+
+    job = {
+        "id": f"batch_{uuid.uuid4().hex}",
+        "object": "batch",
+        "status": "in_progress",
+        "created_at": int(time.time()),
+        "completed_at": None,
+        "request_counts": {"total": len(items), "completed": 0, "failed": 0},
+        "_owner": client_key,
+        "_custom_ids": custom_ids,
+        "_results": [],
+    }
+    BATCH_JOBS[job["id"]] = job
+    job["_task"] = asyncio.create_task(run_batch_job(job, items))
+    job["_task"].add_done_callback(functools.partial(settle_batch_job, job, release))
+    return batch_job_view(job)
+
+
+def get_batch_job(batch_id: str, client_key: str) -> Dict[str, Any]:
+    job = BATCH_JOBS.get(batch_id)
+    if not job or job["_owner"] != client_key:
+        raise HTTPException(status_code=404, detail=f"Batch '{batch_id}' not found.")
+    return job
+
+
+@app.get("/v1/batches/{batch_id}")
+async def retrieve_batch(batch_id: str, client_key: str = Depends(authenticate_client)):
+    """查询批量任务状态和进度"""
+    return batch_job_view(get_batch_job(batch_id, client_key))
+
+
+@app.get("/v1/batches/{batch_id}/results")
+async def retrieve_batch_results(
+    batch_id: str, client_key: str = Depends(authenticate_client)
+):
+    """获取批量任务已完成部分的结果（JSONL，按完成顺序）"""
+    job = get_batch_job(batch_id, client_key)
+    body = "".join(line + "\n" for line in job["_results"])
+    return Response(content=body, media_type="application/x-ndjson")
+
+
+@app.post("/v1/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str, client_key: str = Depends(authenticate_client)):
+    """取消进行中的批量任务，已完成的结果保留"""
+    job = get_batch_job(batch_id, client_key)
+    if job["status"] == "in_progress":
+        job["status"] = "cancelling"
+        job["_task"].cancel()
+    return batch_job_view(job)
 
 
 def main():
@@ -819,10 +3022,9 @@ def main():
     if not os.getenv("YUPP_TOKENS"):
         print("Warning: YUPP_TOKENS environment variable not set.")
 
-    # 加载配置
+    # 加载配置（模型在 lifespan 中加载，必要时后台获取，不阻塞启动）
     load_client_api_keys()
     load_yupp_accounts()
-    load_yupp_models()
 
     # 显示启动信息
     print("\n--- Yupp.ai OpenAI API Adapter ---")
@@ -830,30 +3032,49 @@ def main():
     print("Endpoints:")
     print("  GET  /v1/models (Client API Key Auth)")
     print("  GET  /models (No Auth)")
+    print("  GET  /healthz, /readyz (No Auth)")
     print("  POST /v1/chat/completions (Client API Key Auth)")
+    print("  POST /v1/chat/completions/batch (Client API Key Auth)")
+    print("  POST /v1/batches, GET /v1/batches/{id}[/results] (Client API Key Auth)")
+    print("  GET  /metrics (Client API Key Auth)")
+    print("  POST /admin/reload (Admin API Key Auth)")
 
     print(f"\nClient API Keys: {len(VALID_CLIENT_KEYS)}")
     if YUPP_ACCOUNTS:
         print(f"Yupp.ai Accounts: {len(YUPP_ACCOUNTS)}")
     else:
         print("Yupp.ai Accounts: None loaded. Check YUPP_TOKENS environment variable.")
-    if YUPP_MODELS:
-        models = sorted([m.get("label", m.get("id", "unknown")) for m in YUPP_MODELS])
-        print(f"Yupp.ai Models: {len(YUPP_MODELS)}")
-        print(
-            f"Available models: {', '.join(models[:5])}{'...' if len(models) > 5 else ''}"
-        )
-    else:
-        model_file = os.getenv("MODEL_FILE", "model.json")
-        print(f"Yupp.ai Models: None loaded. Check {model_file}.")
+    print(f"Model file: {os.getenv('MODEL_FILE', './model/model.json')}")
     print("------------------------------------")
 
     # 启动服务器
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", "8001"))
 
+    grace_period = float(os.getenv("SHUTDOWN_GRACE_PERIOD", "30"))
+
+    class DrainingServer(uvicorn.Server):
+        """收到退出信号时先排空进行中的流，再交给 uvicorn 正常关闭"""
+
+        def handle_exit(self, sig, frame):
+            if DRAINING.is_set() or self.should_exit:
+                # 再次收到信号时立即退出
+                return super().handle_exit(sig, frame)
+            begin_drain()
+
+            def drain_then_exit():
+                wait_for_drain(grace_period)
+                super(DrainingServer, self).handle_exit(sig, frame)
+
+            threading.Thread(target=drain_then_exit, daemon=True).start()
+
     print(f"Starting server on {host}:{port}")
-    uvicorn.run(app, host=host, port=port)
+    server = DrainingServer(
+        uvicorn.Config(
+            app, host=host, port=port, timeout_graceful_shutdown=int(grace_period)
+        )
+    )
+    server.run()
 
 
 if __name__ == "__main__":